@@ -0,0 +1,467 @@
+import asyncio
+import gzip
+import json
+import logging
+import os
+import shutil
+from collections import deque
+from datetime import datetime, timedelta, timezone
+from typing import AsyncIterator, Dict, List, Optional
+
+from sqlalchemy import Select, delete, func, select, text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app import db, models
+from app.export import serialize_row
+from app.metrics import Counter
+from app.pagination import keyset_page
+from app.partitions import (
+    PARTITIONED_TABLES, drop_partition, ensure_partitions, month_label, month_start,
+    next_month, parse_month,
+)
+from app.ws_connection import encode_json
+
+try:
+    import fcntl
+except ImportError:  # sem flock (Windows): rode um único worker com ARCHIVE_ENABLED
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# move para o arquivo os meses inteiros mais antigos que a retenção
+ARCHIVE_ENABLED = os.getenv("ARCHIVE_ENABLED", "false").lower() in ("1", "true", "yes")
+# diretório dos segmentos (compartilhado por todos os workers que servem o histórico)
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", "archive")
+ARCHIVE_RETENTION_DAYS = int(os.getenv("ARCHIVE_RETENTION_DAYS", "365"))
+# intervalo da manutenção (criar partições à frente + arquivar)
+ARCHIVE_INTERVAL_SECONDS = float(os.getenv("ARCHIVE_INTERVAL_SECONDS", "3600"))
+# linhas por lote lido do banco / dos arquivos
+ARCHIVE_BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", "5000"))
+
+# só um worker arquiva por vez: pg_try_advisory_lock no Postgres, flock em ARCHIVE_DIR no resto
+_ARCHIVE_LOCK_ID = 0x63686174
+_ARCHIVE_LOCK_FILE = ".lock"
+
+archived_rows = Counter("chat_archived_rows_total", "Mensagens movidas para o arquivo.", ("table",))
+
+
+def _columns(table: str):
+    if table == "messages":
+        Message = models.Message
+        return Message.room_id, (Message.id, Message.content, Message.user_id,
+                                 Message.room_id, Message.timestamp)
+    DirectMessage = models.DirectMessage
+    return DirectMessage.conversation_id, (DirectMessage.id, DirectMessage.conversation_id,
+                                           DirectMessage.sender_id, DirectMessage.receiver_id,
+                                           DirectMessage.content, DirectMessage.timestamp)
+
+
+def naive_utc(moment: Optional[datetime]) -> Optional[datetime]:
+    """Timestamps são gravados em UTC sem fuso; parâmetros com fuso são convertidos"""
+    if moment is None or moment.tzinfo is None:
+        return moment
+    return moment.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def _row_id(row) -> int:
+    return row["id"] if isinstance(row, dict) else row.id
+
+
+# MARK: - Segmentos
+# {ARCHIVE_DIR}/{tabela}/{AAAA-MM}/{sala ou conversa}.jsonl.gz, uma mensagem por
+# linha em ordem de id, com os mesmos campos da API. O manifest.json do mês lista
+# as chaves com contagem e faixa de ids, e só é gravado (com rename atômico do
+# diretório) depois de todos os arquivos: mês com manifest = mês completo.
+
+
+class _MonthWriter:
+    def __init__(self, root: str, table: str, start: datetime):
+        self.final_dir = os.path.join(root, table, month_label(start))
+        self.tmp_dir = self.final_dir + ".tmp"
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+        os.makedirs(self.tmp_dir)
+        self.manifest = {
+            "table": table,
+            "month": month_label(start),
+            "start": start.isoformat(),
+            "end": next_month(start).isoformat(),
+            "rows": 0,
+            "keys": {},
+        }
+        self._key: Optional[str] = None
+        self._file = None
+
+    def write(self, key_column: str, rows: List[dict]):
+        for row in rows:
+            key = str(row[key_column])
+            if key != self._key:
+                self._close_file()
+                self._key = key
+                self._file = gzip.open(os.path.join(self.tmp_dir, f"{key}.jsonl.gz"), "wt", encoding="utf-8")
+                self.manifest["keys"][key] = {"rows": 0, "min_id": row["id"], "max_id": row["id"]}
+            entry = self.manifest["keys"][key]
+            entry["rows"] += 1
+            entry["max_id"] = row["id"]
+            self.manifest["rows"] += 1
+            self._file.write(encode_json(serialize_row(row)) + "\n")
+
+    def _close_file(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def commit(self) -> dict:
+        self._close_file()
+        with open(os.path.join(self.tmp_dir, "manifest.json"), "w") as manifest:
+            json.dump(self.manifest, manifest)
+        shutil.rmtree(self.final_dir, ignore_errors=True)
+        os.rename(self.tmp_dir, self.final_dir)
+        return self.manifest
+
+    def abort(self):
+        self._close_file()
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+
+def _read_latest(path: str, before: Optional[int], count: int) -> List[dict]:
+    """As `count` linhas de maior id abaixo de `before` (ordem crescente)"""
+    newest = deque(maxlen=count)
+    with gzip.open(path, "rt", encoding="utf-8") as segment:
+        for line in segment:
+            row = json.loads(line)
+            if before is not None and row["id"] >= before:
+                break
+            newest.append(row)
+    return list(newest)
+
+
+def _read_earliest(path: str, after: int, count: int) -> List[dict]:
+    rows = []
+    with gzip.open(path, "rt", encoding="utf-8") as segment:
+        for line in segment:
+            row = json.loads(line)
+            if row["id"] > after:
+                rows.append(row)
+                if len(rows) >= count:
+                    break
+    return rows
+
+
+def _read_batch(segment, size: int) -> List[str]:
+    lines = []
+    for line in segment:
+        lines.append(line)
+        if len(lines) >= size:
+            break
+    return lines
+
+
+class MessageArchive:
+    def __init__(self, root: str = ARCHIVE_DIR):
+        self.root = root
+        # tabela -> (mtime do diretório, {mês: manifest})
+        self._manifests: Dict[str, tuple] = {}
+
+    def manifests(self, table: str) -> Dict[str, dict]:
+        """Meses arquivados da tabela, em ordem; relido quando outro processo arquiva"""
+        table_dir = os.path.join(self.root, table)
+        try:
+            mtime = os.stat(table_dir).st_mtime
+        except FileNotFoundError:
+            return {}
+        cached = self._manifests.get(table)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+        months = {}
+        for name in sorted(os.listdir(table_dir)):
+            path = os.path.join(table_dir, name, "manifest.json")
+            if not name.endswith(".tmp") and os.path.exists(path):
+                with open(path) as manifest:
+                    months[name] = json.load(manifest)
+        self._manifests[table] = (mtime, months)
+        return months
+
+    def has_month(self, table: str, start: datetime) -> bool:
+        return month_label(start) in self.manifests(table)
+
+    def watermark(self, table: str) -> Optional[datetime]:
+        """Fim do último mês arquivado: antes disso, as mensagens só existem no arquivo"""
+        months = self.manifests(table)
+        if not months:
+            return None
+        return next_month(parse_month(next(reversed(months))))
+
+    def _segments(self, table: str, key: int) -> List[tuple]:
+        """(caminho, entrada do manifest) de cada mês com mensagens da chave, em ordem"""
+        segments = []
+        for month, manifest in self.manifests(table).items():
+            entry = manifest["keys"].get(str(key))
+            if entry is not None:
+                segments.append((os.path.join(self.root, table, month, f"{key}.jsonl.gz"), entry))
+        return segments
+
+    def has(self, table: str, key: int) -> bool:
+        return bool(self._segments(table, key))
+
+    async def latest(self, table: str, key: int, before: Optional[int], count: int) -> List[dict]:
+        """As `count` mensagens arquivadas mais novas com id < before, em ordem crescente"""
+        rows: List[dict] = []
+        for path, entry in reversed(self._segments(table, key)):
+            if len(rows) >= count:
+                break
+            if before is not None and entry["min_id"] >= before:
+                continue
+            rows = await asyncio.to_thread(_read_latest, path, before, count - len(rows)) + rows
+        return rows
+
+    async def earliest(self, table: str, key: int, after: int, count: int) -> List[dict]:
+        """As `count` primeiras mensagens arquivadas com id > after"""
+        rows: List[dict] = []
+        for path, entry in self._segments(table, key):
+            if len(rows) >= count:
+                break
+            if entry["max_id"] <= after:
+                continue
+            rows += await asyncio.to_thread(_read_earliest, path, after, count - len(rows))
+        return rows
+
+    async def batches(self, table: str, key: int, since: Optional[datetime] = None,
+                      until: Optional[datetime] = None) -> AsyncIterator[List[dict]]:
+        """Lotes de mensagens arquivadas da chave entre since (inclusivo) e until (exclusivo)"""
+        since_text = since.isoformat() if since else None
+        until_text = until.isoformat() if until else None
+        for month, manifest in self.manifests(table).items():
+            if str(key) not in manifest["keys"]:
+                continue
+            if (since and next_month(parse_month(month)) <= since) or (until and parse_month(month) >= until):
+                continue
+            path = os.path.join(self.root, table, month, f"{key}.jsonl.gz")
+            segment = await asyncio.to_thread(gzip.open, path, "rt", encoding="utf-8")
+            try:
+                while True:
+                    lines = await asyncio.to_thread(_read_batch, segment, ARCHIVE_BATCH_SIZE)
+                    if not lines:
+                        break
+                    batch = [json.loads(line) for line in lines]
+                    # timestamps ISO de mesmo formato comparam como texto
+                    batch = [row for row in batch
+                             if (since_text is None or row["timestamp"] >= since_text)
+                             and (until_text is None or row["timestamp"] < until_text)]
+                    if batch:
+                        yield batch
+            finally:
+                segment.close()
+
+
+archive = MessageArchive()
+
+
+# MARK: - Leitura transparente
+# Histórico e export consultam o banco e, quando a faixa pedida passa do que
+# ainda está nele, completam com os segmentos arquivados da mesma sala/conversa.
+
+async def archive_page(
+    session: AsyncSession,
+    query: Select,
+    id_column,
+    table: str,
+    key: Optional[int],
+    before: Optional[int],
+    after: Optional[int],
+    limit: int,
+):
+    """keyset_page sobre banco + arquivo (mesma semântica de cursores)"""
+    rows, next_cursor = await keyset_page(session, query, id_column, before, after, limit)
+    if key is None or not archive.has(table, key):
+        return rows, next_cursor
+
+    if after is not None:
+        # avançando: o que está arquivado vem antes do que está no banco
+        archived = await archive.earliest(table, key, after, limit + 1)
+        if not archived:
+            return rows, next_cursor
+        archived_ids = {row["id"] for row in archived}
+        combined = archived + [row for row in rows if _row_id(row) not in archived_ids]
+        if len(combined) > limit or next_cursor is not None:
+            page = combined[:limit]
+            return page, _row_id(page[-1])
+        return combined, None
+
+    if next_cursor is not None:
+        # página cheia só com o banco
+        return rows, next_cursor
+    # o banco acabou antes de `limit`: completa com as mais novas do arquivo
+    missing = limit - len(rows)
+    older_than = _row_id(rows[0]) if rows else before
+    archived = await archive.latest(table, key, older_than, missing + 1)
+    has_more = len(archived) > missing
+    page = (archived[max(0, len(archived) - missing):] if missing else []) + list(rows)
+    return page, (_row_id(page[0]) if has_more and page else None)
+
+
+def database_since(table: str, since: Optional[datetime]) -> Optional[datetime]:
+    """Início da faixa a pedir ao banco: o que é anterior à marca d'água vem do arquivo"""
+    watermark = archive.watermark(table)
+    if watermark is None or (since is not None and since >= watermark):
+        return since
+    return watermark
+
+
+async def read_through(table: str, key: Optional[int], since: Optional[datetime],
+                       until: Optional[datetime],
+                       database_batches: AsyncIterator[List[dict]]) -> AsyncIterator[List[dict]]:
+    """Lotes do arquivo (parte antiga da faixa) seguidos dos lotes do banco"""
+    watermark = archive.watermark(table)
+    if key is not None and watermark is not None and (since is None or since < watermark):
+        archive_until = watermark if until is None else min(until, watermark)
+        async for batch in archive.batches(table, key, since, archive_until):
+            yield batch
+    async for batch in database_batches:
+        yield batch
+
+
+# MARK: - Arquivamento
+
+class Archiver:
+    """Task de manutenção: cria partições à frente e arquiva meses fora da retenção.
+
+    O mês é lido do banco em ordem (chave, id) e gravado nos segmentos; só depois
+    do manifest a partição é removida (ou as linhas apagadas, no SQLite). Se o
+    processo cair no meio, o mês é refeito ou só a remoção é repetida.
+    """
+
+    def __init__(self, interval: float = ARCHIVE_INTERVAL_SECONDS,
+                 retention_days: int = ARCHIVE_RETENTION_DAYS,
+                 enabled: bool = ARCHIVE_ENABLED):
+        self.interval = interval
+        self.retention = timedelta(days=retention_days)
+        self.enabled = enabled
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                await self.run_once()
+            except Exception:
+                logger.exception("Falha na manutenção das partições / arquivamento")
+            await asyncio.sleep(self.interval)
+
+    async def run_once(self, now: Optional[datetime] = None) -> List[str]:
+        """Uma passada; devolve os meses arquivados ("tabela/AAAA-MM")"""
+        now = now or datetime.utcnow()
+        async with db.get_engine().connect() as lock_connection:
+            postgres = lock_connection.dialect.name == "postgresql"
+            lock_file = None
+            if postgres:
+                if not await lock_connection.scalar(
+                        text("SELECT pg_try_advisory_lock(:id)"), {"id": _ARCHIVE_LOCK_ID}):
+                    return []
+            else:
+                # sem partições para criar: fora do Postgres só há trabalho com o arquivamento ligado
+                if not self.enabled:
+                    return []
+                # workers do mesmo host gravariam o mesmo {mês}.tmp e apagariam o trabalho uns dos outros
+                lock_file = await asyncio.to_thread(
+                    _try_lock_file, os.path.join(archive.root, _ARCHIVE_LOCK_FILE))
+                if lock_file is None:
+                    return []
+            try:
+                async with db.get_engine().begin() as connection:
+                    await connection.run_sync(ensure_partitions, now)
+                if not self.enabled:
+                    return []
+                return await self._archive_expired(month_start(now - self.retention))
+            finally:
+                if postgres:
+                    await lock_connection.execute(
+                        text("SELECT pg_advisory_unlock(:id)"), {"id": _ARCHIVE_LOCK_ID})
+                else:
+                    _unlock_file(lock_file)
+
+    async def _archive_expired(self, cutoff: datetime) -> List[str]:
+        done = []
+        for table in PARTITIONED_TABLES:
+            model_table = models.Base.metadata.tables[table]
+            async with db.SessionLocal() as session:
+                oldest = await session.scalar(select(func.min(model_table.c.timestamp)))
+            if oldest is None:
+                continue
+            start = month_start(oldest)
+            while start < cutoff:
+                await self.archive_month(table, start)
+                done.append(f"{table}/{month_label(start)}")
+                start = next_month(start)
+        return done
+
+    async def archive_month(self, table: str, start: datetime):
+        end = next_month(start)
+        model_table = models.Base.metadata.tables[table]
+        key_column, columns = _columns(table)
+        if not archive.has_month(table, start):
+            writer = await asyncio.to_thread(_MonthWriter, archive.root, table, start)
+            try:
+                async with db.SessionLocal() as session:
+                    result = await session.stream(
+                        select(*columns)
+                        .where(model_table.c.timestamp >= start, model_table.c.timestamp < end)
+                        .order_by(key_column, model_table.c.id)
+                        .execution_options(yield_per=ARCHIVE_BATCH_SIZE))
+                    async for partition in result.mappings().partitions():
+                        await asyncio.to_thread(writer.write, key_column.name, [dict(row) for row in partition])
+                manifest = await asyncio.to_thread(writer.commit)
+            except BaseException:
+                await asyncio.to_thread(writer.abort)
+                raise
+            archived_rows.inc(manifest["rows"], table)
+            logger.info("Arquivado %s/%s: %s mensagens", table, month_label(start), manifest["rows"])
+
+        # remove do banco: a partição inteira no Postgres; DELETE por faixa no resto
+        async with db.get_engine().begin() as connection:
+            await connection.run_sync(drop_partition, table, start)
+            await connection.execute(
+                delete(model_table).where(model_table.c.timestamp >= start, model_table.c.timestamp < end))
+
+
+def _try_lock_file(path: str) -> Optional[int]:
+    """flock exclusivo sem espera; None se outro processo já tem o lock"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    descriptor = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+    if fcntl is None:
+        return descriptor
+    try:
+        fcntl.flock(descriptor, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        os.close(descriptor)
+        return None
+    return descriptor
+
+
+def _unlock_file(descriptor: int):
+    if fcntl is not None:
+        fcntl.flock(descriptor, fcntl.LOCK_UN)
+    os.close(descriptor)
+
+
+archiver = Archiver()
+
+
+if __name__ == "__main__":
+    # uma passada manual (ex.: cron): python -m app.archive
+    async def _main():
+        try:
+            for month in await Archiver(enabled=True).run_once():
+                print(month)
+        finally:
+            await db.dispose_engines()
+
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(_main())
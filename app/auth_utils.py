@@ -2,36 +2,145 @@ from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 from jose import JWTError, jwt
 from app import models, db
-from sqlalchemy.orm import Session
+from app.broker import broker
+from app.metrics import Counter, Gauge
+from collections import OrderedDict
+from sqlalchemy import event, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import make_transient_to_detached
+from typing import Dict, Optional, Set, Tuple
+import asyncio
 import os
+import time
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="auth/login")
 
 SECRET_KEY = os.getenv("SECRET_KEY", "supersecret")
 ALGORITHM = "HS256"
 
+# quanto tempo um usuário autenticado fica em cache (nunca além do exp do token)
+AUTH_CACHE_TTL_SECONDS = int(os.getenv("AUTH_CACHE_TTL_SECONDS", "300"))
+AUTH_CACHE_SIZE = int(os.getenv("AUTH_CACHE_SIZE", "10000"))
+INVALIDATION_CHANNEL = "auth:invalidate"
 
-def get_db():
-    database = db.SessionLocal()
-    try:
+auth_cache_requests = Counter(
+    "chat_auth_cache_requests_total", "Tokens resolvidos pelo cache de usuários autenticados.", ("result",))
+auth_cache_size = Gauge("chat_auth_cache_entries", "Tokens no cache de usuários autenticados.")
+
+
+async def get_db():
+    async with db.SessionLocal() as database:
         yield database
-    finally:
-        database.close()
 
 
-def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+# MARK: - Principal cache
+
+class PrincipalCache:
+    """Cache TTL/LRU de usuários já autenticados, indexado pelo token"""
+
+    def __init__(self, max_size: int = AUTH_CACHE_SIZE, ttl: int = AUTH_CACHE_TTL_SECONDS):
+        self.max_size = max_size
+        self.ttl = ttl
+        # token -> (expira_em, usuário)
+        self.entries: "OrderedDict[str, Tuple[float, models.User]]" = OrderedDict()
+        # user_id -> tokens em cache, para invalidar por usuário
+        self.tokens_by_user: Dict[int, Set[str]] = {}
+        self._subscribed = False
+
+    def get(self, token: str) -> Optional[models.User]:
+        entry = self.entries.get(token)
+        if entry is None:
+            auth_cache_requests.inc(1, "miss")
+            return None
+        expires_at, user = entry
+        if expires_at <= time.time():
+            self._remove(token)
+            auth_cache_requests.inc(1, "miss")
+            return None
+        self.entries.move_to_end(token)
+        auth_cache_requests.inc(1, "hit")
+        return user
+
+    def put(self, token: str, user: models.User, exp: Optional[float]):
+        expires_at = time.time() + self.ttl
+        if exp is not None:
+            expires_at = min(expires_at, float(exp))
+        self.entries[token] = (expires_at, _detached_copy(user))
+        self.entries.move_to_end(token)
+        self.tokens_by_user.setdefault(user.id, set()).add(token)
+        while len(self.entries) > self.max_size:
+            self._remove(next(iter(self.entries)))
+
+    def invalidate_user(self, user_id: int):
+        for token in self.tokens_by_user.pop(user_id, set()):
+            self.entries.pop(token, None)
+
+    def clear(self):
+        self.entries.clear()
+        self.tokens_by_user.clear()
+
+    def _remove(self, token: str):
+        entry = self.entries.pop(token, None)
+        if entry is None:
+            return
+        tokens = self.tokens_by_user.get(entry[1].id)
+        if tokens is not None:
+            tokens.discard(token)
+            if not tokens:
+                del self.tokens_by_user[entry[1].id]
+
+    async def ensure_subscribed(self):
+        if not self._subscribed:
+            self._subscribed = True
+            await broker.subscribe(INVALIDATION_CHANNEL, self._on_invalidate)
+
+    async def _on_invalidate(self, message: dict):
+        self.invalidate_user(message["user_id"])
+
+
+def _detached_copy(user: models.User) -> models.User:
+    # cópia desanexada: pode ser compartilhada entre requisições/sessões
+    copy = models.User(id=user.id, username=user.username,
+                       hashed_password=user.hashed_password)
+    make_transient_to_detached(copy)
+    return copy
+
+
+principal_cache = PrincipalCache()
+auth_cache_size.set_function(lambda: len(principal_cache.entries))
+
+
+@event.listens_for(models.User, "after_update")
+@event.listens_for(models.User, "after_delete")
+def _invalidate_principal(mapper, connection, target):
+    # usuário renomeado ou removido: derruba os tokens dele aqui e nos outros workers
+    principal_cache.invalidate_user(target.id)
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        return
+    loop.create_task(broker.publish(INVALIDATION_CHANNEL, {"user_id": target.id}))
+
+
+# MARK: - Dependencies
+
+async def get_current_user(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_db)):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Não foi possível validar as credenciais.",
         headers={"WWW-Authenticate": "Bearer"},
     )
 
-    user = verify_token(token=token, db=db)
+    user = await verify_token(token=token, db=db)
     if user is None:
         raise credentials_exception
     return user
 
-def verify_token(token: str, db: Session): 
+async def verify_token(token: str, db: AsyncSession): 
+    cached = principal_cache.get(token)
+    if cached is not None:
+        return cached
+
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         username: str = payload.get("sub")
@@ -40,6 +149,9 @@ def verify_token(token: str, db: Session):
     except JWTError:
         return None
 
-    user = db.query(models.User).filter(
-        models.User.username == username).first()
-    return user
\ No newline at end of file
+    await principal_cache.ensure_subscribed()
+    user = await db.scalar(select(models.User).where(
+        models.User.username == username))
+    if user is not None:
+        principal_cache.put(token, user, payload.get("exp"))
+    return user
@@ -0,0 +1,122 @@
+import asyncio
+import json
+import logging
+import os
+from typing import Awaitable, Callable, Dict, Optional
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+REDIS_URL = os.getenv("REDIS_URL")
+# "redis" ou "memory"; sem REDIS_URL o padrão é o backend em memória
+BROKER_BACKEND = os.getenv("BROKER_BACKEND", "redis" if REDIS_URL else "memory")
+
+Handler = Callable[[dict], Awaitable[None]]
+
+
+class Broker:
+    """Interface comum dos backends de pub/sub (um handler por canal, por processo)"""
+
+    def __init__(self):
+        self.handlers: Dict[str, Handler] = {}
+
+    async def publish(self, channel: str, message: dict):
+        raise NotImplementedError
+
+    async def subscribe(self, channel: str, handler: Handler):
+        self.handlers[channel] = handler
+
+    async def unsubscribe(self, channel: str):
+        self.handlers.pop(channel, None)
+
+    async def close(self):
+        self.handlers.clear()
+
+    async def ping(self):
+        """Levanta exceção se o backend não estiver acessível (usado pelo /ready)"""
+
+    async def _dispatch(self, channel: str, message: dict):
+        handler = self.handlers.get(channel)
+        if handler is None:
+            return
+        try:
+            await handler(message)
+        except Exception:
+            logger.exception("Erro ao entregar mensagem do canal %s", channel)
+
+
+class InMemoryBroker(Broker):
+    """Entrega local, dentro do próprio processo (testes / um único worker)"""
+
+    async def publish(self, channel: str, message: dict):
+        await self._dispatch(channel, message)
+
+
+class RedisBroker(Broker):
+    """Pub/sub via Redis: cada worker assina só os canais com sockets locais"""
+
+    def __init__(self, url: str):
+        super().__init__()
+        import redis.asyncio as redis
+
+        self.redis = redis.from_url(url)
+        self.pubsub = self.redis.pubsub()
+        self._listener: Optional[asyncio.Task] = None
+
+    async def publish(self, channel: str, message: dict):
+        await self.redis.publish(channel, json.dumps(message))
+
+    async def subscribe(self, channel: str, handler: Handler):
+        await super().subscribe(channel, handler)
+        await self.pubsub.subscribe(channel)
+        if self._listener is None or self._listener.done():
+            self._listener = asyncio.create_task(self._listen())
+
+    async def unsubscribe(self, channel: str):
+        await super().unsubscribe(channel)
+        await self.pubsub.unsubscribe(channel)
+
+    async def ping(self):
+        await self.redis.ping()
+
+    async def close(self):
+        await super().close()
+        if self._listener is not None:
+            self._listener.cancel()
+            self._listener = None
+        await self.pubsub.aclose()
+        await self.redis.aclose()
+
+    async def _listen(self):
+        while True:
+            try:
+                if not self.pubsub.subscribed:
+                    await asyncio.sleep(0.1)
+                    continue
+                raw = await self.pubsub.get_message(
+                    ignore_subscribe_messages=True, timeout=1.0)
+                if raw is None:
+                    continue
+                channel = raw["channel"]
+                if isinstance(channel, bytes):
+                    channel = channel.decode()
+                await self._dispatch(channel, json.loads(raw["data"]))
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Erro no listener do Redis; tentando novamente")
+                await asyncio.sleep(1)
+
+
+def get_broker() -> Broker:
+    if BROKER_BACKEND == "redis":
+        return RedisBroker(REDIS_URL or "redis://localhost:6379/0")
+    if BROKER_BACKEND == "memory":
+        return InMemoryBroker()
+    raise ValueError(f"BROKER_BACKEND inválido: {BROKER_BACKEND}")
+
+
+broker = get_broker()
@@ -1,29 +1,73 @@
+import time
+
 from fastapi import WebSocket, WebSocketDisconnect
+from functools import partial
 from typing import Dict, List
 from app.models import Message
+from app.broker import broker
+from app.metrics import ws_broadcast_duration, ws_connections, ws_send_queue_depth
+from app.ws_connection import Connection, Frame, negotiate_format
+from app.ws_coalesce import WS_COALESCE, FrameCoalescer
 
 class ConnectionManager:
     def __init__(self):
-        self.active_connections: Dict[int, List[WebSocket]] = {}
+        self.active_connections: Dict[int, List[Connection]] = {}
+        # opcional: salas movimentadas recebem várias mensagens por frame
+        self.coalescer = FrameCoalescer(self._fanout) if WS_COALESCE else None
+
+    def _channel(self, room_id: int) -> str:
+        return f"room:{room_id}"
 
-    async def connect(self, room_id: int, websocket: WebSocket):
-        await websocket.accept()
+    async def connect(self, room_id: int, websocket: WebSocket, hold: bool = False) -> Connection:
+        fmt = negotiate_format(websocket)
+        await websocket.accept(subprotocol=fmt)
+        await websocket.send_text(f"Conectado à sala {room_id}!")
 
+        connection = Connection(websocket, fmt, hold=hold)
         if room_id not in self.active_connections:
             self.active_connections[room_id] = []
+            # primeiro socket local da sala: passa a ouvir o canal dela
+            await broker.subscribe(self._channel(room_id), partial(self.deliver, room_id))
 
-        self.active_connections[room_id].append(websocket)
-        await websocket.send_text(f"Conectado à sala {room_id}!")
+        self.active_connections[room_id].append(connection)
+        return connection
 
-    def disconnect(self, room_id: int, websocket: WebSocket):
-        self.active_connections[room_id].remove(websocket)
+    async def disconnect(self, room_id: int, websocket: WebSocket):
+        connections = self.active_connections.get(room_id)
+        if connections is None:
+            return
+        for connection in connections:
+            if connection.websocket is websocket:
+                connection.stop()
+                connections.remove(connection)
+                break
+        if not connections:
+            del self.active_connections[room_id]
+            if self.coalescer is not None:
+                self.coalescer.discard(room_id)
+            await broker.unsubscribe(self._channel(room_id))
 
     async def broadcast(self, room_id: int, message: Message):
-        """Envia JSON para todos na sala"""
-        if room_id in self.active_connections:
-            message_dict = self.message_to_dict(message=message)
-            for connection in self.active_connections[room_id]:
-                await connection.send_json(message_dict)
+        """Publica a mensagem no canal da sala (todos os workers recebem)"""
+        await broker.publish(self._channel(room_id), self.message_to_dict(message=message))
+
+    async def deliver(self, room_id: int, message_dict: dict):
+        """Entrega local: na hora ou, com WS_COALESCE, em lotes nas salas movimentadas"""
+        if self.coalescer is not None:
+            self.coalescer.add(room_id, message_dict)
+        else:
+            self._fanout(room_id, message_dict)
+
+    def _fanout(self, room_id: int, payload):
+        """Enfileira o mesmo Frame (serializado uma vez por formato) para todos os sockets locais da sala"""
+        started = time.perf_counter()
+        frame = Frame(payload)
+        depth = 0
+        for connection in list(self.active_connections.get(room_id, [])):
+            connection.enqueue(frame)
+            depth = max(depth, connection.queue.qsize())
+        ws_broadcast_duration.observe(time.perf_counter() - started, "room")
+        ws_send_queue_depth.observe(depth, "room")
 
     def message_to_dict(self, message: Message):
         return {
@@ -34,4 +78,8 @@ class ConnectionManager:
             "timestamp": message.timestamp.isoformat()  # datetime -> string
         }
 
-manager = ConnectionManager()
\ No newline at end of file
+    def socket_count(self) -> int:
+        return sum(len(connections) for connections in self.active_connections.values())
+
+manager = ConnectionManager()
+ws_connections.set_function(manager.socket_count, "room")
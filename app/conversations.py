@@ -0,0 +1,54 @@
+from typing import Dict, Sequence, Tuple
+
+from sqlalchemy import or_, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app import models
+
+
+def user_pair(user_id: int, other_user_id: int) -> Tuple[int, int]:
+    """Chave da conversa: o par ordenado (menor id, maior id)"""
+    return (min(user_id, other_user_id), max(user_id, other_user_id))
+
+
+async def find_conversation(db: AsyncSession, user_id: int, other_user_id: int):
+    user_a_id, user_b_id = user_pair(user_id, other_user_id)
+    return await db.scalar(select(models.Conversation).filter_by(
+        user_a_id=user_a_id, user_b_id=user_b_id))
+
+
+async def get_or_create_conversation(db: AsyncSession, user_id: int, other_user_id: int) -> models.Conversation:
+    conversation = await find_conversation(db, user_id, other_user_id)
+    if conversation is not None:
+        return conversation
+
+    user_a_id, user_b_id = user_pair(user_id, other_user_id)
+    conversation = models.Conversation(user_a_id=user_a_id, user_b_id=user_b_id)
+    try:
+        async with db.begin_nested():
+            db.add(conversation)
+    except IntegrityError:
+        # outra requisição criou a mesma conversa ao mesmo tempo
+        conversation = await find_conversation(db, user_id, other_user_id)
+    return conversation
+
+
+async def update_summaries(db: AsyncSession, messages: Sequence[models.DirectMessage]):
+    """Aponta o resumo de cada conversa para a mensagem mais nova (sem regredir)"""
+    latest: Dict[int, models.DirectMessage] = {}
+    for message in messages:
+        current = latest.get(message.conversation_id)
+        if current is None or message.id > current.id:
+            latest[message.conversation_id] = message
+
+    for conversation_id, message in latest.items():
+        await db.execute(
+            update(models.Conversation)
+            .where(
+                models.Conversation.id == conversation_id,
+                or_(models.Conversation.last_message_id.is_(None),
+                    models.Conversation.last_message_id < message.id),
+            )
+            .values(last_message_id=message.id, last_message_at=message.timestamp)
+        )
@@ -1,21 +1,220 @@
-from sqlalchemy import create_engine
-from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.orm import Session, declarative_base
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from starlette.requests import HTTPConnection
+from collections import OrderedDict
+from contextvars import ContextVar
+from typing import List, Optional
+import itertools
 import os
+import time
 from dotenv import load_dotenv
 
+from app.metrics import METRICS_ENABLED, Gauge, Histogram, instrument_engine
+
 load_dotenv()
 
 DATABASE_URL = os.getenv("DATABASE_URL")
+# réplicas de leitura, separadas por vírgula (vazio = tudo no primário)
+DATABASE_REPLICA_URLS = [url.strip() for url in os.getenv("DATABASE_REPLICA_URLS", "").split(",") if url.strip()]
+
+# pool de conexões (ignorado no SQLite, que abre uma conexão por sessão)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+# segundos até reciclar uma conexão (-1 = nunca)
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "-1"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "false").lower() in ("1", "true", "yes")
+# depois de um commit, as leituras do mesmo cliente ficam no primário por esse tempo
+DB_READ_YOUR_WRITES_SECONDS = float(os.getenv("DB_READ_YOUR_WRITES_SECONDS", "5"))
+# create_all na inicialização; em produção o schema vem das migrações (alembic upgrade head)
+DB_CREATE_ALL = os.getenv(
+    "DB_CREATE_ALL", "true" if (DATABASE_URL or "").startswith("sqlite") else "false"
+).lower() in ("1", "true", "yes")
+
+# driver síncrono -> driver assíncrono equivalente
+ASYNC_DRIVERS = {
+    "postgresql+psycopg2://": "postgresql+asyncpg://",
+    "postgresql://": "postgresql+asyncpg://",
+    "sqlite://": "sqlite+aiosqlite://",
+}
+
+
+def to_async_url(url: str) -> str:
+    for sync_prefix, async_prefix in ASYNC_DRIVERS.items():
+        if url.startswith(sync_prefix):
+            return async_prefix + url[len(sync_prefix):]
+    return url
+
+
+# MARK: - Pool
+
+pool_checkout_wait = Histogram(
+    "chat_db_pool_checkout_wait_seconds", "Espera para obter uma conexão do pool.", ("pool",),
+    (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 30.0))
+pool_checked_out = Gauge(
+    "chat_db_pool_checked_out", "Conexões emprestadas pelo pool no momento.", ("pool",))
+
+
+class TimedQueuePool(AsyncAdaptedQueuePool):
+    """QueuePool que mede quanto tempo cada checkout esperou por uma conexão livre"""
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            pool_checkout_wait.observe(time.perf_counter() - started, self._orig_logging_name)
+
+
+def make_engine(url: str, name: str):
+    url = to_async_url(url)
+    options = {"pool_pre_ping": DB_POOL_PRE_PING, "pool_recycle": DB_POOL_RECYCLE}
+    if not url.startswith("sqlite"):
+        options.update(
+            poolclass=TimedQueuePool,
+            pool_logging_name=name,
+            pool_size=DB_POOL_SIZE,
+            max_overflow=DB_MAX_OVERFLOW,
+            pool_timeout=DB_POOL_TIMEOUT,
+        )
+    new_engine = create_async_engine(url, **options)
+    if METRICS_ENABLED:
+        instrument_engine(new_engine)
+    pool = new_engine.sync_engine.pool
+    if hasattr(pool, "checkedout"):
+        pool_checked_out.set_function(lambda: new_engine.sync_engine.pool.checkedout(), name)
+    return new_engine
+
 
-engine = create_engine(DATABASE_URL)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
 
-def get_db():
-    db = SessionLocal()
-    try:
+# MARK: - Engines
+# Criados no primeiro uso, não no import: importar a aplicação (testes, --reload,
+# workers novos) não abre conexão nem exige o banco no ar.
+
+_engine: Optional[AsyncEngine] = None
+_sessionmaker: Optional[async_sessionmaker] = None
+_replica_engines: Optional[List[AsyncEngine]] = None
+_next_replica = None
+
+
+def get_engine() -> AsyncEngine:
+    global _engine, _sessionmaker
+    if _engine is None:
+        if not DATABASE_URL:
+            raise RuntimeError("DATABASE_URL não configurada")
+        _engine = make_engine(DATABASE_URL, "primary")
+        # expire_on_commit=False: objetos continuam legíveis depois do commit sem novo I/O
+        _sessionmaker = async_sessionmaker(
+            bind=_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
+    return _engine
+
+
+def get_replica_engines() -> List[AsyncEngine]:
+    global _replica_engines, _next_replica
+    if _replica_engines is None:
+        _replica_engines = [make_engine(url, f"replica{index}") for index, url in enumerate(DATABASE_REPLICA_URLS)]
+        sessionmakers = [
+            async_sessionmaker(bind=replica, class_=AsyncSession, autoflush=False, expire_on_commit=False)
+            for replica in _replica_engines
+        ]
+        _next_replica = itertools.cycle(sessionmakers) if sessionmakers else None
+    return _replica_engines
+
+
+def SessionLocal() -> AsyncSession:
+    """Nova sessão no primário"""
+    get_engine()
+    return _sessionmaker()
+
+
+async def dispose_engines():
+    """Fecha os pools (desligamento); o próximo uso recria os engines"""
+    global _engine, _sessionmaker, _replica_engines, _next_replica
+    for created in ([_engine] if _engine else []) + (_replica_engines or []):
+        await created.dispose()
+    _engine = _sessionmaker = _replica_engines = _next_replica = None
+
+
+def __getattr__(name: str):
+    # app.db.engine / app.db.replica_engines continuam disponíveis, construídos sob demanda
+    if name == "engine":
+        return get_engine()
+    if name == "replica_engines":
+        return get_replica_engines()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+# MARK: - Read-your-writes
+# Réplicas atrasam alguns milissegundos: quem acabou de gravar volta a ler do
+# primário até DB_READ_YOUR_WRITES_SECONDS depois do último commit. O cliente é
+# identificado pelo header Authorization (ou pelo IP). A marcação é por processo.
+
+_READ_YOUR_WRITES_MAX_CLIENTS = 100_000
+_recent_writers: "OrderedDict[str, float]" = OrderedDict()
+_client_key: ContextVar[Optional[str]] = ContextVar("db_client_key", default=None)
+
+
+def _connection_key(connection: HTTPConnection) -> Optional[str]:
+    authorization = connection.headers.get("authorization")
+    if authorization:
+        return authorization
+    return connection.client.host if connection.client else None
+
+
+def note_commit():
+    """Marca o cliente da requisição atual como recém-gravado"""
+    key = _client_key.get()
+    if key is None or not DATABASE_REPLICA_URLS:
+        return
+    _recent_writers[key] = time.monotonic() + DB_READ_YOUR_WRITES_SECONDS
+    _recent_writers.move_to_end(key)
+    while len(_recent_writers) > _READ_YOUR_WRITES_MAX_CLIENTS:
+        _recent_writers.popitem(last=False)
+
+
+def _wrote_recently(key: Optional[str]) -> bool:
+    if key is None:
+        return False
+    until = _recent_writers.get(key)
+    if until is None:
+        return False
+    if until < time.monotonic():
+        del _recent_writers[key]
+        return False
+    return True
+
+
+@event.listens_for(Session, "after_commit")
+def _after_commit(session):
+    # sessões das réplicas não gravam; só commits no primário contam
+    if _engine is not None and session.bind is _engine.sync_engine:
+        note_commit()
+
+
+# MARK: - Dependências
+
+async def get_db(connection: HTTPConnection):
+    """Sessão no primário (escritas e leituras que precisam do dado mais recente)"""
+    _client_key.set(_connection_key(connection))
+    async with SessionLocal() as db:
+        yield db
+
+
+def read_session(connection: HTTPConnection) -> AsyncSession:
+    """Nova sessão somente leitura: réplica em round-robin, ou o primário logo após um commit"""
+    key = _connection_key(connection)
+    _client_key.set(key)
+    if DATABASE_REPLICA_URLS and not _wrote_recently(key):
+        get_replica_engines()
+        return next(_next_replica)()
+    return SessionLocal()
+
+
+async def get_read_db(connection: HTTPConnection):
+    """Dependência com a sessão de read_session"""
+    async with read_session(connection) as db:
         yield db
-    finally:
-        db.close()
@@ -1,37 +1,72 @@
+import time
+
 from fastapi import WebSocket, WebSocketDisconnect
+from functools import partial
 from typing import Dict, List
 from app.models import DirectMessage
+from app.broker import broker
+from app.metrics import ws_broadcast_duration, ws_connections, ws_send_queue_depth
+from app.ws_connection import Connection, Frame, negotiate_format
 
 
 class DMConnectionManager:
     def __init__(self):
-        # user_id -> lista de websockets conectados
-        self.active_connections: Dict[int, List[WebSocket]] = {}
+        # user_id -> lista de conexões ativas
+        self.active_connections: Dict[int, List[Connection]] = {}
+
+    def _channel(self, user_id: int) -> str:
+        return f"dm:{user_id}"
 
-    async def connect(self, user_id: int, websocket: WebSocket):
-        await websocket.accept()
+    async def connect(self, user_id: int, websocket: WebSocket, hold: bool = False) -> Connection:
+        fmt = negotiate_format(websocket)
+        await websocket.accept(subprotocol=fmt)
+        connection = Connection(websocket, fmt, hold=hold)
         if user_id not in self.active_connections:
             self.active_connections[user_id] = []
-        self.active_connections[user_id].append(websocket)
+            await broker.subscribe(self._channel(user_id), partial(self.deliver, user_id))
+        self.active_connections[user_id].append(connection)
+        return connection
 
-    def disconnect(self, user_id: int, websocket: WebSocket):
-        if user_id in self.active_connections and websocket in self.active_connections[user_id]:
-            self.active_connections[user_id].remove(websocket)
+    async def disconnect(self, user_id: int, websocket: WebSocket):
+        connections = self.active_connections.get(user_id)
+        if connections is None:
+            return
+        for connection in connections:
+            if connection.websocket is websocket:
+                connection.stop()
+                connections.remove(connection)
+                break
+        if not connections:
+            del self.active_connections[user_id]
+            await broker.unsubscribe(self._channel(user_id))
 
     async def send_direct_message(self, user_id: int, message: DirectMessage):
-        """Envia mensagem para todos os WebSockets ativos do usuário destinatário"""
-        if user_id in self.active_connections:
-            message_dict = self.direct_message_to_dict(message=message)
-            for connection in self.active_connections[user_id]:
-                await connection.send_json(message_dict)
+        """Publica a mensagem no canal do destinatário (todos os workers recebem)"""
+        await broker.publish(self._channel(user_id), self.direct_message_to_dict(message=message))
+
+    async def deliver(self, user_id: int, message_dict: dict):
+        """Enfileira o mesmo Frame (serializado uma vez por formato) para todos os sockets locais do destinatário"""
+        started = time.perf_counter()
+        frame = Frame(message_dict)
+        depth = 0
+        for connection in list(self.active_connections.get(user_id, [])):
+            connection.enqueue(frame)
+            depth = max(depth, connection.queue.qsize())
+        ws_broadcast_duration.observe(time.perf_counter() - started, "dm")
+        ws_send_queue_depth.observe(depth, "dm")
 
     def direct_message_to_dict(self, message: DirectMessage):
         return {
             "id": message.id,
+            "conversation_id": message.conversation_id,
             "sender_id": message.sender_id,
             "receiver_id": message.receiver_id,
             "content": message.content,
             "timestamp": message.timestamp.isoformat()  # datetime -> string
         }
 
-dm_manager = DMConnectionManager()
\ No newline at end of file
+    def socket_count(self) -> int:
+        return sum(len(connections) for connections in self.active_connections.values())
+
+dm_manager = DMConnectionManager()
+ws_connections.set_function(dm_manager.socket_count, "dm")
@@ -0,0 +1,104 @@
+import os
+import zlib
+from datetime import datetime
+from typing import AsyncIterator, List, Optional
+
+from fastapi.responses import StreamingResponse
+from sqlalchemy import Select, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app import models
+from app.ws_connection import encode_json
+
+# linhas por lote lido do cursor (e por chunk enviado); a memória fica nessa ordem
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "1000"))
+# nível do gzip (1 = mais rápido, 9 = menor)
+EXPORT_GZIP_LEVEL = int(os.getenv("EXPORT_GZIP_LEVEL", "6"))
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+GZIP_MEDIA_TYPE = "application/gzip"
+
+# MARK: - Consultas
+# Só colunas, sem entidades ORM: nada entra no identity map da sessão, e cada
+# linha vira um dict com os mesmos campos do histórico paginado.
+
+
+def _in_range(query: Select, timestamp_column, since: Optional[datetime],
+              until: Optional[datetime]) -> Select:
+    """`since` inclusivo, `until` exclusivo"""
+    if since is not None:
+        query = query.where(timestamp_column >= since)
+    if until is not None:
+        query = query.where(timestamp_column < until)
+    return query
+
+
+def room_export_query(room_id: int, since: Optional[datetime] = None,
+                      until: Optional[datetime] = None) -> Select:
+    Message = models.Message
+    query = select(Message.id, Message.content, Message.user_id, Message.room_id, Message.timestamp)
+    query = _in_range(query.where(Message.room_id == room_id), Message.timestamp, since, until)
+    # mesma ordem (e índice) da paginação: (room_id, id)
+    return query.order_by(Message.id)
+
+
+def direct_export_query(conversation_id: int, since: Optional[datetime] = None,
+                        until: Optional[datetime] = None) -> Select:
+    DirectMessage = models.DirectMessage
+    query = select(DirectMessage.id, DirectMessage.conversation_id, DirectMessage.sender_id,
+                   DirectMessage.receiver_id, DirectMessage.content, DirectMessage.timestamp)
+    query = _in_range(query.where(DirectMessage.conversation_id == conversation_id),
+                      DirectMessage.timestamp, since, until)
+    return query.order_by(DirectMessage.id)
+
+
+# MARK: - Streaming
+
+async def stream_rows(session: AsyncSession, query: Optional[Select]) -> AsyncIterator[List[dict]]:
+    """Lotes de até EXPORT_BATCH_SIZE linhas lidos por cursor do lado do servidor.
+
+    A sessão é aberta e fechada aqui dentro, enquanto a resposta é enviada: a
+    conexão volta ao pool quando o cliente termina (ou desiste) do download.
+    """
+    async with session:
+        if query is None:
+            return
+        result = await session.stream(query.execution_options(yield_per=EXPORT_BATCH_SIZE))
+        async for partition in result.mappings().partitions():
+            yield [dict(row) for row in partition]
+
+
+def serialize_row(row: dict) -> dict:
+    """Linha do banco -> mesmos campos do JSON da API (timestamp em ISO 8601)"""
+    timestamp = row.get("timestamp")
+    if isinstance(timestamp, datetime):
+        row["timestamp"] = timestamp.isoformat()
+    return row
+
+
+async def ndjson_chunks(batches: AsyncIterator[List[dict]]) -> AsyncIterator[bytes]:
+    """Um chunk por lote, uma mensagem JSON por linha"""
+    async for batch in batches:
+        if batch:
+            yield "".join(encode_json(serialize_row(row)) + "\n" for row in batch).encode()
+
+
+async def gzip_chunks(chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    """Comprime o fluxo incrementalmente num único membro gzip"""
+    compressor = zlib.compressobj(EXPORT_GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    async for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def export_response(batches: AsyncIterator[List[dict]], filename: str, gzip: bool) -> StreamingResponse:
+    chunks = ndjson_chunks(batches)
+    if gzip:
+        chunks, media_type, filename = gzip_chunks(chunks), GZIP_MEDIA_TYPE, filename + ".ndjson.gz"
+    else:
+        media_type, filename = NDJSON_MEDIA_TYPE, filename + ".ndjson"
+    return StreamingResponse(
+        chunks, media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'})
@@ -0,0 +1,74 @@
+import asyncio
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+
+from fastapi import HTTPException, status
+from passlib.hash import bcrypt
+
+# processos dedicados ao bcrypt (padrão: um por núcleo)
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(os.cpu_count() or 1)))
+# quantos pedidos podem esperar além dos que já estão rodando; acima disso, 503
+PASSWORD_HASH_QUEUE_LIMIT = int(os.getenv("PASSWORD_HASH_QUEUE_LIMIT", "64"))
+# fator de custo do bcrypt; ao mudar, os hashes antigos são refeitos no login
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+
+
+def _hash(password: str, rounds: int) -> str:
+    return bcrypt.using(rounds=rounds).hash(password)
+
+
+def _verify(password: str, hashed_password: str) -> bool:
+    return bcrypt.verify(password, hashed_password)
+
+
+class PasswordHasher:
+    """Roda o bcrypt num pool de processos próprio, com fila de admissão limitada"""
+
+    def __init__(self, workers: int = PASSWORD_HASH_WORKERS,
+                 queue_limit: int = PASSWORD_HASH_QUEUE_LIMIT,
+                 rounds: int = BCRYPT_ROUNDS):
+        self.workers = workers
+        self.queue_limit = queue_limit
+        self.rounds = rounds
+        self.pending = 0
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            # spawn: não herda threads/sockets do worker do uvicorn
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"))
+        return self._executor
+
+    async def _submit(self, fn, *args):
+        if self.pending >= self.workers + self.queue_limit:
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Servidor ocupado, tente novamente",
+                headers={"Retry-After": "1"})
+        self.pending += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._get_executor(), fn, *args)
+        finally:
+            self.pending -= 1
+
+    async def hash(self, password: str) -> str:
+        return await self._submit(_hash, password, self.rounds)
+
+    async def verify(self, password: str, hashed_password: str) -> bool:
+        return await self._submit(_verify, password, hashed_password)
+
+    def needs_rehash(self, hashed_password: str) -> bool:
+        return bcrypt.using(rounds=self.rounds).needs_update(hashed_password)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+password_hasher = PasswordHasher()
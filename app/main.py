@@ -1,24 +1,96 @@
 from fastapi import FastAPI, WebSocket, Depends, WebSocketDisconnect, status
-from app.db import engine, Base
-from app.routers import auth, users, rooms, messages
+from fastapi.responses import JSONResponse, PlainTextResponse
+from app.db import DB_CREATE_ALL, Base, dispose_engines, get_engine
+from app.routers import users, rooms, messages, search
 from fastapi.openapi.utils import get_openapi
 from app.db import get_db
-from app.auth_utils import get_current_user, verify_token
-from app import models
-from sqlalchemy.orm import Session
+from app.auth_utils import verify_token
+from sqlalchemy.ext.asyncio import AsyncSession
 from app.connection_manager import manager
 from app.dm_connection_manager import dm_manager
-
-app = FastAPI(title="Chat API", version="1.0")
-
-# Cria as tabelas no banco (somente para protótipo)
-Base.metadata.create_all(bind=engine)
+from app.broker import broker
+from app.membership import membership
+from app.hashing import password_hasher
+from app.write_batcher import message_writer, direct_message_writer
+from app.ws_frames import receive_frame, handle_room_frame, handle_dm_frame
+from app.ws_resume import resume_room, resume_dm
+from app.ws_heartbeat import heartbeat
+from app.archive import archiver
+from app.presence import presence
+from sqlalchemy import text
+from contextlib import asynccontextmanager
+from typing import Optional
+from app import metrics
+import asyncio
+import os
+
+# tempo máximo de cada verificação do /ready
+READY_TIMEOUT_SECONDS = float(os.getenv("READY_TIMEOUT_SECONDS", "2"))
+
+
+# MARK: - Ciclo de vida
+# Nada aqui roda no import: o engine só é criado no primeiro uso, e o schema vem
+# das migrações (alembic upgrade head). create_all fica para SQLite/protótipo.
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if DB_CREATE_ALL:
+        async with get_engine().begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+    heartbeat.start()
+    # partições à frente (Postgres) e, com ARCHIVE_ENABLED, arquivamento dos meses antigos
+    archiver.start()
+    yield
+    await archiver.stop()
+    await heartbeat.stop()
+    await message_writer.close()
+    await direct_message_writer.close()
+    await broker.close()
+    password_hasher.shutdown()
+    await dispose_engines()
+
+
+app = FastAPI(title="Chat API", version="1.0", lifespan=lifespan)
+
+if metrics.METRICS_ENABLED:
+    app.add_middleware(metrics.MetricsMiddleware)
 
 # MARK: - Rotas REST
-# app.include_router(auth.router)
 app.include_router(users.router)
 app.include_router(rooms.router)
 app.include_router(messages.router)
+app.include_router(search.router)
+
+
+# MARK: - Prontidão
+
+async def _check_database():
+    async with get_engine().connect() as conn:
+        await conn.execute(text("SELECT 1"))
+
+
+@app.get("/ready", include_in_schema=False)
+async def ready():
+    """200 quando banco e broker respondem; 503 tira o pod do balanceador"""
+    checks = {}
+    for name, check in (("database", _check_database), ("broker", broker.ping)):
+        try:
+            await asyncio.wait_for(check(), READY_TIMEOUT_SECONDS)
+            checks[name] = "ok"
+        except Exception as exc:
+            checks[name] = f"erro: {type(exc).__name__}"
+    ok = all(result == "ok" for result in checks.values())
+    return JSONResponse(
+        {"status": "ok" if ok else "unavailable", "checks": checks},
+        status_code=status.HTTP_200_OK if ok else status.HTTP_503_SERVICE_UNAVAILABLE)
+
+
+# MARK: - Métricas
+
+if metrics.METRICS_ENABLED:
+    @app.get("/metrics", include_in_schema=False)
+    def get_metrics():
+        return PlainTextResponse(metrics.render(), media_type=metrics.CONTENT_TYPE)
 
 
 # MARK: - Room WS
@@ -27,7 +99,8 @@ app.include_router(messages.router)
 async def websocket_endpoint(
     websocket: WebSocket,
     room_id: int,
-    db: Session = Depends(get_db)
+    last_seen_id: Optional[int] = None,
+    db: AsyncSession = Depends(get_db)
 ):
     token = websocket.headers.get("authorization") or websocket.headers.get("Authorization")
     if not token or not token.startswith("Bearer "):
@@ -35,31 +108,35 @@ async def websocket_endpoint(
         return
 
     token = token.split(" ")[1]
-    current_user = verify_token(token=token, db=db)
+    current_user = await verify_token(token=token, db=db)
     if current_user is None:
         await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
         return
 
-    room = db.query(models.Room).filter(models.Room.id == room_id).first()
-    if not room:
+    # ser membro implica que a sala existe (FK em user_rooms)
+    if not await membership.is_member(db, room_id, current_user.id):
         await websocket.close(code=1008)  # Policy Violation
         return
 
-    user_in_room = db.query(models.UserRoom).filter_by(
-        user_id=current_user.id, room_id=room_id
-    ).first()
-    if not user_in_room:
-        await websocket.close(code=1008)
-        return
-
-    await manager.connect(room_id, websocket)
+    # devolve a conexão ao pool: cada frame de envio abre a sua própria sessão
+    await db.close()
+    # reconexão com ?last_seen_id=: segura a entrega ao vivo até o replay do que foi perdido
+    connection = await manager.connect(room_id, websocket, hold=last_seen_id is not None)
+    if last_seen_id is not None:
+        await resume_room(connection, room_id, last_seen_id)
 
     try:
-        # Mantém a conexão aberta (sem tratar mensagens)
+        await presence.join(connection, room_id, current_user.id)
         while True:
-            await websocket.receive_text()  # só mantém a conexão viva
+            # send / typing / presence / ping; o resto só mantém a conexão viva
+            data = await receive_frame(connection)
+            if data is not None:
+                await handle_room_frame(connection, room_id, current_user, data)
     except WebSocketDisconnect:
-        manager.disconnect(room_id, websocket)
+        pass
+    finally:
+        await manager.disconnect(room_id, websocket)
+        await presence.leave(room_id, current_user.id)
 
 
 # MARK: - DM WS
@@ -67,7 +144,8 @@ async def websocket_endpoint(
 @app.websocket("/ws/dm")
 async def dm_websocket(
     websocket: WebSocket,
-    db: Session = Depends(get_db)
+    last_seen_id: Optional[int] = None,
+    db: AsyncSession = Depends(get_db)
 ):
     token = websocket.headers.get("authorization") or websocket.headers.get("Authorization")
     if not token or not token.startswith("Bearer "):
@@ -75,20 +153,27 @@ async def dm_websocket(
         return
 
     token = token.split(" ")[1]
-    current_user = verify_token(token=token, db=db)
+    current_user = await verify_token(token=token, db=db)
     if current_user is None:
         await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
         return
     
+    await db.close()
     # Registra o WebSocket do remetente
-    await dm_manager.connect(current_user.id, websocket)
+    connection = await dm_manager.connect(current_user.id, websocket, hold=last_seen_id is not None)
+    if last_seen_id is not None:
+        await resume_dm(connection, current_user.id, last_seen_id)
 
     try:
         while True:
             # Recebe mensagem do remetente
-            await websocket.receive_text()
+            data = await receive_frame(connection)
+            if data is not None:
+                await handle_dm_frame(connection, current_user, data)
     except WebSocketDisconnect:
-        dm_manager.disconnect(current_user.id, websocket)
+        pass
+    finally:
+        await dm_manager.disconnect(current_user.id, websocket)
 
 #MARK: - OpenAPI
 
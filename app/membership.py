@@ -0,0 +1,96 @@
+import os
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Set, Tuple
+
+from sqlalchemy import exists, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app import models
+from app.broker import broker
+
+# número máximo de pares (sala, usuário) guardados por processo
+MEMBERSHIP_CACHE_SIZE = int(os.getenv("MEMBERSHIP_CACHE_SIZE", "100000"))
+# validade de um "é membro" em cache; limita o atraso de uma leitura em réplica defasada
+MEMBERSHIP_CACHE_TTL_SECONDS = float(os.getenv("MEMBERSHIP_CACHE_TTL_SECONDS", "60"))
+INVALIDATION_CHANNEL = "membership:invalidate"
+
+
+class MembershipService:
+    """Responde "o usuário U está na sala R?" em O(1) com cache local (LRU).
+
+    Só respostas positivas entram no cache, e por MEMBERSHIP_CACHE_TTL_SECONDS:
+    um "não é membro" lido antes de um join (ou numa réplica atrasada) ficaria
+    preso para sempre. Uma consulta que cruzou uma invalidação não é guardada.
+    """
+
+    def __init__(self, max_size: int = MEMBERSHIP_CACHE_SIZE, ttl: float = MEMBERSHIP_CACHE_TTL_SECONDS):
+        self.max_size = max_size
+        self.ttl = ttl
+        # (sala, usuário) -> até quando o "é membro" vale
+        self.cache: "OrderedDict[Tuple[int, int], float]" = OrderedDict()
+        # room_id -> user_ids em cache, para invalidar uma sala inteira
+        self.rooms: Dict[int, Set[int]] = {}
+        # incrementado a cada invalidação
+        self.generation = 0
+        self._subscribed = False
+
+    async def is_member(self, db: AsyncSession, room_id: int, user_id: int) -> bool:
+        key = (room_id, user_id)
+        expires = self.cache.get(key)
+        if expires is not None:
+            if expires > time.monotonic():
+                self.cache.move_to_end(key)
+                return True
+            del self.cache[key]
+            self._forget(room_id, user_id)
+
+        await self._ensure_subscribed()
+        generation = self.generation
+        # EXISTS sobre a chave primária de user_rooms
+        is_member = bool(await db.scalar(select(exists().where(
+            models.UserRoom.user_id == user_id,
+            models.UserRoom.room_id == room_id,
+        ))))
+        if is_member and generation == self.generation:
+            self._store(key)
+        return is_member
+
+    async def invalidate(self, room_id: int, user_id: Optional[int] = None):
+        """Descarta o par (ou a sala inteira) aqui e nos demais workers"""
+        self._drop(room_id, user_id)
+        await broker.publish(INVALIDATION_CHANNEL, {"room_id": room_id, "user_id": user_id})
+
+    def _store(self, key: Tuple[int, int]):
+        self.cache[key] = time.monotonic() + self.ttl
+        self.rooms.setdefault(key[0], set()).add(key[1])
+        while len(self.cache) > self.max_size:
+            (room_id, user_id), _ = self.cache.popitem(last=False)
+            self._forget(room_id, user_id)
+
+    def _drop(self, room_id: int, user_id: Optional[int]):
+        self.generation += 1
+        if user_id is None:
+            for cached_user_id in self.rooms.pop(room_id, set()):
+                self.cache.pop((room_id, cached_user_id), None)
+            return
+        self.cache.pop((room_id, user_id), None)
+        self._forget(room_id, user_id)
+
+    def _forget(self, room_id: int, user_id: int):
+        users = self.rooms.get(room_id)
+        if users is not None:
+            users.discard(user_id)
+            if not users:
+                del self.rooms[room_id]
+
+    async def _ensure_subscribed(self):
+        if not self._subscribed:
+            self._subscribed = True
+            await broker.subscribe(INVALIDATION_CHANNEL, self._on_invalidate)
+
+    async def _on_invalidate(self, message: dict):
+        self._drop(message["room_id"], message.get("user_id"))
+
+
+membership = MembershipService()
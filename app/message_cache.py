@@ -0,0 +1,224 @@
+import bisect
+import json
+import os
+from collections import OrderedDict
+from typing import Awaitable, Callable, List, Optional, Tuple
+
+from app.broker import BROKER_BACKEND, REDIS_URL
+from app.metrics import Counter
+
+# mensagens recentes guardadas por sala
+RECENT_MESSAGES_PER_ROOM = int(os.getenv("RECENT_MESSAGES_PER_ROOM", "100"))
+# limite de memória do cache local (somando todas as salas)
+RECENT_MESSAGES_MAX_BYTES = int(os.getenv("RECENT_MESSAGES_MAX_BYTES", str(64 * 1024 * 1024)))
+# "memory" (por processo) ou "redis" (compartilhado); segue o broker por padrão
+RECENT_MESSAGES_BACKEND = os.getenv("RECENT_MESSAGES_BACKEND", BROKER_BACKEND)
+# salas sem acesso somem do Redis depois desse tempo
+RECENT_MESSAGES_REDIS_TTL_SECONDS = int(os.getenv("RECENT_MESSAGES_REDIS_TTL_SECONDS", "3600"))
+
+# devolve as RECENT_MESSAGES_PER_ROOM + 1 mensagens mais recentes, em ordem crescente
+Loader = Callable[[], Awaitable[List[dict]]]
+Page = Tuple[List[dict], Optional[int]]
+
+message_cache_requests = Counter(
+    "chat_message_cache_requests_total", "Leituras da última página de uma sala pelo cache de recentes.",
+    ("result",))
+
+
+def _page(messages: List[dict], complete: bool, limit: int) -> Optional[Page]:
+    """Últimas `limit` mensagens + cursor, se o buffer tiver o suficiente para responder"""
+    if len(messages) > limit:
+        page = messages[-limit:]
+        return page, page[0]["id"]
+    if complete:
+        return messages, None
+    return None
+
+
+class RecentMessageCache:
+    """Ring buffer por sala com as mensagens mais recentes já serializadas.
+
+    Guarda `per_room + 1` mensagens: a sobra é a que diz, sem ir ao banco, se
+    existe página anterior a uma página cheia de `per_room` (o cursor).
+    """
+
+    def __init__(self, per_room: int = RECENT_MESSAGES_PER_ROOM):
+        self.per_room = per_room
+        self.capacity = per_room + 1
+
+    async def get_latest(self, room_id: int, limit: int) -> Optional[Page]:
+        raise NotImplementedError
+
+    async def warm(self, room_id: int, loader: Loader):
+        raise NotImplementedError
+
+    async def append(self, room_id: int, message: dict):
+        raise NotImplementedError
+
+    async def invalidate(self, room_id: int):
+        raise NotImplementedError
+
+    async def latest(self, room_id: int, limit: int, loader: Optional[Loader]) -> Optional[Page]:
+        """Serve do cache, aquecendo a sala na primeira leitura (sem `loader`, sala fria dá None)"""
+        if limit > self.per_room:
+            return None
+        page = await self.get_latest(room_id, limit)
+        if page is not None:
+            message_cache_requests.inc(1, "hit")
+            return page
+        message_cache_requests.inc(1, "miss")
+        if loader is None:
+            return None
+        await self.warm(room_id, loader)
+        return await self.get_latest(room_id, limit)
+
+
+class _RoomBuffer:
+    def __init__(self):
+        self.ids: List[int] = []
+        self.messages: List[dict] = []
+        self.sizes: List[int] = []
+        self.bytes = 0
+        # False enquanto a sala está sendo aquecida
+        self.warm = False
+        # True se o buffer contém o histórico inteiro da sala
+        self.complete = False
+
+
+class InMemoryMessageCache(RecentMessageCache):
+    """Buffers locais com despejo LRU entre salas, limitado por RECENT_MESSAGES_MAX_BYTES"""
+
+    def __init__(self, per_room: int = RECENT_MESSAGES_PER_ROOM,
+                 max_bytes: int = RECENT_MESSAGES_MAX_BYTES):
+        super().__init__(per_room)
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.rooms: "OrderedDict[int, _RoomBuffer]" = OrderedDict()
+
+    async def get_latest(self, room_id: int, limit: int) -> Optional[Page]:
+        buffer = self.rooms.get(room_id)
+        if buffer is None or not buffer.warm:
+            return None
+        self.rooms.move_to_end(room_id)
+        return _page(buffer.messages, buffer.complete, limit)
+
+    async def warm(self, room_id: int, loader: Loader):
+        if room_id in self.rooms:
+            return
+        # registra antes de consultar: mensagens gravadas durante a carga também entram
+        buffer = self.rooms[room_id] = _RoomBuffer()
+        try:
+            messages = await loader()
+        except Exception:
+            await self.invalidate(room_id)
+            raise
+        if self.rooms.get(room_id) is not buffer:
+            return  # invalidada durante a carga
+        buffer.complete = len(messages) <= self.per_room
+        for message in messages:
+            self._insert(buffer, message)
+        buffer.warm = True
+        self._evict()
+
+    async def append(self, room_id: int, message: dict):
+        # salas frias não são guardadas; serão aquecidas na primeira leitura
+        buffer = self.rooms.get(room_id)
+        if buffer is not None:
+            self._insert(buffer, message)
+            self._evict()
+
+    async def invalidate(self, room_id: int):
+        buffer = self.rooms.pop(room_id, None)
+        if buffer is not None:
+            self.bytes -= buffer.bytes
+
+    def _insert(self, buffer: _RoomBuffer, message: dict):
+        index = bisect.bisect_left(buffer.ids, message["id"])
+        if index < len(buffer.ids) and buffer.ids[index] == message["id"]:
+            return
+        size = len(json.dumps(message))
+        buffer.ids.insert(index, message["id"])
+        buffer.messages.insert(index, message)
+        buffer.sizes.insert(index, size)
+        buffer.bytes += size
+        self.bytes += size
+        while len(buffer.ids) > self.capacity:
+            buffer.ids.pop(0)
+            buffer.messages.pop(0)
+            size = buffer.sizes.pop(0)
+            buffer.bytes -= size
+            self.bytes -= size
+            buffer.complete = False
+
+    def _evict(self):
+        while self.bytes > self.max_bytes and len(self.rooms) > 1:
+            _, buffer = self.rooms.popitem(last=False)
+            self.bytes -= buffer.bytes
+
+
+class RedisMessageCache(RecentMessageCache):
+    """Buffer compartilhado entre workers: sorted set por sala (score = id da mensagem).
+
+    O sorted set (em vez de uma lista) deixa a carga inicial e as gravações
+    concorrentes se misturarem sem perder nem duplicar mensagens.
+    """
+
+    def __init__(self, url: str, per_room: int = RECENT_MESSAGES_PER_ROOM,
+                 ttl: int = RECENT_MESSAGES_REDIS_TTL_SECONDS):
+        super().__init__(per_room)
+        import redis.asyncio as redis
+
+        self.redis = redis.from_url(url)
+        self.ttl = ttl
+
+    def _key(self, room_id: int) -> str:
+        return f"recent:{room_id}"
+
+    def _state_key(self, room_id: int) -> str:
+        # "complete" ou "partial"; ausente = sala fria
+        return f"recent:{room_id}:state"
+
+    async def get_latest(self, room_id: int, limit: int) -> Optional[Page]:
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.get(self._state_key(room_id))
+            pipe.zrange(self._key(room_id), -(limit + 1), -1)
+            state, raw = await pipe.execute()
+        if state is None:
+            return None
+        messages = [json.loads(item) for item in raw]
+        return _page(messages, state == b"complete", limit)
+
+    async def warm(self, room_id: int, loader: Loader):
+        messages = await loader()
+        state = b"complete" if len(messages) <= self.per_room else b"partial"
+        async with self.redis.pipeline(transaction=True) as pipe:
+            if messages:
+                pipe.zadd(self._key(room_id), {json.dumps(m): m["id"] for m in messages})
+            pipe.zremrangebyrank(self._key(room_id), 0, -(self.capacity + 1))
+            pipe.set(self._state_key(room_id), state, ex=self.ttl)
+            pipe.expire(self._key(room_id), self.ttl)
+            await pipe.execute()
+
+    async def append(self, room_id: int, message: dict):
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.zadd(self._key(room_id), {json.dumps(message): message["id"]})
+            pipe.zremrangebyrank(self._key(room_id), 0, -(self.capacity + 1))
+            pipe.expire(self._key(room_id), self.ttl)
+            _, trimmed, _ = await pipe.execute()
+        if trimmed:
+            # o buffer deixou de conter o histórico inteiro
+            await self.redis.set(self._state_key(room_id), b"partial", xx=True, keepttl=True)
+
+    async def invalidate(self, room_id: int):
+        await self.redis.delete(self._key(room_id), self._state_key(room_id))
+
+
+def get_message_cache() -> RecentMessageCache:
+    if RECENT_MESSAGES_BACKEND == "redis":
+        return RedisMessageCache(REDIS_URL or "redis://localhost:6379/0")
+    if RECENT_MESSAGES_BACKEND == "memory":
+        return InMemoryMessageCache()
+    raise ValueError(f"RECENT_MESSAGES_BACKEND inválido: {RECENT_MESSAGES_BACKEND}")
+
+
+recent_messages = get_message_cache()
@@ -0,0 +1,203 @@
+import bisect
+import os
+import time
+from functools import lru_cache
+from typing import Callable, Dict, List, Sequence, Tuple
+
+from sqlalchemy import event
+
+# desliga o middleware, os eventos do SQLAlchemy e o /metrics
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() in ("1", "true", "yes")
+
+# MARK: - Métricas
+# Implementação mínima do formato texto do Prometheus. As métricas são por
+# processo: com vários workers, cada um responde só pelos próprios números.
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.075, 0.1, 0.25, 0.5, 0.75, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0)
+FANOUT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1)
+DEPTH_BUCKETS = (0, 1, 2, 4, 8, 16, 32, 64, 128, 256, 512)
+
+REGISTRY: List["_Metric"] = []
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value: float) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        REGISTRY.append(self)
+
+    def samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self.samples())
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self.values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, *labels: str):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def samples(self) -> List[str]:
+        return [f"{self.name}{_labels(self.labelnames, labels)} {_number(value)}"
+                for labels, value in self.values.items()]
+
+
+class Gauge(_Metric):
+    """Valor lido na hora da coleta (nenhum custo no caminho quente)"""
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self.functions: Dict[Tuple[str, ...], Callable[[], float]] = {}
+
+    def set_function(self, function: Callable[[], float], *labels: str):
+        self.functions[labels] = function
+
+    def samples(self) -> List[str]:
+        return [f"{self.name}{_labels(self.labelnames, labels)} {_number(function())}"
+                for labels, function in self.functions.items()]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+        # labels -> [contagem de cada bucket (não cumulativa)..., +Inf, soma]
+        self.series: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, *labels: str):
+        series = self.series.get(labels)
+        if series is None:
+            series = self.series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        series[bisect.bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def samples(self) -> List[str]:
+        lines = []
+        for labels, series in self.series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                le = 'le="' + _number(bound) + '"'
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, labels, le)} {cumulative}")
+            cumulative += series[len(self.buckets)]
+            inf = 'le="+Inf"'
+            lines.append(f"{self.name}_bucket{_labels(self.labelnames, labels, inf)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, labels)} {_number(series[-1])}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, labels)} {cumulative}")
+        return lines
+
+
+def render() -> str:
+    return "\n".join(metric.render() for metric in REGISTRY) + "\n"
+
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+http_request_duration = Histogram(
+    "chat_http_request_duration_seconds", "Latência das requisições HTTP por rota.",
+    ("method", "route", "status"))
+db_query_duration = Histogram(
+    "chat_db_query_duration_seconds", "Tempo de execução de cada comando SQL.",
+    ("operation",), QUERY_BUCKETS)
+ws_connections = Gauge(
+    "chat_ws_connections", "Sockets abertos neste processo.", ("kind",))
+ws_broadcast_duration = Histogram(
+    "chat_ws_broadcast_duration_seconds", "Tempo para enfileirar uma entrega para os sockets locais.",
+    ("kind",), FANOUT_BUCKETS)
+ws_send_queue_depth = Histogram(
+    "chat_ws_send_queue_depth", "Maior fila de saída entre os destinatários de uma entrega.",
+    ("kind",), DEPTH_BUCKETS)
+ws_frames_dropped = Counter(
+    "chat_ws_frames_dropped_total", "Frames descartados ou sockets derrubados por consumidor lento.",
+    ("policy",))
+
+
+# MARK: - HTTP
+
+class MetricsMiddleware:
+    """Middleware ASGI puro (sem BaseHTTPMiddleware) que mede cada requisição.
+
+    A rota é o template (`/rooms/{room_id}/messages`), lido do scope depois que o
+    roteador o preenche, para não criar uma série por id.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status_code = 500
+
+        async def send_with_status(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            route = getattr(scope.get("route"), "path", "unmatched")
+            http_request_duration.observe(
+                time.perf_counter() - started, scope["method"], route, str(status_code))
+
+
+# MARK: - SQLAlchemy
+
+@lru_cache(maxsize=1024)
+def _operation(statement: str) -> str:
+    # SELECT / INSERT / UPDATE / ...: o texto completo explodiria a cardinalidade
+    words = statement.split(None, 1)
+    return words[0].upper() if words else "UNKNOWN"
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    context._metrics_started = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, "_metrics_started", None)
+    if started is not None:
+        db_query_duration.observe(time.perf_counter() - started, _operation(statement))
+
+
+def instrument_engine(engine):
+    """Registra o tempo de cada comando executado pelo engine (síncrono ou async)"""
+    sync_engine = getattr(engine, "sync_engine", engine)
+    event.listen(sync_engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(sync_engine, "after_cursor_execute", _after_cursor_execute)
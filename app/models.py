@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, Text
+from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, Text, Index, UniqueConstraint, func
 from sqlalchemy.orm import relationship
 from app.db import Base
 from datetime import datetime
@@ -17,13 +17,27 @@ class User(Base):
     messages = relationship("Message", back_populates="user")  # <- importante!
 
 
+# autocomplete por prefixo, sem diferenciar maiúsculas (LIKE 'abc%' usa o índice no Postgres)
+Index(
+    "ix_users_username_lower",
+    func.lower(User.username).label("username_lower"),
+    postgresql_ops={"username_lower": "text_pattern_ops"},
+)
+
+
 class Room(Base):
     __tablename__ = "rooms"
+    __table_args__ = (
+        # busca por prefixo do nome (LIKE 'abc%') no Postgres
+        Index("ix_rooms_name_pattern", "name", postgresql_ops={"name": "text_pattern_ops"}),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String, unique=True, nullable=False)
     # description = Column(String, unique=False, nullable=False)
     owner_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    # contador mantido em create/enter/leave/remove (evita COUNT por sala na listagem)
+    member_count = Column(Integer, nullable=False, default=0, server_default="0")
 
     # Relações
     users = relationship("User", secondary="user_rooms",
@@ -34,6 +48,10 @@ class Room(Base):
 
 class UserRoom(Base):
     __tablename__ = "user_rooms"
+    __table_args__ = (
+        # membros de uma sala: a PK (user_id, room_id) só serve buscas por usuário
+        Index("ix_user_rooms_room_id", "room_id"),
+    )
 
     user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
     room_id = Column(Integer, ForeignKey("rooms.id"), primary_key=True)
@@ -41,6 +59,13 @@ class UserRoom(Base):
 
 class Message(Base):
     __tablename__ = "messages"
+    __table_args__ = (
+        # paginação por cursor (keyset) e consultas por intervalo de tempo
+        Index("ix_messages_room_id_id", "room_id", "id"),
+        Index("ix_messages_room_id_timestamp", "room_id", "timestamp"),
+        # segmentos mensais: faixa do arquivamento e min(timestamp)
+        Index("ix_messages_timestamp", "timestamp"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     content = Column(Text, nullable=False)
@@ -55,10 +80,36 @@ class Message(Base):
     room = relationship("Room", back_populates="messages")
 
 
+class Conversation(Base):
+    """Par de usuários de uma conversa privada (user_a_id < user_b_id) + resumo da última mensagem"""
+    __tablename__ = "conversations"
+    __table_args__ = (
+        UniqueConstraint("user_a_id", "user_b_id", name="uq_conversations_users"),
+        # listagem "minhas conversas", da mais recente para a mais antiga
+        Index("ix_conversations_user_a_id_last_message_id", "user_a_id", "last_message_id"),
+        Index("ix_conversations_user_b_id_last_message_id", "user_b_id", "last_message_id"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_a_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    user_b_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    # resumo mantido a cada mensagem (evita GROUP BY sobre direct_messages)
+    last_message_id = Column(Integer)
+    last_message_at = Column(DateTime)
+
+
 class DirectMessage(Base):
     __tablename__ = "direct_messages"
+    __table_args__ = (
+        # histórico paginado da conversa (as duas direções)
+        Index("ix_direct_messages_conversation_id_id", "conversation_id", "id"),
+        Index("ix_direct_messages_receiver_id_id", "receiver_id", "id"),
+        Index("ix_direct_messages_sender_id_id", "sender_id", "id"),
+        Index("ix_direct_messages_timestamp", "timestamp"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
+    conversation_id = Column(Integer, ForeignKey("conversations.id"))
     sender_id = Column(Integer, ForeignKey("users.id"))
     receiver_id = Column(Integer, ForeignKey("users.id"))
     content = Column(Text, nullable=False)
@@ -0,0 +1,36 @@
+from typing import Any, List, Optional, Tuple
+
+from sqlalchemy import Select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+
+async def keyset_page(
+    db: AsyncSession,
+    query: Select,
+    id_column,
+    before: Optional[int],
+    after: Optional[int],
+    limit: int,
+) -> Tuple[List[Any], Optional[int]]:
+    """Página por cursor sobre um índice que termina em `id_column`.
+
+    Sem `after`, devolve as `limit` linhas mais recentes antes de `before` e o
+    cursor aponta para trás; com `after`, avança a partir dele. Em ambos os
+    casos as linhas voltam em ordem crescente.
+    """
+    if before is not None:
+        query = query.where(id_column < before)
+
+    if after is not None:
+        # avançando: linhas mais novas que `after`, em ordem crescente
+        query = query.where(id_column > after)
+        rows = (await db.scalars(query.order_by(id_column.asc()).limit(limit + 1))).all()
+        has_more = len(rows) > limit
+        rows = list(rows[:limit])
+        return rows, (rows[-1].id if has_more else None)
+
+    # voltando no histórico: as `limit` mais recentes antes de `before`
+    rows = (await db.scalars(query.order_by(id_column.desc()).limit(limit + 1))).all()
+    has_more = len(rows) > limit
+    rows = list(reversed(rows[:limit]))
+    return rows, (rows[0].id if has_more else None)
@@ -0,0 +1,107 @@
+import logging
+import os
+from datetime import datetime
+from typing import Iterator, List, Optional
+
+from sqlalchemy import text
+from sqlalchemy.engine import Connection
+
+logger = logging.getLogger(__name__)
+
+# partições mensais criadas à frente do mês corrente (Postgres)
+PARTITION_MONTHS_AHEAD = int(os.getenv("PARTITION_MONTHS_AHEAD", "2"))
+
+# tabelas de mensagens, particionadas por `timestamp`
+PARTITIONED_TABLES = ("messages", "direct_messages")
+
+# MARK: - Meses
+# Um segmento = um mês (UTC, como os timestamps gravados). No Postgres cada mês é
+# uma partição declarativa (RANGE em timestamp); no SQLite a tabela é uma só e o
+# segmento é a faixa do mês no índice de timestamp.
+
+
+def month_start(moment: datetime) -> datetime:
+    return moment.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def next_month(start: datetime) -> datetime:
+    if start.month == 12:
+        return start.replace(year=start.year + 1, month=1)
+    return start.replace(month=start.month + 1)
+
+
+def months_between(first: datetime, last: datetime) -> Iterator[datetime]:
+    """Início de cada mês de `first` até `last`, inclusive"""
+    current = month_start(first)
+    while current <= last:
+        yield current
+        current = next_month(current)
+
+
+def month_label(start: datetime) -> str:
+    return start.strftime("%Y-%m")
+
+
+def parse_month(label: str) -> datetime:
+    return datetime.strptime(label, "%Y-%m")
+
+
+def partition_name(table: str, start: datetime) -> str:
+    return f"{table}_p{start:%Y_%m}"
+
+
+# MARK: - Partições (Postgres)
+
+def create_partition_sql(table: str, start: datetime) -> str:
+    return (
+        f"CREATE TABLE IF NOT EXISTS {partition_name(table, start)} PARTITION OF {table} "
+        f"FOR VALUES FROM ('{start:%Y-%m-%d}') TO ('{next_month(start):%Y-%m-%d}')"
+    )
+
+
+def default_partition_sql(table: str) -> str:
+    # rede de segurança: linhas fora de qualquer mês criado não fazem o INSERT falhar
+    return f"CREATE TABLE IF NOT EXISTS {table}_default PARTITION OF {table} DEFAULT"
+
+
+def is_partitioned(connection: Connection, table: str) -> bool:
+    if connection.dialect.name != "postgresql":
+        return False
+    return bool(connection.execute(text(
+        "SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(:table)"
+    ), {"table": table}).scalar())
+
+
+def ensure_partitions(connection: Connection, now: Optional[datetime] = None,
+                      months_ahead: int = PARTITION_MONTHS_AHEAD) -> List[str]:
+    """Cria as partições do mês corrente e dos próximos; devolve as que criou"""
+    now = now or datetime.utcnow()
+    created = []
+    for table in PARTITIONED_TABLES:
+        if not is_partitioned(connection, table):
+            continue
+        start = month_start(now)
+        for _ in range(months_ahead + 1):
+            name = partition_name(table, start)
+            if connection.execute(text("SELECT to_regclass(:name)"), {"name": name}).scalar() is None:
+                try:
+                    with connection.begin_nested():
+                        connection.execute(text(create_partition_sql(table, start)))
+                    created.append(name)
+                except Exception:
+                    # a partição DEFAULT já tem linhas desse mês: fica nela até o arquivamento
+                    logger.exception("Não foi possível criar a partição %s", name)
+            start = next_month(start)
+    return created
+
+
+def drop_partition(connection: Connection, table: str, start: datetime) -> bool:
+    """Remove a partição do mês, se existir (o conteúdo já foi arquivado)"""
+    name = partition_name(table, start)
+    if not is_partitioned(connection, table):
+        return False
+    if connection.execute(text("SELECT to_regclass(:name)"), {"name": name}).scalar() is None:
+        return False
+    connection.execute(text(f"ALTER TABLE {table} DETACH PARTITION {name}"))
+    connection.execute(text(f"DROP TABLE {name}"))
+    return True
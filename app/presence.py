@@ -0,0 +1,246 @@
+import asyncio
+import logging
+import os
+import time
+from collections import defaultdict
+from typing import Dict, Iterable, Optional, Tuple
+
+from app.broker import BROKER_BACKEND, REDIS_URL, broker
+from app.ws_connection import Connection, Frame
+
+logger = logging.getLogger(__name__)
+
+# intervalo mínimo entre dois frames de presença da mesma sala
+PRESENCE_MIN_INTERVAL_MS = float(os.getenv("PRESENCE_MIN_INTERVAL_MS", "1000"))
+# "digitando" some sozinho se o cliente não renovar nesse tempo
+PRESENCE_TYPING_TTL_SECONDS = float(os.getenv("PRESENCE_TYPING_TTL_SECONDS", "5"))
+# "memory" (por processo) ou "redis" (compartilhado); segue o broker por padrão
+PRESENCE_BACKEND = os.getenv("PRESENCE_BACKEND", BROKER_BACKEND)
+PRESENCE_REDIS_TTL_SECONDS = int(os.getenv("PRESENCE_REDIS_TTL_SECONDS", "3600"))
+
+STATUSES = ("online", "away")
+
+
+# MARK: - Estado
+# Quem está em cada sala e com qual status; é o que vai no snapshot de quem entra.
+
+class PresenceStore:
+    async def set(self, room_id: int, user_id: int, status: str):
+        raise NotImplementedError
+
+    async def remove(self, room_id: int, user_id: int):
+        raise NotImplementedError
+
+    async def snapshot(self, room_id: int) -> Dict[int, str]:
+        raise NotImplementedError
+
+    async def refresh(self, room_ids: Iterable[int]):
+        """Mantém vivo o estado das salas que ainda têm sockets locais"""
+
+
+class InMemoryPresenceStore(PresenceStore):
+    def __init__(self):
+        self.rooms: Dict[int, Dict[int, str]] = defaultdict(dict)
+
+    async def set(self, room_id: int, user_id: int, status: str):
+        self.rooms[room_id][user_id] = status
+
+    async def remove(self, room_id: int, user_id: int):
+        users = self.rooms.get(room_id)
+        if users is not None:
+            users.pop(user_id, None)
+            if not users:
+                del self.rooms[room_id]
+
+    async def snapshot(self, room_id: int) -> Dict[int, str]:
+        return dict(self.rooms.get(room_id, {}))
+
+
+class RedisPresenceStore(PresenceStore):
+    """Hash por sala (user_id -> status), compartilhado entre workers"""
+
+    def __init__(self, url: str, ttl: int = PRESENCE_REDIS_TTL_SECONDS):
+        import redis.asyncio as redis
+
+        self.redis = redis.from_url(url)
+        self.ttl = ttl
+
+    def _key(self, room_id: int) -> str:
+        return f"presence:{room_id}"
+
+    async def set(self, room_id: int, user_id: int, status: str):
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.hset(self._key(room_id), str(user_id), status)
+            # workers que caem sem limpar não deixam presença eterna
+            pipe.expire(self._key(room_id), self.ttl)
+            await pipe.execute()
+
+    async def remove(self, room_id: int, user_id: int):
+        await self.redis.hdel(self._key(room_id), str(user_id))
+
+    async def refresh(self, room_ids: Iterable[int]):
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for room_id in room_ids:
+                pipe.expire(self._key(room_id), self.ttl)
+            await pipe.execute()
+
+    async def snapshot(self, room_id: int) -> Dict[int, str]:
+        raw = await self.redis.hgetall(self._key(room_id))
+        return {int(user_id): status.decode() for user_id, status in raw.items()}
+
+
+def get_presence_store() -> PresenceStore:
+    if PRESENCE_BACKEND == "redis":
+        return RedisPresenceStore(REDIS_URL or "redis://localhost:6379/0")
+    if PRESENCE_BACKEND == "memory":
+        return InMemoryPresenceStore()
+    raise ValueError(f"PRESENCE_BACKEND inválido: {PRESENCE_BACKEND}")
+
+
+# MARK: - Deltas
+# Mudanças de uma sala são juntadas e publicadas no canal dela no máximo uma vez
+# a cada PRESENCE_MIN_INTERVAL_MS; dentro da janela só o último valor de cada
+# usuário conta (online -> away -> online vira um único "online").
+
+class _PendingDelta:
+    __slots__ = ("status", "typing", "timer")
+
+    def __init__(self):
+        self.status: Dict[int, str] = {}
+        self.typing: Dict[int, bool] = {}
+        self.timer: Optional[asyncio.TimerHandle] = None
+
+
+class PresenceTracker:
+    def __init__(self, store: PresenceStore, min_interval_ms: float = PRESENCE_MIN_INTERVAL_MS,
+                 typing_ttl: float = PRESENCE_TYPING_TTL_SECONDS):
+        self.store = store
+        self.min_interval = min_interval_ms / 1000
+        self.typing_ttl = typing_ttl
+        # (sala, usuário) -> sockets locais; presença só muda no primeiro / último
+        self.sockets: Dict[Tuple[int, int], int] = defaultdict(int)
+        # status já publicado de cada (sala, usuário) com socket local
+        self.status: Dict[Tuple[int, int], str] = {}
+        # (sala, usuário) -> quando o "digitando" expira
+        self.typing_until: Dict[Tuple[int, int], float] = {}
+        # (remetente, destinatário) -> último aviso de digitação em DM
+        self.dm_typing_sent: Dict[Tuple[int, int], float] = {}
+        self.pending: Dict[int, _PendingDelta] = {}
+        self.last_flush: Dict[int, float] = {}
+
+    async def join(self, connection: Connection, room_id: int, user_id: int):
+        """Manda o snapshot da sala para o socket novo e anuncia o usuário"""
+        key = (room_id, user_id)
+        self.sockets[key] += 1
+        if self.sockets[key] == 1:
+            self.status[key] = "online"
+            await self.store.set(room_id, user_id, "online")
+            self._change(room_id, user_id, status="online")
+        users = await self.store.snapshot(room_id)
+        connection.enqueue(Frame({
+            "type": "presence",
+            "room_id": room_id,
+            "snapshot": True,
+            "users": [{"user_id": uid, "status": status} for uid, status in users.items()],
+        }))
+
+    async def leave(self, room_id: int, user_id: int):
+        key = (room_id, user_id)
+        if key not in self.sockets:
+            return
+        self.sockets[key] -= 1
+        if self.sockets[key] > 0:
+            return
+        del self.sockets[key]
+        self.status.pop(key, None)
+        self.typing_until.pop(key, None)
+        await self.store.remove(room_id, user_id)
+        self._change(room_id, user_id, status="offline", typing=False)
+
+    async def set_status(self, room_id: int, user_id: int, status: str):
+        key = (room_id, user_id)
+        if status not in STATUSES or key not in self.sockets or self.status.get(key) == status:
+            return
+        self.status[key] = status
+        await self.store.set(room_id, user_id, status)
+        self._change(room_id, user_id, status=status)
+
+    async def refresh(self):
+        """Chamado pelo heartbeat: renova o TTL das salas com sockets neste processo"""
+        room_ids = {room_id for room_id, _ in self.sockets}
+        if room_ids:
+            await self.store.refresh(room_ids)
+
+    def typing(self, room_id: int, user_id: int):
+        """Cliente avisou que está digitando; renovações não geram frame"""
+        key = (room_id, user_id)
+        if key not in self.sockets:
+            return
+        already = key in self.typing_until
+        self.typing_until[key] = time.monotonic() + self.typing_ttl
+        if not already:
+            self._change(room_id, user_id, typing=True)
+            asyncio.get_running_loop().call_later(self.typing_ttl, self._expire_typing, key)
+
+    def stop_typing(self, room_id: int, user_id: int):
+        """Mensagem enviada: o "digitando" acaba na hora"""
+        if self.typing_until.pop((room_id, user_id), None) is not None:
+            self._change(room_id, user_id, typing=False)
+
+    async def typing_dm(self, sender_id: int, receiver_id: int):
+        """Digitação em DM vai direto para o destinatário, no máximo uma vez por TTL"""
+        now = time.monotonic()
+        key = (sender_id, receiver_id)
+        if now - self.dm_typing_sent.get(key, float("-inf")) < self.typing_ttl:
+            return
+        self.dm_typing_sent[key] = now
+        if len(self.dm_typing_sent) > 100_000:
+            self.dm_typing_sent = {k: t for k, t in self.dm_typing_sent.items() if now - t < self.typing_ttl}
+        await broker.publish(f"dm:{receiver_id}", {"type": "typing", "sender_id": sender_id})
+
+    def _expire_typing(self, key: Tuple[int, int]):
+        until = self.typing_until.get(key)
+        if until is None:
+            return
+        remaining = until - time.monotonic()
+        if remaining > 0:
+            asyncio.get_running_loop().call_later(remaining, self._expire_typing, key)
+            return
+        del self.typing_until[key]
+        self._change(key[0], key[1], typing=False)
+
+    def _change(self, room_id: int, user_id: int, status: Optional[str] = None,
+                typing: Optional[bool] = None):
+        delta = self.pending.get(room_id)
+        if delta is None:
+            delta = self.pending[room_id] = _PendingDelta()
+        if status is not None:
+            delta.status[user_id] = status
+        if typing is not None:
+            delta.typing[user_id] = typing
+        if delta.timer is None:
+            wait = self.last_flush.get(room_id, float("-inf")) + self.min_interval - time.monotonic()
+            delta.timer = asyncio.get_running_loop().call_later(max(0.0, wait), self._flush, room_id)
+
+    def _flush(self, room_id: int):
+        delta = self.pending.pop(room_id, None)
+        if delta is None:
+            return
+        self.last_flush[room_id] = time.monotonic()
+        if len(self.last_flush) > 100_000:
+            self.last_flush.clear()
+        frame = {"type": "presence", "room_id": room_id}
+        if delta.status:
+            frame["status"] = [{"user_id": uid, "status": s} for uid, s in delta.status.items()]
+        if delta.typing:
+            frame["typing"] = [{"user_id": uid, "typing": t} for uid, t in delta.typing.items()]
+        asyncio.create_task(self._publish(room_id, frame))
+
+    async def _publish(self, room_id: int, frame: dict):
+        try:
+            await broker.publish(f"room:{room_id}", frame)
+        except Exception:
+            logger.exception("Falha ao publicar presença da sala %s", room_id)
+
+
+presence = PresenceTracker(get_presence_store())
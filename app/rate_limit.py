@@ -0,0 +1,178 @@
+import math
+import os
+import time
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+
+from fastapi import Depends, HTTPException, Request, status
+
+from app import models
+from app.auth_utils import get_current_user
+from app.broker import BROKER_BACKEND, REDIS_URL
+from app.metrics import Counter
+
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "true").lower() in ("1", "true", "yes")
+# "memory" (por processo) ou "redis" (compartilhado entre workers); segue o broker por padrão
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", BROKER_BACKEND)
+# mensagens por segundo (reposição do balde) e rajada máxima; taxa 0 desliga o limite
+RATE_LIMIT_USER_PER_SECOND = float(os.getenv("RATE_LIMIT_USER_PER_SECOND", "5"))
+RATE_LIMIT_USER_BURST = float(os.getenv("RATE_LIMIT_USER_BURST", "20"))
+RATE_LIMIT_ROOM_PER_SECOND = float(os.getenv("RATE_LIMIT_ROOM_PER_SECOND", "100"))
+RATE_LIMIT_ROOM_BURST = float(os.getenv("RATE_LIMIT_ROOM_BURST", "300"))
+RATE_LIMIT_IP_PER_SECOND = float(os.getenv("RATE_LIMIT_IP_PER_SECOND", "20"))
+RATE_LIMIT_IP_BURST = float(os.getenv("RATE_LIMIT_IP_BURST", "60"))
+# baldes guardados pelo backend em memória
+RATE_LIMIT_MAX_KEYS = int(os.getenv("RATE_LIMIT_MAX_KEYS", "100000"))
+
+# (escopo, chave, taxa, rajada)
+Limit = Tuple[str, str, float, float]
+# (segundos até poder tentar de novo, escopo que bloqueou); (0, None) = liberado
+Decision = Tuple[float, Optional[str]]
+
+rate_limited = Counter("chat_rate_limited_total", "Envios recusados pelo limite de taxa.", ("scope",))
+
+
+# MARK: - Backends
+# Token bucket: cada chave tem até `rajada` fichas, repostas a `taxa` por segundo;
+# cada mensagem gasta uma ficha de cada balde envolvido, e só se todos tiverem.
+
+class RateLimiter:
+    async def acquire(self, limits: List[Limit]) -> Decision:
+        raise NotImplementedError
+
+
+class InMemoryRateLimiter(RateLimiter):
+    def __init__(self, max_keys: int = RATE_LIMIT_MAX_KEYS):
+        self.max_keys = max_keys
+        # chave -> (fichas, atualizado_em)
+        self.buckets: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()
+
+    async def acquire(self, limits: List[Limit]) -> Decision:
+        now = time.monotonic()
+        refilled = []
+        retry_after, blocked_by = 0.0, None
+        for scope, key, rate, burst in limits:
+            tokens, updated = self.buckets.get(key, (burst, now))
+            tokens = min(burst, tokens + (now - updated) * rate)
+            refilled.append(tokens)
+            if tokens < 1 and (1 - tokens) / rate > retry_after:
+                retry_after, blocked_by = (1 - tokens) / rate, scope
+
+        for (scope, key, rate, burst), tokens in zip(limits, refilled):
+            self.buckets[key] = (tokens if blocked_by else tokens - 1, now)
+            self.buckets.move_to_end(key)
+        while len(self.buckets) > self.max_keys:
+            self.buckets.popitem(last=False)
+        return retry_after, blocked_by
+
+
+# KEYS: um balde por limite; ARGV: taxa e rajada de cada um, na mesma ordem.
+# Usa o relógio do Redis para que workers com relógios diferentes concordem.
+_ACQUIRE_SCRIPT = """
+local now_parts = redis.call('TIME')
+local now = tonumber(now_parts[1]) + tonumber(now_parts[2]) / 1000000
+local tokens = {}
+local retry_after, blocked = 0, 0
+for i, key in ipairs(KEYS) do
+    local rate = tonumber(ARGV[2 * i - 1])
+    local burst = tonumber(ARGV[2 * i])
+    local state = redis.call('HMGET', key, 'tokens', 'ts')
+    local current = tonumber(state[1]) or burst
+    local ts = tonumber(state[2]) or now
+    current = math.min(burst, current + math.max(0, now - ts) * rate)
+    tokens[i] = current
+    if current < 1 and (1 - current) / rate > retry_after then
+        retry_after, blocked = (1 - current) / rate, i
+    end
+end
+for i, key in ipairs(KEYS) do
+    local rate = tonumber(ARGV[2 * i - 1])
+    local burst = tonumber(ARGV[2 * i])
+    local current = tokens[i]
+    if blocked == 0 then current = current - 1 end
+    redis.call('HSET', key, 'tokens', current, 'ts', now)
+    redis.call('PEXPIRE', key, math.ceil(burst / rate * 1000) + 1000)
+end
+return {tostring(retry_after), blocked}
+"""
+
+
+class RedisRateLimiter(RateLimiter):
+    """Baldes num hash do Redis, lidos e gastos atomicamente por um script Lua"""
+
+    def __init__(self, url: str):
+        import redis.asyncio as redis
+
+        self.redis = redis.from_url(url)
+        self.script = self.redis.register_script(_ACQUIRE_SCRIPT)
+
+    async def acquire(self, limits: List[Limit]) -> Decision:
+        keys = [f"ratelimit:{key}" for _, key, _, _ in limits]
+        args = [value for _, _, rate, burst in limits for value in (rate, burst)]
+        retry_after, blocked = await self.script(keys=keys, args=args)
+        if not int(blocked):
+            return 0.0, None
+        return float(retry_after), limits[int(blocked) - 1][0]
+
+
+def get_rate_limiter() -> RateLimiter:
+    if RATE_LIMIT_BACKEND == "redis":
+        return RedisRateLimiter(REDIS_URL or "redis://localhost:6379/0")
+    if RATE_LIMIT_BACKEND == "memory":
+        return InMemoryRateLimiter()
+    raise ValueError(f"RATE_LIMIT_BACKEND inválido: {RATE_LIMIT_BACKEND}")
+
+
+rate_limiter = get_rate_limiter()
+
+
+# MARK: - Limites das mensagens
+
+def message_limits(user_id: int, ip: Optional[str], room_id: Optional[int] = None) -> List[Limit]:
+    limits = []
+    if RATE_LIMIT_USER_PER_SECOND > 0:
+        limits.append(("user", f"user:{user_id}", RATE_LIMIT_USER_PER_SECOND, RATE_LIMIT_USER_BURST))
+    if room_id is not None and RATE_LIMIT_ROOM_PER_SECOND > 0:
+        limits.append(("room", f"room:{room_id}", RATE_LIMIT_ROOM_PER_SECOND, RATE_LIMIT_ROOM_BURST))
+    if ip and RATE_LIMIT_IP_PER_SECOND > 0:
+        limits.append(("ip", f"ip:{ip}", RATE_LIMIT_IP_PER_SECOND, RATE_LIMIT_IP_BURST))
+    return limits
+
+
+async def check_message_rate(user_id: int, ip: Optional[str], room_id: Optional[int] = None) -> float:
+    """0 se o envio pode seguir; senão, segundos até a próxima ficha"""
+    if not RATE_LIMIT_ENABLED:
+        return 0.0
+    limits = message_limits(user_id, ip, room_id)
+    if not limits:
+        return 0.0
+    retry_after, scope = await rate_limiter.acquire(limits)
+    if scope is not None:
+        rate_limited.inc(1, scope)
+    return retry_after
+
+
+def _too_many_requests(retry_after: float) -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+        detail="Muitas mensagens, tente novamente em instantes",
+        headers={"Retry-After": str(max(1, math.ceil(retry_after)))})
+
+
+async def limit_room_messages(room_id: int, request: Request, current_user: models.User):
+    """Chamada por POST /rooms/{room_id}/messages depois de checar o pertencimento à sala"""
+    ip = request.client.host if request.client else None
+    retry_after = await check_message_rate(current_user.id, ip, room_id)
+    if retry_after:
+        raise _too_many_requests(retry_after)
+
+
+async def limit_direct_messages(
+    request: Request,
+    current_user: models.User = Depends(get_current_user)
+):
+    """Dependência de POST /messages/direct/{receiver_id}"""
+    ip = request.client.host if request.client else None
+    retry_after = await check_message_rate(current_user.id, ip)
+    if retry_after:
+        raise _too_many_requests(retry_after)
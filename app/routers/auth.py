@@ -1,12 +1,12 @@
 from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
-from passlib.hash import bcrypt
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from app import models, schemas
 from app.db import get_db
+from app.hashing import password_hasher
 from fastapi.security import OAuth2PasswordRequestForm
 from datetime import datetime, timedelta
 from jose import JWTError, jwt
-from passlib.hash import bcrypt
 import os
 
 
@@ -19,15 +19,16 @@ router = APIRouter(prefix="/auth", tags=["Auth"])
 
 
 @router.post("/signup", response_model=schemas.UserOut)
-def signup(user: schemas.UserCreate, db: Session = Depends(get_db)):
-    if db.query(models.User).filter(models.User.username == user.username).first():
+async def signup(user: schemas.UserCreate, db: AsyncSession = Depends(get_db)):
+    if await db.scalar(select(models.User).where(models.User.username == user.username)):
         raise HTTPException(status_code=400, detail="Usuário já existe")
-    hashed_pw = bcrypt.hash(user.password)
+    # bcrypt é pesado em CPU: roda no pool de processos dedicado
+    hashed_pw = await password_hasher.hash(user.password)
     db_user = models.User(username=user.username,
                           hashed_password=hashed_pw)
     db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
+    await db.commit()
+    await db.refresh(db_user)
     return db_user
 
 
@@ -39,10 +40,14 @@ def create_access_token(data: dict, expires_delta: timedelta | None = None):
 
 
 @router.post("/login")
-def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
-    user = db.query(models.User).filter(
-        models.User.username == form_data.username).first()
-    if not user or not bcrypt.verify(form_data.password, user.hashed_password):
+async def login(form_data: OAuth2PasswordRequestForm = Depends(), db: AsyncSession = Depends(get_db)):
+    user = await db.scalar(select(models.User).where(
+        models.User.username == form_data.username))
+    if not user or not await password_hasher.verify(form_data.password, user.hashed_password):
         raise HTTPException(status_code=401, detail="Credenciais inválidas")
+    # custo do bcrypt mudou: regrava o hash com a senha que acabou de ser validada
+    if password_hasher.needs_rehash(user.hashed_password):
+        user.hashed_password = await password_hasher.hash(form_data.password)
+        await db.commit()
     access_token = create_access_token(data={"sub": user.username})
     return {"access_token": access_token, "token_type": "bearer"}
@@ -1,11 +1,17 @@
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from sqlalchemy import or_, select
+from sqlalchemy.ext.asyncio import AsyncSession
 from app import models, schemas
-from app.db import get_db
+from app.db import get_db, get_read_db, read_session
 from datetime import datetime
+from typing import Optional
 from app.auth_utils import get_current_user
-import asyncio
 from app.dm_connection_manager import dm_manager
+from app.write_batcher import MESSAGE_WRITE_BEHIND, direct_message_writer
+from app.conversations import find_conversation, get_or_create_conversation, update_summaries
+from app.archive import archive_page, database_since, naive_utc, read_through
+from app.rate_limit import limit_direct_messages
+from app.export import direct_export_query, export_response, stream_rows
 
 
 router = APIRouter(prefix="/messages", tags=["Messages"])
@@ -14,42 +20,129 @@ router = APIRouter(prefix="/messages", tags=["Messages"])
 
 # MARK: - Send Direct message
 
-@router.post("/direct/{receiver_id}")
+async def save_direct_message(db: AsyncSession, sender_id: int, receiver_id: int, content: str) -> models.DirectMessage:
+    conversation = await get_or_create_conversation(db, sender_id, receiver_id)
+    values = dict(
+        conversation_id=conversation.id,
+        sender_id=sender_id,
+        receiver_id=receiver_id,
+        content=content,
+        timestamp=datetime.utcnow()
+    )
+    if MESSAGE_WRITE_BEHIND:
+        # a conversa precisa existir antes do lote (que usa outra sessão)
+        await db.commit()
+        # gravado em lote junto com outras mensagens (group commit)
+        return await direct_message_writer.insert(values)
+
+    direct_msg = models.DirectMessage(**values)
+    db.add(direct_msg)
+    await db.flush()
+    await update_summaries(db, [direct_msg])
+    await db.commit()
+    return direct_msg
+
+
+@router.post("/direct/{receiver_id}", dependencies=[Depends(limit_direct_messages)])
 async def send_direct_message(
     receiver_id: int,
     msg: schemas.MessageCreate,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user: models.User = Depends(get_current_user)
 ):
-    receiver = db.query(models.User).filter(
-        models.User.id == receiver_id).first()
+    receiver = await db.scalar(select(models.User).where(
+        models.User.id == receiver_id))
     if not receiver:
         raise HTTPException(
             status_code=404, detail="Usuário de destino não encontrado")
 
-    direct_msg = models.DirectMessage(
-        sender_id=current_user.id,
-        receiver_id=receiver_id,
-        content=msg.content
-    )
-    db.add(direct_msg)
-    db.commit()
-    db.refresh(direct_msg)
+    direct_msg = await save_direct_message(db, current_user.id, receiver_id, msg.content)
 
-    await asyncio.create_task(dm_manager.send_direct_message(receiver_id, message=direct_msg))
+    # só enfileira: não espera a entrega aos sockets
+    await dm_manager.send_direct_message(receiver_id, message=direct_msg)
 
     return {"message": "Mensagem direta enviada com sucesso"}
 
 # MARK: - Get Direct messages
 
-@router.get("/direct/{receiver_id}")
-def get_direct_messages(
+@router.get("/direct/{receiver_id}", response_model=schemas.DirectMessagePage)
+async def get_direct_messages(
+    receiver_id: int,
+    before: Optional[int] = None,
+    after: Optional[int] = None,
+    limit: int = Query(50, ge=1, le=200),
+    db: AsyncSession = Depends(get_read_db),
+    current_user: models.User = Depends(get_current_user)
+):
+    conversation = await find_conversation(db, current_user.id, receiver_id)
+    if conversation is None:
+        return {"messages": [], "next_cursor": None}
+
+    # as duas direções da conversa, paginadas pelo índice (conversation_id, id) e pelo arquivo
+    query = select(models.DirectMessage).where(
+        models.DirectMessage.conversation_id == conversation.id)
+    messages, next_cursor = await archive_page(
+        db, query, models.DirectMessage.id, "direct_messages", conversation.id, before, after, limit)
+
+    return {"messages": messages, "next_cursor": next_cursor}
+
+# MARK: - Export Direct messages
+
+@router.get("/direct/{receiver_id}/export")
+async def export_direct_messages(
     receiver_id: int,
-    db: Session = Depends(get_db),
+    request: Request,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    gzip: bool = False,
+    db: AsyncSession = Depends(get_read_db),
     current_user: models.User = Depends(get_current_user)
 ):
-    messages = db.query(models.DirectMessage).filter_by(
-        sender_id=current_user.id, receiver_id=receiver_id
-    ).all()
+    """Conversa completa (ou entre `since` e `until`) em NDJSON, enviada enquanto é lida"""
+    conversation = await find_conversation(db, current_user.id, receiver_id)
+    since, until = naive_utc(since), naive_utc(until)
+    key = None if conversation is None else conversation.id
+    query = None if key is None else direct_export_query(key, database_since("direct_messages", since), until)
+
+    batches = read_through("direct_messages", key, since, until, stream_rows(read_session(request), query))
+    return export_response(batches, f"dm-{current_user.id}-{receiver_id}", gzip)
+
+# MARK: - List conversations
+
+@router.get("/conversations", response_model=schemas.ConversationPage)
+async def list_conversations(
+    before: Optional[int] = None,
+    limit: int = Query(20, ge=1, le=100),
+    db: AsyncSession = Depends(get_read_db),
+    current_user: models.User = Depends(get_current_user)
+):
+    # lê só as linhas de resumo (+ a última mensagem pela PK), da mais recente para a mais antiga;
+    # outer join: a última mensagem de uma conversa antiga pode já estar no arquivo
+    query = (
+        select(models.Conversation, models.DirectMessage)
+        .outerjoin(models.DirectMessage,
+              models.DirectMessage.id == models.Conversation.last_message_id)
+        .where(or_(models.Conversation.user_a_id == current_user.id,
+                   models.Conversation.user_b_id == current_user.id),
+               # conversa criada sem mensagem gravada (lote falhou): sem resumo, fora do cursor
+               # (no Postgres o NULL viria primeiro no DESC e quebraria o keyset)
+               models.Conversation.last_message_id.is_not(None))
+    )
+    if before is not None:
+        query = query.where(models.Conversation.last_message_id < before)
+    rows = (await db.execute(
+        query.order_by(models.Conversation.last_message_id.desc()).limit(limit + 1))).all()
 
-    return messages
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    conversations = [
+        {
+            "id": conversation.id,
+            "other_user_id": conversation.user_b_id
+            if conversation.user_a_id == current_user.id else conversation.user_a_id,
+            "last_message": last_message,
+        }
+        for conversation, last_message in rows
+    ]
+    next_cursor = rows[-1][0].last_message_id if has_more else None
+    return {"conversations": conversations, "next_cursor": next_cursor}
@@ -1,105 +1,132 @@
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session, joinedload
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
 from app import models, schemas
-from app.db import get_db
+from app.db import SessionLocal, get_db, get_read_db, read_session
 from app.auth_utils import get_current_user
-import asyncio
 from datetime import datetime
+from functools import partial
+from typing import Dict, List, Optional
 from app.connection_manager import manager
+from app.membership import membership
+from app.presence import presence
+from app.rate_limit import limit_room_messages
+from app.pagination import keyset_page
+from app.archive import archive, archive_page, database_since, naive_utc, read_through
+from app.message_cache import RECENT_MESSAGES_PER_ROOM, recent_messages
+from app.write_batcher import MESSAGE_WRITE_BEHIND, message_writer
+from app.export import export_response, room_export_query, stream_rows
 
 router = APIRouter(prefix="/rooms", tags=["Rooms"])
 
 # MARK: - Create
 @router.post("/", response_model=schemas.Room)
-def create_room(
+async def create_room(
     room: schemas.RoomCreate,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user: models.User = Depends(get_current_user)
 ):
-    db_room = models.Room(name=room.name, owner_id=current_user.id)
+    db_room = models.Room(name=room.name, owner_id=current_user.id, member_count=1)
     db.add(db_room)
-    db.commit()
-    db.refresh(db_room)
+    await db.commit()
+    await db.refresh(db_room)
 
     # adiciona automaticamente o criador à sala
     user_room = models.UserRoom(user_id=current_user.id, room_id=db_room.id)
     db.add(user_room)
-    db.commit()
+    await db.commit()
+    # carrega os membros aqui: em sessão assíncrona não há lazy load na serialização
+    await db.refresh(db_room, attribute_names=["users"])
 
     return db_room
 
 # MARK: - Delete
 @router.delete("/{room_id}")
-def delete_room(
+async def delete_room(
     room_id: int,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user: models.User = Depends(get_current_user)
 ):
-    room = db.query(models.Room).filter(models.Room.id == room_id).first()
+    room = await db.scalar(select(models.Room).where(models.Room.id == room_id))
     if not room:
         raise HTTPException(status_code=404, detail="Sala não encontrada")
     if room.owner_id != current_user.id:
         raise HTTPException(
             status_code=403, detail="Apenas o dono pode excluir a sala")
 
-    db.delete(room)
-    db.commit()
+    await db.delete(room)
+    await db.commit()
+    await membership.invalidate(room_id)
+    await recent_messages.invalidate(room_id)
     return {"message": "Sala removida com sucesso"}
 
 
 # MARK: - Enter
+
+async def _add_to_member_count(db: AsyncSession, room_id: int, delta: int):
+    # incremento atômico no banco: seguro com requisições concorrentes
+    await db.execute(
+        update(models.Room)
+        .where(models.Room.id == room_id)
+        .values(member_count=models.Room.member_count + delta)
+    )
+
 @router.post("/{room_id}/enter")
-def join_room(
+async def join_room(
     room_id: int,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user: models.User = Depends(get_current_user)
 ):
-    room = db.query(models.Room).filter(models.Room.id == room_id).first()
+    room = await db.scalar(select(models.Room).where(models.Room.id == room_id))
     if not room:
         raise HTTPException(status_code=404, detail="Sala não encontrada")
 
-    already_in_room = db.query(models.UserRoom).filter_by(
+    already_in_room = await db.scalar(select(models.UserRoom).filter_by(
         user_id=current_user.id, room_id=room_id
-    ).first()
+    ))
     if already_in_room:
         raise HTTPException(status_code=400, detail="Você já está na sala")
 
     db.add(models.UserRoom(user_id=current_user.id, room_id=room_id))
-    db.commit()
+    await _add_to_member_count(db, room_id, 1)
+    await db.commit()
+    await membership.invalidate(room_id, current_user.id)
     return {"message": f"Usuário {current_user.username} entrou na sala {room.name}"}
 
 # MARK: - Leave
 @router.delete("/{room_id}/leave")
-def leave_room(
+async def leave_room(
     room_id: int,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user: models.User = Depends(get_current_user)
 ):
-    relation = db.query(models.UserRoom).filter_by(
+    relation = await db.scalar(select(models.UserRoom).filter_by(
         user_id=current_user.id, room_id=room_id
-    ).first()
+    ))
     if not relation:
         raise HTTPException(status_code=400, detail="Você não está nessa sala")
     
-    room = db.query(models.Room).filter(models.Room.id == room_id).first()
+    room = await db.scalar(select(models.Room).where(models.Room.id == room_id))
     if not room:
         raise HTTPException(status_code=404, detail="Sala não encontrada")
     if room.owner_id == current_user.id:
         raise HTTPException(status_code=400, detail="O dono não pode sair da sala")
 
-    db.delete(relation)
-    db.commit()
+    await db.delete(relation)
+    await _add_to_member_count(db, room_id, -1)
+    await db.commit()
+    await membership.invalidate(room_id, current_user.id)
     return {"message": f"{current_user.username} saiu da sala {room.name}"}
 
 # MARK: - Remove user
 @router.delete("/{room_id}/users/{user_id}")
-def remove_user_from_room(
+async def remove_user_from_room(
     room_id: int,
     user_id: int,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user: models.User = Depends(get_current_user)
 ):
-    room = db.query(models.Room).filter(models.Room.id == room_id).first()
+    room = await db.scalar(select(models.Room).where(models.Room.id == room_id))
     if not room:
         raise HTTPException(status_code=404, detail="Sala não encontrada")
     if room.owner_id != current_user.id:
@@ -110,76 +137,167 @@ def remove_user_from_room(
         raise HTTPException(
             status_code=400, detail="O dono da sala não pode ser removido")
     
-    relation = db.query(models.UserRoom).filter_by(
+    relation = await db.scalar(select(models.UserRoom).filter_by(
         user_id=user_id, room_id=room_id
-    ).first()
+    ))
     if not relation:
         raise HTTPException(status_code=404, detail="Usuário não está na sala")
 
-    db.delete(relation)
-    db.commit()
+    await db.delete(relation)
+    await _add_to_member_count(db, room_id, -1)
+    await db.commit()
+    await membership.invalidate(room_id, user_id)
     return {"message": f"Usuário removido da sala {room.name}"}
 
 # MARK: - Send messages
 
-def _user_in_room(room: models.Room, user_id: int) -> bool:
-    # tenta usar relação room.users (mais comum). Ajuste se seu modelo for outro.
-    try:
-        users = getattr(room, "users", None)
-        if users is None:
-            return False
-        return any(u.id == user_id for u in users)
-    except Exception:
-        return False
+async def _check_room_access(db: AsyncSession, room_id: int, user_id: int, detail: str):
+    # caminho comum: membro em cache, sem nenhuma consulta à sala
+    if await membership.is_member(db, room_id, user_id):
+        return
+    room = await db.scalar(select(models.Room).where(models.Room.id == room_id))
+    if not room:
+        raise HTTPException(status_code=404, detail="Sala não encontrada")
+    raise HTTPException(status_code=403, detail=detail)
+
+
+async def save_message(db: AsyncSession, room_id: int, user_id: int, content: str) -> models.Message:
+    values = dict(
+        room_id=room_id,
+        user_id=user_id,
+        content=content,
+        timestamp=datetime.utcnow()
+    )
+    if MESSAGE_WRITE_BEHIND:
+        # gravado em lote junto com outras mensagens (group commit)
+        message = await message_writer.insert(values)
+    else:
+        message = models.Message(**values)
+        db.add(message)
+        await db.commit()
+        await db.refresh(message)
+
+    await recent_messages.append(room_id, manager.message_to_dict(message=message))
+    return message
 
 
 @router.post("/{room_id}/messages")
 async def send_message(
     room_id: int,
     msg: schemas.MessageCreate, 
-    db: Session = Depends(get_db), 
+    request: Request,
+    db: AsyncSession = Depends(get_db), 
     current_user: models.User = Depends(get_current_user)
     ):
-    room = db.query(models.Room).filter(models.Room.id == room_id).first()
-    if not room:
-        raise HTTPException(status_code=404, detail="Sala não encontrada")
+    await _check_room_access(
+        db, room_id, current_user.id, "Você não faz parte desta sala")
+    # só membros gastam fichas: de fora, ninguém esvazia o balde da sala
+    await limit_room_messages(room_id, request, current_user)
 
-    if not _user_in_room(room, current_user.id):
-        raise HTTPException(
-            status_code=403, detail="Você não faz parte desta sala")
+    message = await save_message(db, room_id, current_user.id, msg.content)
+    presence.stop_typing(room_id, current_user.id)
 
-    message = models.Message(
-        room_id=room.id,
-        user_id=current_user.id,
-        content=msg.content,
-        timestamp=datetime.utcnow()
-    )
-    db.add(message)
-    db.commit()
-    db.refresh(message)
-
-    
-    await asyncio.create_task(manager.broadcast(room_id, message=message))
+    # só enfileira: não espera a entrega aos sockets
+    await manager.broadcast(room_id, message=message)
 
     return message
 
 # MARK: - Get messages
 
-@router.get("/{room_id}/messages")
-def get_messages(room_id: int, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
-    room = db.query(models.Room).filter(models.Room.id == room_id).first()
-    if not room:
-        raise HTTPException(status_code=404, detail="Sala não encontrada")
+async def load_recent_messages(room_id: int) -> List[dict]:
+    """Carga do buffer de mensagens recentes (RECENT_MESSAGES_PER_ROOM + 1, em ordem crescente)"""
+    # aquece sempre pelo primário: uma réplica atrasada deixaria buracos no buffer
+    async with SessionLocal() as primary:
+        rows = (await primary.scalars(
+            select(models.Message)
+            .where(models.Message.room_id == room_id)
+            .order_by(models.Message.id.desc())
+            .limit(RECENT_MESSAGES_PER_ROOM + 1))).all()
+    return [manager.message_to_dict(message=m) for m in reversed(rows)]
 
-    if not _user_in_room(room, current_user.id):
-        raise HTTPException(
-            status_code=403, detail="Você não tem acesso a esta sala")
 
-    messages = db.query(models.Message).filter(
-        models.Message.room_id == room_id).all()
-    return messages
+@router.get("/{room_id}/messages", response_model=schemas.MessagePage)
+async def get_messages(
+    room_id: int,
+    before: Optional[int] = None,
+    after: Optional[int] = None,
+    limit: int = Query(50, ge=1, le=200),
+    db: AsyncSession = Depends(get_read_db),
+    current_user: models.User = Depends(get_current_user)
+):
+    await _check_room_access(
+        db, room_id, current_user.id, "Você não tem acesso a esta sala")
+
+    # caso mais comum (última tela da sala): servido do buffer em memória
+    if before is None and after is None:
+        cached = await recent_messages.latest(room_id, limit, partial(load_recent_messages, room_id))
+        # buffer "completo" só no banco: o começo da sala pode estar no arquivo
+        if cached is not None and (cached[1] is not None or not archive.has("messages", room_id)):
+            messages, next_cursor = cached
+            return {"messages": messages, "next_cursor": next_cursor}
+
+    # paginação por cursor sobre o índice (room_id, id), completando com o arquivo
+    query = select(models.Message).where(models.Message.room_id == room_id)
+    messages, next_cursor = await archive_page(
+        db, query, models.Message.id, "messages", room_id, before, after, limit)
+
+    return {"messages": messages, "next_cursor": next_cursor}
+
+# MARK: - Export
+
+@router.get("/{room_id}/export")
+async def export_messages(
+    room_id: int,
+    request: Request,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    gzip: bool = False,
+    db: AsyncSession = Depends(get_read_db),
+    current_user: models.User = Depends(get_current_user)
+):
+    """Histórico completo (ou entre `since` e `until`) em NDJSON, enviado enquanto é lido"""
+    await _check_room_access(
+        db, room_id, current_user.id, "Você não tem acesso a esta sala")
+
+    since, until = naive_utc(since), naive_utc(until)
+    query = room_export_query(room_id, database_since("messages", since), until)
+    batches = read_through("messages", room_id, since, until, stream_rows(read_session(request), query))
+    return export_response(batches, f"room-{room_id}", gzip)
 
 # MARK: - Get all rooms
-@router.get("/", response_model=list[schemas.Room])
-def list_rooms(db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
-    return db.query(models.Room).options(joinedload(models.Room.users)).all()
+@router.get("/", response_model=schemas.RoomPage)
+async def list_rooms(
+    q: Optional[str] = Query(None, description="Prefixo do nome da sala"),
+    after: Optional[int] = None,
+    limit: int = Query(50, ge=1, le=200),
+    include: Optional[str] = Query(None, pattern="^members$"),
+    db: AsyncSession = Depends(get_read_db),
+    current_user: models.User = Depends(get_current_user)
+):
+    query = select(models.Room)
+    if q:
+        query = query.where(models.Room.name.startswith(q, autoescape=True))
+    # diretório em ordem de criação, paginado por id
+    rooms, next_cursor = await keyset_page(
+        db, query, models.Room.id, None, after or 0, limit)
+
+    # montado campo a campo: `room.users` não pode ser carregado implicitamente
+    summaries = [
+        schemas.RoomSummary(id=room.id, name=room.name, owner_id=room.owner_id,
+                            member_count=room.member_count)
+        for room in rooms
+    ]
+    if include == "members" and summaries:
+        # uma única consulta para os membros de todas as salas da página
+        members: Dict[int, List[models.User]] = {room.id: [] for room in summaries}
+        rows = await db.execute(
+            select(models.UserRoom.room_id, models.User)
+            .join(models.User, models.User.id == models.UserRoom.user_id)
+            .where(models.UserRoom.room_id.in_(members.keys()))
+        )
+        for room_id, user in rows:
+            members[room_id].append(user)
+        for summary in summaries:
+            summary.users = [schemas.User.model_validate(u) for u in members[summary.id]]
+
+    return {"rooms": summaries, "next_cursor": next_cursor}
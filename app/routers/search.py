@@ -0,0 +1,28 @@
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy.ext.asyncio import AsyncSession
+from app import models, schemas
+from app.db import get_read_db
+from app.auth_utils import get_current_user
+from app.search import search_messages
+
+router = APIRouter(prefix="/search", tags=["Search"])
+
+
+# MARK: - Search messages
+
+@router.get("/messages", response_model=schemas.SearchPage)
+async def search(
+    q: str = Query(..., min_length=1),
+    scope: str = Query("all", pattern="^(all|rooms|dm)$"),
+    limit: int = Query(20, ge=1, le=100),
+    offset: int = Query(0, ge=0, le=1000),
+    db: AsyncSession = Depends(get_read_db),
+    current_user: models.User = Depends(get_current_user)
+):
+    # só espaços não é uma busca (no SQLite viraria MATCH '' e erro de sintaxe do FTS5)
+    if not q.split():
+        raise HTTPException(status_code=422, detail="Informe ao menos um termo de busca")
+    # só salas de que o usuário faz parte e DMs enviadas/recebidas por ele
+    hits = await search_messages(db, current_user.id, q, scope, limit + 1, offset)
+    has_more = len(hits) > limit
+    return {"hits": hits[:limit], "next_offset": offset + limit if has_more else None}
@@ -1,9 +1,13 @@
-from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
-from app import models, schemas, db
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from app import models, schemas
 from app.auth_utils import get_current_user
-from app.db import get_db
-from passlib.hash import bcrypt
+from app.db import get_db, get_read_db
+from app.hashing import password_hasher
+from app.pagination import keyset_page
+from app.user_index import USER_INDEX_IN_MEMORY, user_index
+from typing import Optional
 from fastapi.security import OAuth2PasswordRequestForm
 import os
 from datetime import datetime, timedelta
@@ -21,15 +25,17 @@ router = APIRouter(
 # MARK: - Create 
 
 @router.post("/", response_model=schemas.UserOut)
-def signup(user: schemas.UserCreate, db: Session = Depends(get_db)):
-    if db.query(models.User).filter(models.User.username == user.username).first():
+async def signup(user: schemas.UserCreate, db: AsyncSession = Depends(get_db)):
+    if await db.scalar(select(models.User).where(models.User.username == user.username)):
         raise HTTPException(status_code=400, detail="Usuário já existe")
-    hashed_pw = bcrypt.hash(user.password)
+    # bcrypt é pesado em CPU: roda no pool de processos dedicado
+    hashed_pw = await password_hasher.hash(user.password)
     db_user = models.User(username=user.username,
                           hashed_password=hashed_pw)
     db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
+    await db.commit()
+    await db.refresh(db_user)
+    await user_index.add(db_user)
     return db_user
 
 
@@ -43,34 +49,85 @@ def create_access_token(data: dict, expires_delta: timedelta | None = None):
 
 
 @router.post("/login")
-def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
-    user = db.query(models.User).filter(
-        models.User.username == form_data.username).first()
-    if not user or not bcrypt.verify(form_data.password, user.hashed_password):
+async def login(form_data: OAuth2PasswordRequestForm = Depends(), db: AsyncSession = Depends(get_db)):
+    user = await db.scalar(select(models.User).where(
+        models.User.username == form_data.username))
+    if not user or not await password_hasher.verify(form_data.password, user.hashed_password):
         raise HTTPException(status_code=401, detail="Credenciais inválidas")
+    # custo do bcrypt mudou: regrava o hash com a senha que acabou de ser validada
+    if password_hasher.needs_rehash(user.hashed_password):
+        user.hashed_password = await password_hasher.hash(form_data.password)
+        await db.commit()
     access_token = create_access_token(data={"sub": user.username})
     return {"access_token": access_token, "token_type": "bearer"}
 
 # MARK: - List all users
-# Listar todos os usuários (somente autenticado)
-@router.get("/", response_model=list[schemas.UserOut])
-def list_users(
-    db: Session = Depends(get_db),
+# Listar os usuários, paginado por id (somente autenticado)
+@router.get("/", response_model=schemas.UserPage)
+async def list_users(
+    after: Optional[int] = None,
+    limit: int = Query(50, ge=1, le=200),
+    db: AsyncSession = Depends(get_read_db),
     current_user: models.User = Depends(get_current_user)
 ):
-    users = db.query(models.User).all()
+    users, next_cursor = await keyset_page(
+        db, select(models.User), models.User.id, None, after or 0, limit)
+    return {"users": users, "next_cursor": next_cursor}
+
+
+# MARK: - Search users
+# Autocomplete: usernames que começam com `q`, sem diferenciar maiúsculas
+@router.get("/search", response_model=list[schemas.UserOut])
+async def search_users(
+    q: str = Query(..., min_length=1),
+    limit: int = Query(10, ge=1, le=50),
+    db: AsyncSession = Depends(get_read_db),
+    current_user: models.User = Depends(get_current_user)
+):
+    if USER_INDEX_IN_MEMORY:
+        return await user_index.search(db, q, limit)
+
+    prefix = q.lower()
+    username_lower = func.lower(models.User.username)
+    # LIKE 'prefixo%' sobre lower(username): no Postgres usa o índice text_pattern_ops da 0002
+    conditions = [username_lower.startswith(prefix, autoescape=True)]
+    if db.bind.dialect.name == "sqlite":
+        # o SQLite não usa índice de expressão para LIKE; a faixa sim, e lá a comparação
+        # de texto é binária, então ela não descarta nenhum resultado do LIKE
+        conditions.append(username_lower >= prefix)
+        upper_bound = _prefix_upper_bound(prefix)
+        if upper_bound is not None:
+            conditions.append(username_lower < upper_bound)
+    users = (await db.scalars(
+        select(models.User)
+        .where(*conditions)
+        .order_by(username_lower, models.User.id)
+        .limit(limit)
+    )).all()
     return users
 
 
+def _prefix_upper_bound(prefix: str) -> Optional[str]:
+    """Menor string maior que todas as que começam com `prefix` (None se não houver)"""
+    while prefix:
+        code = ord(prefix[-1]) + 1
+        if 0xD800 <= code <= 0xDFFF:
+            code = 0xE000  # surrogates não existem em UTF-8
+        if code <= 0x10FFFF:
+            return prefix[:-1] + chr(code)
+        prefix = prefix[:-1]
+    return None
+
+
 # MARK: List user by id
 # Buscar um usuário específico (somente autenticado)
 @router.get("/{user_id}", response_model=schemas.UserOut)
-def get_user(
+async def get_user(
     user_id: int,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_read_db),
     current_user: models.User = Depends(get_current_user)
 ):
-    user = db.query(models.User).filter(models.User.id == user_id).first()
+    user = await db.scalar(select(models.User).where(models.User.id == user_id))
     if not user:
         raise HTTPException(status_code=404, detail="Usuário não encontrado")
     return user
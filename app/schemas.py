@@ -30,6 +30,12 @@ class UserOut(BaseModel):
         from_attributes = True
 
 
+class UserPage(BaseModel):
+    users: List[UserOut]
+    # id a ser passado em `after` para a próxima página
+    next_cursor: Optional[int] = None
+
+
 # ============================================================
 # Sala
 # ============================================================
@@ -51,6 +57,23 @@ class Room(RoomBase):
         from_attributes = True
 
 
+class RoomSummary(RoomBase):
+    id: int
+    owner_id: int
+    member_count: int
+    # só preenchido com include=members
+    users: Optional[List[User]] = None
+
+    class Config:
+        from_attributes = True
+
+
+class RoomPage(BaseModel):
+    rooms: List[RoomSummary]
+    # id a ser passado em `after` para a próxima página
+    next_cursor: Optional[int] = None
+
+
 # ============================================================
 # Mensagem (em sala)
 # ============================================================
@@ -73,6 +96,12 @@ class Message(MessageBase):
         from_attributes = True
 
 
+class MessagePage(BaseModel):
+    messages: List[Message]
+    # id a ser passado em `before` (ou `after`) para buscar a próxima página
+    next_cursor: Optional[int] = None
+
+
 # ============================================================
 # Mensagem direta (DM)
 # ============================================================
@@ -87,9 +116,52 @@ class DirectMessageCreate(DirectMessageBase):
 
 class DirectMessage(DirectMessageBase):
     id: int
+    conversation_id: Optional[int] = None
     sender_id: int
     receiver_id: int
     timestamp: datetime
 
     class Config:
         from_attributes = True
+
+
+class DirectMessagePage(BaseModel):
+    messages: List[DirectMessage]
+    next_cursor: Optional[int] = None
+
+
+# ============================================================
+# Conversa (DM)
+# ============================================================
+
+class ConversationSummary(BaseModel):
+    id: int
+    other_user_id: int
+    last_message: Optional[DirectMessage] = None
+
+
+class ConversationPage(BaseModel):
+    conversations: List[ConversationSummary]
+    # last_message_id a ser passado em `before` para a próxima página
+    next_cursor: Optional[int] = None
+
+
+# ============================================================
+# Busca
+# ============================================================
+
+class SearchHit(BaseModel):
+    kind: str  # "room" ou "dm"
+    id: int
+    content: str
+    timestamp: datetime
+    room_id: Optional[int] = None
+    user_id: Optional[int] = None
+    sender_id: Optional[int] = None
+    receiver_id: Optional[int] = None
+    rank: float
+
+
+class SearchPage(BaseModel):
+    hits: List[SearchHit]
+    next_offset: Optional[int] = None
@@ -0,0 +1,107 @@
+from typing import List
+
+from sqlalchemy import DDL, event, text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app import models
+
+# MARK: - Índices de busca
+# Criados junto com as tabelas. No Postgres, uma coluna tsvector gerada (mantida
+# pelo próprio banco a cada INSERT/UPDATE) + índice GIN; no SQLite, uma tabela
+# virtual FTS5 de conteúdo externo mantida por triggers.
+
+_POSTGRES_DDL = """
+ALTER TABLE {table} ADD COLUMN search_vector tsvector
+    GENERATED ALWAYS AS (to_tsvector('simple', coalesce(content, ''))) STORED;
+CREATE INDEX ix_{table}_search_vector ON {table} USING GIN (search_vector);
+"""
+
+_SQLITE_DDL = [
+    "CREATE VIRTUAL TABLE {table}_fts USING fts5(content, content='{table}', content_rowid='id')",
+    """CREATE TRIGGER {table}_fts_insert AFTER INSERT ON {table} BEGIN
+        INSERT INTO {table}_fts(rowid, content) VALUES (new.id, new.content);
+    END""",
+    """CREATE TRIGGER {table}_fts_delete AFTER DELETE ON {table} BEGIN
+        INSERT INTO {table}_fts({table}_fts, rowid, content) VALUES ('delete', old.id, old.content);
+    END""",
+    """CREATE TRIGGER {table}_fts_update AFTER UPDATE OF content ON {table} BEGIN
+        INSERT INTO {table}_fts({table}_fts, rowid, content) VALUES ('delete', old.id, old.content);
+        INSERT INTO {table}_fts(rowid, content) VALUES (new.id, new.content);
+    END""",
+]
+
+
+def search_ddl(table: str, dialect: str) -> List[str]:
+    """Comandos que criam o índice de busca de `table` (também usados nas migrações)"""
+    if dialect == "postgresql":
+        return [stmt.strip() for stmt in _POSTGRES_DDL.format(table=table).split(";") if stmt.strip()]
+    if dialect == "sqlite":
+        return [stmt.format(table=table) for stmt in _SQLITE_DDL]
+    return []
+
+
+for _table in (models.Message.__table__, models.DirectMessage.__table__):
+    for _dialect in ("postgresql", "sqlite"):
+        for _statement in search_ddl(_table.name, _dialect):
+            event.listen(_table, "after_create", DDL(_statement).execute_if(dialect=_dialect))
+
+
+# MARK: - Consultas
+
+def _fts5_query(q: str) -> str:
+    # cada termo vira uma string entre aspas (AND implícito): a sintaxe do FTS5 não vaza para o usuário
+    return " ".join('"' + term.replace('"', '""') + '"' for term in q.split())
+
+
+_SQLITE_ROOMS = """
+    SELECT 'room' AS kind, m.id, m.content, m.timestamp, m.room_id, m.user_id,
+           NULL AS sender_id, NULL AS receiver_id, -bm25(messages_fts) AS rank
+    FROM messages_fts JOIN messages m ON m.id = messages_fts.rowid
+    WHERE messages_fts MATCH :q
+      AND m.room_id IN (SELECT room_id FROM user_rooms WHERE user_id = :user_id)
+"""
+_SQLITE_DMS = """
+    SELECT 'dm' AS kind, d.id, d.content, d.timestamp, NULL AS room_id, NULL AS user_id,
+           d.sender_id, d.receiver_id, -bm25(direct_messages_fts) AS rank
+    FROM direct_messages_fts JOIN direct_messages d ON d.id = direct_messages_fts.rowid
+    WHERE direct_messages_fts MATCH :q
+      AND (d.sender_id = :user_id OR d.receiver_id = :user_id)
+"""
+_POSTGRES_ROOMS = """
+    SELECT 'room' AS kind, m.id, m.content, m.timestamp, m.room_id, m.user_id,
+           NULL::integer AS sender_id, NULL::integer AS receiver_id,
+           ts_rank(m.search_vector, plainto_tsquery('simple', :q)) AS rank
+    FROM messages m
+    WHERE m.search_vector @@ plainto_tsquery('simple', :q)
+      AND m.room_id IN (SELECT room_id FROM user_rooms WHERE user_id = :user_id)
+"""
+_POSTGRES_DMS = """
+    SELECT 'dm' AS kind, d.id, d.content, d.timestamp, NULL::integer AS room_id, NULL::integer AS user_id,
+           d.sender_id, d.receiver_id,
+           ts_rank(d.search_vector, plainto_tsquery('simple', :q)) AS rank
+    FROM direct_messages d
+    WHERE d.search_vector @@ plainto_tsquery('simple', :q)
+      AND (d.sender_id = :user_id OR d.receiver_id = :user_id)
+"""
+
+
+async def search_messages(db: AsyncSession, user_id: int, q: str, scope: str,
+                          limit: int, offset: int) -> List[dict]:
+    """Mensagens das salas do usuário e das DMs dele, da mais relevante para a menos"""
+    if not q.split():
+        return []
+    if db.bind.dialect.name == "postgresql":
+        rooms_sql, dms_sql, q_param = _POSTGRES_ROOMS, _POSTGRES_DMS, q
+    else:
+        rooms_sql, dms_sql, q_param = _SQLITE_ROOMS, _SQLITE_DMS, _fts5_query(q)
+
+    parts = []
+    if scope in ("all", "rooms"):
+        parts.append(rooms_sql)
+    if scope in ("all", "dm"):
+        parts.append(dms_sql)
+    sql = " UNION ALL ".join(parts) + " ORDER BY rank DESC, id DESC LIMIT :limit OFFSET :offset"
+
+    rows = await db.execute(text(sql), {
+        "q": q_param, "user_id": user_id, "limit": limit, "offset": offset})
+    return [dict(row._mapping) for row in rows]
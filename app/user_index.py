@@ -0,0 +1,135 @@
+import asyncio
+import bisect
+import os
+from typing import List, Optional, Tuple
+
+from sqlalchemy import event, inspect, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app import models
+from app.broker import broker
+from app.db import DATABASE_URL
+
+# índice ordenado em memória para o autocomplete; ligado por padrão só no SQLite
+USER_INDEX_IN_MEMORY = os.getenv(
+    "USER_INDEX_IN_MEMORY", "true" if (DATABASE_URL or "").startswith("sqlite") else "false"
+).lower() in ("1", "true", "yes")
+# inserções e remoções propagadas entre workers
+USER_INDEX_CHANNEL = "user_index:changes"
+
+Entry = Tuple[str, int, str]  # (username em minúsculas, id, username)
+
+
+def _entry(user_id: int, username: str) -> Entry:
+    return (username.lower(), user_id, username)
+
+
+class UserDirectoryIndex:
+    """Lista ordenada por username (case-insensitive) com busca por prefixo via bisect.
+
+    Carregada do banco na primeira busca; depois só recebe inserções e remoções
+    pontuais, feitas aqui e anunciadas no broker para os demais workers.
+    """
+
+    def __init__(self):
+        self.entries: Optional[List[Entry]] = None
+        # mudanças recebidas durante a carga, aplicadas sobre o snapshot ao final
+        self._pending: Optional[List[Tuple[str, int, str]]] = None
+        self._load_lock = asyncio.Lock()
+        self._subscribed = False
+
+    async def search(self, db: AsyncSession, prefix: str, limit: int) -> List[dict]:
+        if self.entries is None:
+            async with self._load_lock:
+                if self.entries is None:
+                    await self._load(db)
+        prefix = prefix.lower()
+        start = bisect.bisect_left(self.entries, (prefix,))
+        results = []
+        # por índice: nem cópia da cauda (fatia) nem avanço item a item até `start` (islice)
+        for position in range(start, min(start + limit, len(self.entries))):
+            lowered, user_id, username = self.entries[position]
+            if not lowered.startswith(prefix):
+                break
+            results.append({"id": user_id, "username": username})
+        return results
+
+    async def add(self, user: models.User):
+        """Usuário novo: entra no índice local e no dos outros workers"""
+        self._apply("add", user.id, user.username)
+        await broker.publish(USER_INDEX_CHANNEL, {"op": "add", "id": user.id, "username": user.username})
+
+    def changed(self, op: str, user_id: int, username: str):
+        """"add" ou "remove" vindo de um evento do ORM (síncrono): a publicação vai para uma task"""
+        self._apply(op, user_id, username)
+        asyncio.get_running_loop().create_task(
+            broker.publish(USER_INDEX_CHANNEL, {"op": op, "id": user_id, "username": username}))
+
+    def _apply(self, op: str, user_id: int, username: str):
+        if self.entries is None:
+            if self._pending is not None:
+                self._pending.append((op, user_id, username))
+            return
+        entry = _entry(user_id, username)
+        if op == "add":
+            self._insert(entry)
+        else:
+            self._remove(entry)
+
+    def _insert(self, entry: Entry):
+        # idempotente: o próprio worker também recebe o que publicou
+        if self.entries is None:
+            return
+        position = bisect.bisect_left(self.entries, entry)
+        if position == len(self.entries) or self.entries[position] != entry:
+            self.entries.insert(position, entry)
+
+    def _remove(self, entry: Entry):
+        if self.entries is None:
+            return
+        position = bisect.bisect_left(self.entries, entry)
+        if position < len(self.entries) and self.entries[position] == entry:
+            del self.entries[position]
+
+    async def _load(self, db: AsyncSession):
+        # assina e começa a guardar as mudanças antes de ler: o que for publicado
+        # durante a carga é reaplicado sobre o snapshot (inserir/remover é idempotente)
+        await self._ensure_subscribed()
+        self._pending = []
+        try:
+            rows = await db.execute(select(models.User.id, models.User.username))
+            entries = sorted(_entry(user_id, username) for user_id, username in rows)
+        except BaseException:
+            self._pending = None
+            raise
+        pending, self._pending = self._pending, None
+        self.entries = entries
+        for op, user_id, username in pending:
+            self._apply(op, user_id, username)
+
+    async def _ensure_subscribed(self):
+        if not self._subscribed:
+            self._subscribed = True
+            await broker.subscribe(USER_INDEX_CHANNEL, self._on_change)
+
+    async def _on_change(self, message: dict):
+        self._apply(message["op"], message["id"], message["username"])
+
+
+user_index = UserDirectoryIndex()
+
+
+# Só troca de username e exclusão mexem no índice; o rehash da senha no login não.
+@event.listens_for(models.User, "after_update")
+def _update_user_index(mapper, connection, target):
+    history = inspect(target).attrs.username.history
+    if not history.deleted:
+        return
+    for old_username in history.deleted:
+        user_index.changed("remove", target.id, old_username)
+    user_index.changed("add", target.id, target.username)
+
+
+@event.listens_for(models.User, "after_delete")
+def _delete_from_user_index(mapper, connection, target):
+    user_index.changed("remove", target.id, target.username)
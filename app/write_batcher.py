@@ -0,0 +1,116 @@
+import asyncio
+import logging
+import os
+from typing import Awaitable, Callable, List, Optional, Set, Tuple
+
+from sqlalchemy import insert
+
+from app import conversations, db, models
+
+logger = logging.getLogger(__name__)
+
+# liga o modo write-behind (mensagens gravadas em lote)
+MESSAGE_WRITE_BEHIND = os.getenv("MESSAGE_WRITE_BEHIND", "false").lower() in ("1", "true", "yes")
+# quanto tempo esperar por mais mensagens antes de gravar o lote
+MESSAGE_BATCH_WINDOW_MS = float(os.getenv("MESSAGE_BATCH_WINDOW_MS", "5"))
+# tamanho máximo do lote (grava imediatamente ao atingir)
+MESSAGE_BATCH_MAX_SIZE = int(os.getenv("MESSAGE_BATCH_MAX_SIZE", "500"))
+
+
+class WriteBatcher:
+    """Agrupa inserts de um modelo e grava cada lote num único INSERT ... RETURNING"""
+
+    def __init__(self, model, window_ms: float = MESSAGE_BATCH_WINDOW_MS,
+                 max_size: int = MESSAGE_BATCH_MAX_SIZE,
+                 after_insert: Optional[Callable[..., Awaitable[None]]] = None):
+        self.model = model
+        # roda na mesma transação do lote, com as linhas já gravadas
+        self.after_insert = after_insert
+        self.window = window_ms / 1000
+        self.max_size = max_size
+        self.pending: List[Tuple[dict, asyncio.Future]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._writes: Set[asyncio.Task] = set()
+
+    async def insert(self, values: dict):
+        """Enfileira a linha e espera o commit do lote; devolve a linha gravada (com id)"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.pending.append((values, future))
+        if len(self.pending) >= self.max_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self._flush)
+        row = await future
+        # o commit foi feito pela task do lote; marca o cliente desta requisição
+        db.note_commit()
+        return row
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self.pending:
+            return
+        batch, self.pending = self.pending, []
+        task = asyncio.create_task(self._write(batch))
+        self._writes.add(task)
+        task.add_done_callback(self._writes.discard)
+
+    async def _write(self, batch: List[Tuple[dict, asyncio.Future]]):
+        try:
+            rows = await self._insert([values for values, _ in batch])
+        except Exception as exc:
+            if len(batch) == 1:
+                logger.exception("Falha ao gravar %s", self.model.__tablename__)
+                _resolve(batch[0][1], exception=exc)
+                return
+            # uma linha ruim (ex.: sala excluída entre a checagem e o flush) não pode
+            # derrubar as outras: refaz linha a linha, cada uma com o próprio resultado
+            logger.warning("Falha ao gravar lote de %s; regravando linha a linha",
+                           self.model.__tablename__, exc_info=True)
+            for item in batch:
+                await self._write([item])
+            return
+
+        for (_, future), row in zip(batch, rows):
+            _resolve(future, result=row)
+
+    async def _insert(self, values: List[dict]) -> list:
+        """Um INSERT ... RETURNING e um commit para todas as linhas (rollback se falhar)"""
+        async with db.SessionLocal() as session:
+            # SQLite não garante a ordem do RETURNING em INSERT multi-linha, mas
+            # atribui os ids na ordem do VALUES (escritor único): reordena pelo id
+            sqlite = session.bind.dialect.name == "sqlite"
+            result = await session.scalars(
+                insert(self.model).returning(
+                    self.model, sort_by_parameter_order=not sqlite),
+                values)
+            rows = result.all()
+            if sqlite:
+                rows.sort(key=lambda row: row.id)
+            if self.after_insert is not None:
+                await self.after_insert(session, rows)
+            await session.commit()
+        return rows
+
+    async def close(self):
+        """Grava o que estiver pendente e espera os lotes em andamento"""
+        self._flush()
+        if self._writes:
+            await asyncio.gather(*self._writes, return_exceptions=True)
+
+
+def _resolve(future: asyncio.Future, result=None, exception: Optional[BaseException] = None):
+    # quem esperava pode ter desistido (requisição cancelada)
+    if future.done():
+        return
+    if exception is not None:
+        future.set_exception(exception)
+    else:
+        future.set_result(result)
+
+
+message_writer = WriteBatcher(models.Message)
+direct_message_writer = WriteBatcher(
+    models.DirectMessage, after_insert=conversations.update_summaries)
@@ -0,0 +1,89 @@
+import asyncio
+import math
+import os
+import time
+from typing import Callable, Dict, List, Optional
+
+# agrupa mensagens de salas movimentadas num único frame (lista JSON/msgpack)
+WS_COALESCE = os.getenv("WS_COALESCE", "false").lower() in ("1", "true", "yes")
+# abaixo dessa taxa (mensagens/s) a entrega é imediata, uma mensagem por frame
+WS_COALESCE_MIN_RATE = float(os.getenv("WS_COALESCE_MIN_RATE", "50"))
+# espera máxima antes de enviar o lote
+WS_COALESCE_MAX_WINDOW_MS = float(os.getenv("WS_COALESCE_MAX_WINDOW_MS", "10"))
+# tamanho máximo do lote; ao atingir, envia na hora
+WS_COALESCE_MAX_BATCH = int(os.getenv("WS_COALESCE_MAX_BATCH", "50"))
+
+# constante de tempo da média móvel da taxa (segundos)
+RATE_TIME_CONSTANT = 1.0
+
+Flush = Callable[[int, object], None]
+
+
+class _RoomState:
+    __slots__ = ("rate", "updated", "pending", "timer")
+
+    def __init__(self, now: float):
+        self.rate = 0.0
+        self.updated = now
+        self.pending: List[dict] = []
+        self.timer: Optional[asyncio.TimerHandle] = None
+
+
+class FrameCoalescer:
+    """Junta as mensagens de uma sala numa janela que se adapta à taxa dela.
+
+    A taxa é uma média móvel exponencial (mensagens/s). Salas abaixo de
+    `min_rate` entregam cada mensagem na hora; acima, a janela é o tempo
+    esperado para juntar `max_batch` mensagens, limitado a `max_window`.
+    `flush(room_id, payload)` recebe um dict (uma mensagem) ou uma lista.
+    """
+
+    def __init__(self, flush: Flush, min_rate: float = WS_COALESCE_MIN_RATE,
+                 max_window_ms: float = WS_COALESCE_MAX_WINDOW_MS,
+                 max_batch: int = WS_COALESCE_MAX_BATCH):
+        self.flush = flush
+        self.min_rate = min_rate
+        self.max_window = max_window_ms / 1000
+        self.max_batch = max_batch
+        self.rooms: Dict[int, _RoomState] = {}
+
+    def rate(self, room_id: int) -> float:
+        state = self.rooms.get(room_id)
+        return state.rate if state else 0.0
+
+    def add(self, room_id: int, message: dict):
+        now = time.monotonic()
+        state = self.rooms.get(room_id)
+        if state is None:
+            state = self.rooms[room_id] = _RoomState(now)
+        state.rate = state.rate * math.exp(-(now - state.updated) / RATE_TIME_CONSTANT) + 1 / RATE_TIME_CONSTANT
+        state.updated = now
+
+        # com lote aberto, a mensagem entra nele para não passar à frente das anteriores
+        if not state.pending and state.rate < self.min_rate:
+            self.flush(room_id, message)
+            return
+
+        state.pending.append(message)
+        if len(state.pending) >= self.max_batch:
+            self._flush(room_id)
+        elif state.timer is None:
+            window = min(self.max_window, self.max_batch / state.rate)
+            state.timer = asyncio.get_running_loop().call_later(window, self._flush, room_id)
+
+    def discard(self, room_id: int):
+        """A sala ficou sem sockets locais: esquece o estado (e o lote pendente)"""
+        state = self.rooms.pop(room_id, None)
+        if state is not None and state.timer is not None:
+            state.timer.cancel()
+
+    def _flush(self, room_id: int):
+        state = self.rooms.get(room_id)
+        if state is None:
+            return
+        if state.timer is not None:
+            state.timer.cancel()
+            state.timer = None
+        batch, state.pending = state.pending, []
+        if batch:
+            self.flush(room_id, batch[0] if len(batch) == 1 else batch)
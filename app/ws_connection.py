@@ -0,0 +1,193 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Set, Union
+
+from fastapi import WebSocket, status
+
+from app.metrics import ws_frames_dropped
+
+try:
+    import orjson
+except ImportError:  # dependência opcional: cai no json da stdlib
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:  # sem msgpack, o subprotocolo binário não é oferecido
+    msgpack = None
+
+logger = logging.getLogger(__name__)
+
+# tamanho da fila de saída de cada socket
+WS_SEND_QUEUE_SIZE = int(os.getenv("WS_SEND_QUEUE_SIZE", "256"))
+# o que fazer quando a fila enche: "drop_oldest" ou "disconnect"
+WS_SLOW_CONSUMER_POLICY = os.getenv("WS_SLOW_CONSUMER_POLICY", "drop_oldest")
+# por quanto tempo, depois de um replay, mensagens ao vivo repetidas são descartadas
+WS_RESUME_DEDUPE_SECONDS = float(os.getenv("WS_RESUME_DEDUPE_SECONDS", "10"))
+
+
+# MARK: - Formatos
+# O cliente escolhe o formato pelo header Sec-WebSocket-Protocol: "msgpack"
+# (frames binários) ou "json" (texto, o padrão quando nada é pedido).
+
+def encode_json(data) -> str:
+    """Mesmo formato do WebSocket.send_json, sem espaços"""
+    if orjson is not None:
+        return orjson.dumps(data).decode()
+    return json.dumps(data, separators=(",", ":"), ensure_ascii=False)
+
+
+def encode_msgpack(data) -> bytes:
+    return msgpack.packb(data, use_bin_type=True)
+
+
+ENCODERS: Dict[str, Callable[[object], Union[str, bytes]]] = {"json": encode_json}
+if msgpack is not None:
+    ENCODERS["msgpack"] = encode_msgpack
+
+
+def negotiate_format(websocket: WebSocket) -> Optional[str]:
+    """Primeiro subprotocolo suportado na ordem de preferência do cliente"""
+    for subprotocol in websocket.scope.get("subprotocols", []):
+        if subprotocol in ENCODERS:
+            return subprotocol
+    return None
+
+
+class Frame:
+    """Payload de uma entrega, serializado no máximo uma vez por formato.
+
+    O mesmo objeto vai para a fila de todos os destinatários; o primeiro socket
+    de cada formato serializa e os demais reaproveitam os mesmos bytes.
+    """
+
+    __slots__ = ("data", "encoded")
+
+    def __init__(self, data):
+        self.data = data
+        self.encoded: Dict[str, Union[str, bytes]] = {}
+
+    def encode(self, fmt: str) -> Union[str, bytes]:
+        payload = self.encoded.get(fmt)
+        if payload is None:
+            payload = self.encoded[fmt] = ENCODERS[fmt](self.data)
+        return payload
+
+
+# ping da aplicação (heartbeat); enviá-lo não conta como sinal de vida
+PING = Frame({"type": "ping"})
+
+
+class Connection:
+    """WebSocket com fila de saída limitada e uma task escritora própria.
+
+    Com `hold=True` a escritora só começa depois de `release`: as mensagens ao
+    vivo ficam na fila enquanto o endpoint monta o replay de uma reconexão.
+    """
+
+    def __init__(self, websocket: WebSocket, fmt: Optional[str] = None, hold: bool = False):
+        self.websocket = websocket
+        self.format = fmt or "json"
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=WS_SEND_QUEUE_SIZE)
+        self.dropped = 0
+        self.closed = False
+        # último sinal de vida: frame recebido do cliente ou envio concluído (usado pelo heartbeat)
+        self.last_seen = time.monotonic()
+        self._released = asyncio.Event()
+        self._replay: List[Frame] = []
+        # ids já enviados no replay (e até quando checar repetições)
+        self._replayed: Optional[Set[int]] = None
+        self._replayed_until = 0.0
+        if not hold:
+            self._released.set()
+        self._writer = asyncio.create_task(self._write_loop())
+
+    def touch(self):
+        self.last_seen = time.monotonic()
+
+    def release(self, replay: List[Frame], replayed_ids: Iterable[int] = ()):
+        """Envia `replay` antes de tudo o que está na fila e libera a entrega ao vivo"""
+        self._replay = replay
+        self._replayed = set(replayed_ids) or None
+        self._replayed_until = time.monotonic() + WS_RESUME_DEDUPE_SECONDS
+        self._released.set()
+
+    def enqueue(self, frame: Frame) -> bool:
+        """Enfileira sem bloquear; aplica a política de consumidor lento"""
+        if self.closed:
+            return False
+        try:
+            self.queue.put_nowait(frame)
+        except asyncio.QueueFull:
+            ws_frames_dropped.inc(1, WS_SLOW_CONSUMER_POLICY)
+            if WS_SLOW_CONSUMER_POLICY == "disconnect":
+                self.close(code=status.WS_1013_TRY_AGAIN_LATER)
+                return False
+            self.queue.get_nowait()
+            self.dropped += 1
+            self.queue.put_nowait(frame)
+        return True
+
+    def _without_replayed(self, frame: Frame) -> Optional[Frame]:
+        """Tira do frame ao vivo as mensagens que o replay já entregou"""
+        if self._replayed is None:
+            return frame
+        if time.monotonic() > self._replayed_until:
+            self._replayed = None
+            return frame
+        data = frame.data
+        # mensagens não têm "type"; acks, erros etc. passam direto
+        if isinstance(data, dict):
+            if "type" not in data and data.get("id") in self._replayed:
+                return None
+            return frame
+        if isinstance(data, list):
+            kept = [item for item in data if item.get("id") not in self._replayed]
+            if len(kept) == len(data):
+                return frame
+            return Frame(kept) if kept else None
+        return frame
+
+    async def _send(self, frame: Frame):
+        payload = frame.encode(self.format)
+        if isinstance(payload, bytes):
+            await self.websocket.send_bytes(payload)
+        else:
+            await self.websocket.send_text(payload)
+        if frame is not PING:
+            self.last_seen = time.monotonic()
+
+    async def _write_loop(self):
+        try:
+            await self._released.wait()
+            replay, self._replay = self._replay, []
+            for frame in replay:
+                await self._send(frame)
+            while True:
+                frame = self._without_replayed(await self.queue.get())
+                if frame is not None:
+                    await self._send(frame)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            # socket quebrado: o loop de recepção do endpoint faz a limpeza
+            self.closed = True
+
+    def stop(self):
+        """Encerra a task escritora (o socket já foi fechado pelo cliente)"""
+        self.closed = True
+        self._writer.cancel()
+
+    def close(self, code: int = status.WS_1000_NORMAL_CLOSURE):
+        """Derruba a conexão pelo lado do servidor"""
+        self.stop()
+        asyncio.create_task(self._close(code))
+
+    async def _close(self, code: int):
+        try:
+            await self.websocket.close(code=code)
+        except Exception:
+            logger.debug("Falha ao fechar websocket", exc_info=True)
@@ -0,0 +1,175 @@
+import json
+import logging
+from typing import Optional
+
+from fastapi import WebSocketDisconnect, status
+from pydantic import ValidationError
+from sqlalchemy import select
+
+from app import db, models, schemas
+from app.connection_manager import manager
+from app.dm_connection_manager import dm_manager
+from app.membership import membership
+from app.presence import presence
+from app.rate_limit import check_message_rate
+from app.routers.messages import save_direct_message
+from app.routers.rooms import save_message
+from app.ws_connection import Connection, Frame, msgpack
+
+logger = logging.getLogger(__name__)
+
+# resposta ao {"type": "ping"} do cliente; o {"type": "pong"} dele só renova o last_seen
+PONG = Frame({"type": "pong"})
+
+
+def parse_frame(raw: str) -> Optional[dict]:
+    """Frames que não são um objeto JSON são ignorados (ex.: keepalive em texto)"""
+    try:
+        data = json.loads(raw)
+    except ValueError:
+        return None
+    return data if isinstance(data, dict) else None
+
+
+def parse_binary_frame(raw: bytes) -> Optional[dict]:
+    """Frames binários vêm de clientes no subprotocolo msgpack"""
+    if msgpack is None:
+        return None
+    try:
+        data = msgpack.unpackb(raw, raw=False)
+    except (ValueError, TypeError, msgpack.UnpackException):
+        return None
+    return data if isinstance(data, dict) else None
+
+
+async def receive_frame(connection: Connection) -> Optional[dict]:
+    """Próximo frame do cliente, em texto (JSON) ou binário (msgpack)"""
+    message = await connection.websocket.receive()
+    if message["type"] == "websocket.disconnect":
+        raise WebSocketDisconnect(message.get("code", 1000), message.get("reason"))
+    # qualquer frame, até os ignorados, prova que o cliente está vivo
+    connection.touch()
+    if message.get("bytes") is not None:
+        return parse_binary_frame(message["bytes"])
+    return parse_frame(message.get("text") or "")
+
+
+def _reply_error(connection: Connection, client_id, detail: str):
+    connection.enqueue(Frame({"type": "error", "client_id": client_id, "detail": detail}))
+
+
+def _client_ip(connection: Connection) -> Optional[str]:
+    client = connection.websocket.client
+    return client.host if client else None
+
+
+def _reply_rate_limited(connection: Connection, client_id, retry_after: float):
+    connection.enqueue(Frame({
+        "type": "error",
+        "client_id": client_id,
+        "detail": "Muitas mensagens, tente novamente em instantes",
+        "retry_after": round(retry_after, 3),
+    }))
+
+
+def _reply_ack(connection: Connection, client_id, message):
+    connection.enqueue(Frame({
+        "type": "ack",
+        "client_id": client_id,
+        "id": message.id,
+        "timestamp": message.timestamp.isoformat(),
+    }))
+
+
+# MARK: - Room
+
+async def handle_room_frame(connection: Connection, room_id: int, user: models.User, data: dict):
+    kind = data.get("type")
+    if kind == "send":
+        await _send_room_message(connection, room_id, user, data)
+    elif kind == "typing":
+        presence.typing(room_id, user.id)
+    elif kind == "presence":
+        await presence.set_status(room_id, user.id, data.get("status"))
+    elif kind == "ping":
+        connection.enqueue(PONG)
+
+
+async def _send_room_message(connection: Connection, room_id: int, user: models.User, data: dict):
+    """{"type": "send", "client_id": ..., "content": ...} -> grava, difunde e confirma"""
+    client_id = data.get("client_id")
+    try:
+        msg = schemas.MessageCreate.model_validate(data)
+    except ValidationError:
+        _reply_error(connection, client_id, "Mensagem inválida")
+        return
+
+    try:
+        async with db.SessionLocal() as session:
+            # quem saiu, foi removido ou perdeu a sala depois de conectar é desconectado
+            # (cache local: só consulta o banco no primeiro envio ou após invalidação)
+            if not await membership.is_member(session, room_id, user.id):
+                connection.close(code=status.WS_1008_POLICY_VIOLATION)
+                return
+
+            # mesmos limites do POST /rooms/{room_id}/messages, só para membros
+            retry_after = await check_message_rate(user.id, _client_ip(connection), room_id)
+            if retry_after:
+                _reply_rate_limited(connection, client_id, retry_after)
+                return
+
+            message = await save_message(session, room_id, user.id, msg.content)
+    except Exception:
+        logger.exception("Falha ao gravar mensagem da sala %s via websocket", room_id)
+        _reply_error(connection, client_id, "Falha ao enviar mensagem")
+        return
+
+    presence.stop_typing(room_id, user.id)
+    await manager.broadcast(room_id, message=message)
+    _reply_ack(connection, client_id, message)
+
+
+# MARK: - DM
+
+async def handle_dm_frame(connection: Connection, user: models.User, data: dict):
+    kind = data.get("type")
+    if kind == "send":
+        await _send_direct_message(connection, user, data)
+    elif kind == "typing" and isinstance(data.get("receiver_id"), int):
+        await presence.typing_dm(user.id, data["receiver_id"])
+    elif kind == "ping":
+        connection.enqueue(PONG)
+
+
+async def _send_direct_message(connection: Connection, user: models.User, data: dict):
+    """{"type": "send", "client_id": ..., "receiver_id": ..., "content": ...}"""
+    client_id = data.get("client_id")
+    receiver_id = data.get("receiver_id")
+    try:
+        msg = schemas.MessageCreate.model_validate(data)
+    except ValidationError:
+        _reply_error(connection, client_id, "Mensagem inválida")
+        return
+    if not isinstance(receiver_id, int):
+        _reply_error(connection, client_id, "Mensagem inválida")
+        return
+    retry_after = await check_message_rate(user.id, _client_ip(connection))
+    if retry_after:
+        _reply_rate_limited(connection, client_id, retry_after)
+        return
+
+    try:
+        async with db.SessionLocal() as session:
+            receiver = await session.scalar(select(models.User.id).where(
+                models.User.id == receiver_id))
+            if not receiver:
+                _reply_error(connection, client_id, "Usuário de destino não encontrado")
+                return
+            direct_msg = await save_direct_message(session, user.id, receiver_id, msg.content)
+    except Exception:
+        logger.exception("Falha ao gravar DM via websocket")
+        _reply_error(connection, client_id, "Falha ao enviar mensagem")
+        return
+
+    await dm_manager.send_direct_message(receiver_id, message=direct_msg)
+    _reply_ack(connection, client_id, direct_msg)
@@ -0,0 +1,76 @@
+import asyncio
+import logging
+import os
+import time
+from typing import Optional
+
+from fastapi import status
+
+from app.connection_manager import manager
+from app.dm_connection_manager import dm_manager
+from app.metrics import Counter
+from app.presence import presence
+from app.ws_connection import PING
+
+logger = logging.getLogger(__name__)
+
+# intervalo da varredura; com o reaping ligado, sockets quietos por esse tempo recebem {"type": "ping"}
+WS_PING_INTERVAL_SECONDS = float(os.getenv("WS_PING_INTERVAL_SECONDS", "20"))
+# sem frame do cliente nem envio concluído por esse tempo, o socket é derrubado (0 = desligado).
+# Conexões meio abertas já caem pelos pings de protocolo do uvicorn (--ws-ping-interval/--ws-ping-timeout).
+WS_IDLE_TIMEOUT_SECONDS = float(os.getenv("WS_IDLE_TIMEOUT_SECONDS", "0"))
+
+ws_reaped = Counter("chat_ws_reaped_total", "Sockets derrubados por inatividade.", ("kind",))
+
+
+class Heartbeat:
+    """Uma task por processo: renova a presença das salas com sockets locais e,
+    com WS_IDLE_TIMEOUT_SECONDS > 0, pinga sockets quietos e derruba os inativos.
+
+    O reaping é opcional porque clientes que só escutam não respondem ao ping da
+    aplicação; o que derruba TCP meio aberto são os pings de protocolo do uvicorn.
+    """
+
+    def __init__(self, interval: float = WS_PING_INTERVAL_SECONDS,
+                 timeout: float = WS_IDLE_TIMEOUT_SECONDS):
+        self.interval = interval
+        self.timeout = timeout
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.sweep()
+            except Exception:
+                logger.exception("Falha na varredura de heartbeat")
+
+    async def sweep(self):
+        # o TTL do hash de presença (Redis) não expira em salas quietas com gente conectada
+        await presence.refresh()
+        if self.timeout <= 0:
+            return
+        now = time.monotonic()
+        for kind, connection_manager in (("room", manager), ("dm", dm_manager)):
+            for key, connections in list(connection_manager.active_connections.items()):
+                for connection in list(connections):
+                    idle = now - connection.last_seen
+                    if idle >= self.timeout:
+                        ws_reaped.inc(1, kind)
+                        # sai da lista na hora; o endpoint limpa o resto quando o receive terminar
+                        await connection_manager.disconnect(key, connection.websocket)
+                        connection.close(code=status.WS_1001_GOING_AWAY)
+                    elif idle >= self.interval:
+                        connection.enqueue(PING)
+
+
+heartbeat = Heartbeat()
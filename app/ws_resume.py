@@ -0,0 +1,91 @@
+import logging
+import os
+from typing import List, Optional
+
+from sqlalchemy import select
+
+from app import db, models
+from app.connection_manager import manager
+from app.dm_connection_manager import dm_manager
+from app.message_cache import recent_messages
+from app.ws_connection import Connection, Frame
+
+logger = logging.getLogger(__name__)
+
+# acima disso o servidor não faz replay: o cliente pagina pela API REST
+WS_RESUME_MAX_MESSAGES = int(os.getenv("WS_RESUME_MAX_MESSAGES", "500"))
+
+# MARK: - Replay
+# A conexão é registrada no broker (com a escritora segurada) antes da consulta
+# do replay: o que foi gravado antes da consulta vem no replay, o que foi gravado
+# depois chega ao vivo, e o que aparecer nos dois é descartado pela Connection.
+
+
+async def _missed_room_messages(room_id: int, last_seen_id: int) -> Optional[List[dict]]:
+    """Mensagens da sala com id > last_seen_id, ou None se passarem do limite"""
+    # o buffer de mensagens recentes resolve a maioria das reconexões sem ir ao banco;
+    # sala fria não é aquecida aqui: a consulta por faixa abaixo é mais barata que a carga
+    cached = await recent_messages.latest(room_id, recent_messages.per_room, None)
+    if cached is not None:
+        messages, next_cursor = cached
+        if next_cursor is None or messages[0]["id"] <= last_seen_id:
+            missed = [m for m in messages if m["id"] > last_seen_id]
+            return missed if len(missed) <= WS_RESUME_MAX_MESSAGES else None
+
+    # consulta por faixa no índice (room_id, id)
+    async with db.SessionLocal() as session:
+        rows = (await session.scalars(
+            select(models.Message)
+            .where(models.Message.room_id == room_id, models.Message.id > last_seen_id)
+            .order_by(models.Message.id)
+            .limit(WS_RESUME_MAX_MESSAGES + 1))).all()
+    if len(rows) > WS_RESUME_MAX_MESSAGES:
+        return None
+    return [manager.message_to_dict(message=m) for m in rows]
+
+
+async def _missed_direct_messages(user_id: int, last_seen_id: int) -> Optional[List[dict]]:
+    """DMs recebidas com id > last_seen_id (o socket de DM só entrega as recebidas)"""
+    async with db.SessionLocal() as session:
+        rows = (await session.scalars(
+            select(models.DirectMessage)
+            .where(models.DirectMessage.receiver_id == user_id,
+                   models.DirectMessage.id > last_seen_id)
+            .order_by(models.DirectMessage.id)
+            .limit(WS_RESUME_MAX_MESSAGES + 1))).all()
+    if len(rows) > WS_RESUME_MAX_MESSAGES:
+        return None
+    return [dm_manager.direct_message_to_dict(message=m) for m in rows]
+
+
+def _release(connection: Connection, last_seen_id: int, missed: Optional[List[dict]]):
+    if missed is None:
+        # muitas mensagens perdidas: só a entrega ao vivo, e o cliente pagina o resto
+        connection.release([Frame({
+            "type": "resume",
+            "complete": False,
+            "last_seen_id": last_seen_id,
+            "detail": "Mensagens demais desde a desconexão; use o histórico paginado",
+        })])
+        return
+    frames = [Frame(message) for message in missed]
+    frames.append(Frame({"type": "resume", "complete": True, "replayed": len(missed)}))
+    connection.release(frames, (message["id"] for message in missed))
+
+
+async def resume_room(connection: Connection, room_id: int, last_seen_id: int):
+    try:
+        missed = await _missed_room_messages(room_id, last_seen_id)
+    except Exception:
+        logger.exception("Falha no replay da sala %s", room_id)
+        missed = None
+    _release(connection, last_seen_id, missed)
+
+
+async def resume_dm(connection: Connection, user_id: int, last_seen_id: int):
+    try:
+        missed = await _missed_direct_messages(user_id, last_seen_id)
+    except Exception:
+        logger.exception("Falha no replay de DMs do usuário %s", user_id)
+        missed = None
+    _release(connection, last_seen_id, missed)
@@ -0,0 +1,359 @@
+"""Benchmark de carga: fan-out por WebSocket e envio pela API REST.
+
+Sobe `app.main:app` num subprocesso (uvicorn) com SQLite e broker em memória,
+abre N clientes em /ws/rooms/{room_id} e /ws/dm, dispara POST /rooms/{id}/messages
+e POST /messages/direct/{id} nas taxas pedidas e mede a latência de ponta a
+ponta (POST -> frame recebido no socket), a vazão e a memória (RSS) do servidor.
+
+Uso:
+    python benchmarks/ws_load.py --rooms 10 --clients-per-room 200 \\
+        --dm-clients 200 --room-rate 200 --dm-rate 50 --duration 30 \\
+        --output bench.json [--compare bench_anterior.json]
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List, Optional
+
+import httpx
+import websockets
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCH_PREFIX = "bench:"
+
+
+# MARK: - Servidor
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(port: int, workdir: str, extra_env: Dict[str, str]) -> subprocess.Popen:
+    env = dict(os.environ)
+    env.update({
+        "DATABASE_URL": f"sqlite:///{os.path.join(workdir, 'bench.db')}",
+        "BROKER_BACKEND": "memory",
+        "RECENT_MESSAGES_BACKEND": "memory",
+        # o custo do bcrypt não é o que está sendo medido aqui
+        "BCRYPT_ROUNDS": "4",
+        # todos os clientes saem do mesmo IP; use --env para medir com os limites
+        "RATE_LIMIT_ENABLED": "false",
+    })
+    env.update(extra_env)
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app",
+         "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        cwd=ROOT, env=env)
+
+
+async def wait_ready(base_url: str, timeout: float = 30.0, interval: float = 0.1):
+    """Espera o GET /ready responder 200 (banco e broker acessíveis)"""
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient(base_url=base_url) as client:
+        while time.monotonic() < deadline:
+            try:
+                if (await client.get("/ready")).status_code == 200:
+                    return
+            except httpx.TransportError:
+                pass
+            await asyncio.sleep(interval)
+    raise RuntimeError("servidor não ficou pronto a tempo")
+
+
+def rss_bytes(pid: int) -> Optional[int]:
+    try:
+        with open(f"/proc/{pid}/status") as status:
+            for line in status:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        return None
+    return None
+
+
+# MARK: - Clientes
+
+def ws_connect(url: str, token: str, subprotocol: Optional[str]):
+    headers = {"Authorization": f"Bearer {token}"}
+    options = {"max_queue": None}
+    if subprotocol:
+        options["subprotocols"] = [subprotocol]
+    if int(websockets.__version__.split(".")[0]) >= 14:
+        return websockets.connect(url, additional_headers=headers, **options)
+    return websockets.connect(url, extra_headers=headers, **options)
+
+
+def decode(raw):
+    if isinstance(raw, bytes):
+        import msgpack
+
+        return msgpack.unpackb(raw, raw=False)
+    return json.loads(raw)
+
+
+class Stats:
+    def __init__(self):
+        self.latencies: List[float] = []
+        self.post_latencies: List[float] = []
+        self.sent = 0
+        self.delivered = 0
+        self.errors = 0
+        self.rss_samples: List[int] = []
+
+
+async def setup_users(client: httpx.AsyncClient, count: int) -> List[dict]:
+    users = []
+    suffix = random.randrange(1 << 30)
+    for index in range(count):
+        username = f"bench_{suffix}_{index}"
+        response = await client.post("/users/", json={"username": username, "password": "bench"})
+        response.raise_for_status()
+        login = await client.post("/users/login", data={"username": username, "password": "bench"})
+        login.raise_for_status()
+        users.append({"id": response.json()["id"], "token": login.json()["access_token"]})
+    return users
+
+
+async def setup_rooms(client: httpx.AsyncClient, users: List[dict], count: int) -> List[int]:
+    owner = {"Authorization": f"Bearer {users[0]['token']}"}
+    suffix = random.randrange(1 << 30)
+    room_ids = []
+    for index in range(count):
+        response = await client.post("/rooms/", json={"name": f"bench_{suffix}_{index}"}, headers=owner)
+        response.raise_for_status()
+        room_id = response.json()["id"]
+        room_ids.append(room_id)
+        for user in users[1:]:
+            headers = {"Authorization": f"Bearer {user['token']}"}
+            (await client.post(f"/rooms/{room_id}/enter", headers=headers)).raise_for_status()
+    return room_ids
+
+
+async def listen(url: str, token: str, subprotocol: Optional[str], stats: Stats,
+                 ready: asyncio.Event, stop: asyncio.Event):
+    async with ws_connect(url, token, subprotocol) as ws:
+        ready.set()
+        while not stop.is_set():
+            try:
+                raw = await asyncio.wait_for(ws.recv(), timeout=0.5)
+            except asyncio.TimeoutError:
+                continue
+            now = time.time()
+            try:
+                data = decode(raw)
+            except ValueError:
+                continue  # texto de boas-vindas da sala
+            frames = data if isinstance(data, list) else [data]
+            for frame in frames:
+                content = frame.get("content") if isinstance(frame, dict) else None
+                if isinstance(content, str) and content.startswith(BENCH_PREFIX):
+                    stats.latencies.append(now - float(content[len(BENCH_PREFIX):]))
+                    stats.delivered += 1
+
+
+async def drive(client: httpx.AsyncClient, rate: float, duration: float, make_request, stats: Stats):
+    """Dispara requisições em taxa constante (sem esperar a anterior terminar)"""
+    if rate <= 0:
+        return
+    interval = 1.0 / rate
+    pending = set()
+    start = time.monotonic()
+    sent = 0
+    while time.monotonic() - start < duration:
+        method_url, kwargs = make_request()
+        kwargs["json"] = {"content": f"{BENCH_PREFIX}{time.time()}"}
+        task = asyncio.create_task(_timed_post(client, method_url, kwargs, stats))
+        pending.add(task)
+        task.add_done_callback(pending.discard)
+        sent += 1
+        delay = start + sent * interval - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+    if pending:
+        await asyncio.gather(*pending, return_exceptions=True)
+
+
+async def _timed_post(client: httpx.AsyncClient, url: str, kwargs: dict, stats: Stats):
+    started = time.perf_counter()
+    try:
+        response = await client.post(url, **kwargs)
+        if response.status_code >= 400:
+            stats.errors += 1
+            return
+    except httpx.HTTPError:
+        stats.errors += 1
+        return
+    stats.post_latencies.append(time.perf_counter() - started)
+    stats.sent += 1
+
+
+async def sample_rss(pid: int, stats: Stats, stop: asyncio.Event):
+    while not stop.is_set():
+        rss = rss_bytes(pid)
+        if rss is not None:
+            stats.rss_samples.append(rss)
+        await asyncio.sleep(0.5)
+
+
+# MARK: - Relatório
+
+def percentiles(values: List[float]) -> Dict[str, Optional[float]]:
+    if not values:
+        return {"p50": None, "p95": None, "p99": None, "max": None}
+    ordered = sorted(values)
+
+    def pick(q: float) -> float:
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    return {"p50": pick(0.50), "p95": pick(0.95), "p99": pick(0.99), "max": ordered[-1]}
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "HEAD"], cwd=ROOT, text=True, stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(current: dict, baseline: dict):
+    """Imprime a variação das métricas principais em relação a um resultado anterior"""
+    keys = [
+        ("delivery_latency_s", "p50"), ("delivery_latency_s", "p95"), ("delivery_latency_s", "p99"),
+        ("post_latency_s", "p50"), ("post_latency_s", "p99"),
+        ("throughput", "delivered_per_s"), ("server_rss_bytes", "peak"),
+    ]
+    print(f"\nComparação com {baseline.get('git_commit') or 'baseline'}:")
+    for group, key in keys:
+        old = baseline["results"].get(group, {}).get(key)
+        new = current["results"].get(group, {}).get(key)
+        if old is None or new is None:
+            continue
+        change = (new - old) / old * 100 if old else 0.0
+        print(f"  {group}.{key}: {old:.6g} -> {new:.6g} ({change:+.1f}%)")
+
+
+async def run(args) -> dict:
+    port = args.port or _free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    ws_url = f"ws://127.0.0.1:{port}"
+    extra_env = dict(item.split("=", 1) for item in args.env)
+
+    with tempfile.TemporaryDirectory() as workdir:
+        server = start_server(port, workdir, extra_env)
+        try:
+            await wait_ready(base_url)
+            limits = httpx.Limits(max_connections=args.http_connections)
+            async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=30) as client:
+                users = await setup_users(client, args.users)
+                room_ids = await setup_rooms(client, users, args.rooms)
+
+                stats = Stats()
+                stop = asyncio.Event()
+                listeners = []
+                readies = []
+                for room_id in room_ids:
+                    for index in range(args.clients_per_room):
+                        user = users[index % len(users)]
+                        ready = asyncio.Event()
+                        readies.append(ready)
+                        listeners.append(asyncio.create_task(listen(
+                            f"{ws_url}/ws/rooms/{room_id}", user["token"], args.subprotocol, stats, ready, stop)))
+                for index in range(args.dm_clients):
+                    user = users[index % len(users)]
+                    ready = asyncio.Event()
+                    readies.append(ready)
+                    listeners.append(asyncio.create_task(listen(
+                        f"{ws_url}/ws/dm", user["token"], args.subprotocol, stats, ready, stop)))
+                await asyncio.wait_for(asyncio.gather(*(r.wait() for r in readies)), timeout=120)
+                rss_idle = rss_bytes(server.pid)
+
+                def room_request():
+                    user = random.choice(users)
+                    return (f"/rooms/{random.choice(room_ids)}/messages",
+                            {"headers": {"Authorization": f"Bearer {user['token']}"}})
+
+                def dm_request():
+                    sender, receiver = random.sample(users, 2)
+                    return (f"/messages/direct/{receiver['id']}",
+                            {"headers": {"Authorization": f"Bearer {sender['token']}"}})
+
+                sampler = asyncio.create_task(sample_rss(server.pid, stats, stop))
+                started = time.monotonic()
+                await asyncio.gather(
+                    drive(client, args.room_rate, args.duration, room_request, stats),
+                    drive(client, args.dm_rate, args.duration, dm_request, stats),
+                )
+                # tempo para as últimas entregas chegarem
+                await asyncio.sleep(args.drain)
+                elapsed = time.monotonic() - started
+                stop.set()
+                await asyncio.gather(*listeners, sampler, return_exceptions=True)
+        finally:
+            server.terminate()
+            server.wait(timeout=10)
+
+    return {
+        "git_commit": git_commit(),
+        "timestamp": time.time(),
+        "config": {key: value for key, value in vars(args).items() if key not in ("output", "compare")},
+        "results": {
+            "sockets": len(listeners),
+            "posted": stats.sent,
+            "post_errors": stats.errors,
+            "delivered": stats.delivered,
+            "delivery_latency_s": percentiles(stats.latencies),
+            "post_latency_s": percentiles(stats.post_latencies),
+            "throughput": {
+                "posted_per_s": stats.sent / elapsed,
+                "delivered_per_s": stats.delivered / elapsed,
+            },
+            "server_rss_bytes": {
+                "idle_with_sockets": rss_idle,
+                "peak": max(stats.rss_samples) if stats.rss_samples else None,
+                "mean": statistics.mean(stats.rss_samples) if stats.rss_samples else None,
+            },
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rooms", type=int, default=5)
+    parser.add_argument("--clients-per-room", type=int, default=100)
+    parser.add_argument("--dm-clients", type=int, default=50)
+    parser.add_argument("--users", type=int, default=20, help="usuários criados (sockets são distribuídos entre eles)")
+    parser.add_argument("--room-rate", type=float, default=50, help="POST /rooms/{id}/messages por segundo")
+    parser.add_argument("--dm-rate", type=float, default=10, help="POST /messages/direct/{id} por segundo")
+    parser.add_argument("--duration", type=float, default=10, help="segundos de carga")
+    parser.add_argument("--drain", type=float, default=2, help="segundos de espera após a carga")
+    parser.add_argument("--subprotocol", choices=["json", "msgpack"], help="formato pedido pelos sockets")
+    parser.add_argument("--http-connections", type=int, default=100)
+    parser.add_argument("--port", type=int, default=0)
+    parser.add_argument("--env", action="append", default=[], metavar="CHAVE=VALOR",
+                        help="variável extra para o servidor (ex.: MESSAGE_WRITE_BEHIND=true)")
+    parser.add_argument("--output", default="bench_results.json")
+    parser.add_argument("--compare", help="JSON de uma execução anterior para comparar")
+    args = parser.parse_args()
+
+    result = asyncio.run(run(args))
+    with open(args.output, "w") as output:
+        json.dump(result, output, indent=2)
+    print(json.dumps(result["results"], indent=2))
+    if args.compare:
+        with open(args.compare) as baseline:
+            compare(result, json.load(baseline))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+import asyncio
+from logging.config import fileConfig
+
+from alembic import context
+
+from app import models  # noqa: F401  (registra as tabelas em Base.metadata)
+from app.db import DATABASE_URL, Base, make_engine
+
+config = context.config
+if config.config_file_name is not None:
+    fileConfig(config.config_file_name)
+
+target_metadata = Base.metadata
+
+
+def _include_object(obj, name, type_, reflected, compare_to):
+    # índices de busca (FTS5 / tsvector) são criados por app.search.search_ddl, fora dos modelos
+    if type_ == "table" and reflected and "_fts" in name:
+        return False
+    if type_ == "column" and name == "search_vector":
+        return False
+    return True
+
+
+def _run_migrations(connection):
+    # render_as_batch: o SQLite não altera colunas/constraints no lugar
+    context.configure(
+        connection=connection,
+        target_metadata=target_metadata,
+        include_object=_include_object,
+        render_as_batch=connection.dialect.name == "sqlite",
+    )
+    with context.begin_transaction():
+        context.run_migrations()
+
+
+async def run_migrations_online():
+    engine = make_engine(config.get_main_option("sqlalchemy.url") or DATABASE_URL, "migrations")
+    async with engine.connect() as connection:
+        await connection.run_sync(_run_migrations)
+    await engine.dispose()
+
+
+if context.is_offline_mode():
+    context.configure(url=config.get_main_option("sqlalchemy.url") or DATABASE_URL,
+                      target_metadata=target_metadata, literal_binds=True)
+    with context.begin_transaction():
+        context.run_migrations()
+else:
+    asyncio.run(run_migrations_online())
@@ -0,0 +1,90 @@
+"""schema inicial (o que o create_all da primeira versão criava)
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0001"
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # bancos criados pelo create_all da primeira versão não têm alembic_version:
+    # as tabelas que já existem são adotadas como estão e o upgrade segue para a 0002
+    existing = set(sa.inspect(op.get_bind()).get_table_names())
+    if "users" not in existing:
+        _create_users()
+    if "rooms" not in existing:
+        _create_rooms()
+    if "user_rooms" not in existing:
+        _create_user_rooms()
+    if "messages" not in existing:
+        _create_messages()
+    if "direct_messages" not in existing:
+        _create_direct_messages()
+
+
+def _create_users():
+    op.create_table(
+        "users",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("username", sa.String(), nullable=False, unique=True),
+        sa.Column("hashed_password", sa.String(), nullable=False),
+    )
+    op.create_index("ix_users_id", "users", ["id"])
+
+
+def _create_rooms():
+    op.create_table(
+        "rooms",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("name", sa.String(), nullable=False, unique=True),
+        sa.Column("owner_id", sa.Integer(), sa.ForeignKey("users.id"), nullable=False),
+    )
+    op.create_index("ix_rooms_id", "rooms", ["id"])
+
+
+def _create_user_rooms():
+    op.create_table(
+        "user_rooms",
+        sa.Column("user_id", sa.Integer(), sa.ForeignKey("users.id"), primary_key=True),
+        sa.Column("room_id", sa.Integer(), sa.ForeignKey("rooms.id"), primary_key=True),
+    )
+
+
+def _create_messages():
+    op.create_table(
+        "messages",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("content", sa.Text(), nullable=False),
+        sa.Column("timestamp", sa.DateTime()),
+        sa.Column("user_id", sa.Integer(), sa.ForeignKey("users.id")),
+        sa.Column("room_id", sa.Integer(), sa.ForeignKey("rooms.id")),
+    )
+    op.create_index("ix_messages_id", "messages", ["id"])
+
+
+def _create_direct_messages():
+    op.create_table(
+        "direct_messages",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("sender_id", sa.Integer(), sa.ForeignKey("users.id")),
+        sa.Column("receiver_id", sa.Integer(), sa.ForeignKey("users.id")),
+        sa.Column("content", sa.Text(), nullable=False),
+        sa.Column("timestamp", sa.DateTime()),
+    )
+    op.create_index("ix_direct_messages_id", "direct_messages", ["id"])
+
+
+def downgrade():
+    op.drop_table("direct_messages")
+    op.drop_table("messages")
+    op.drop_table("user_rooms")
+    op.drop_table("rooms")
+    op.drop_table("users")
@@ -0,0 +1,121 @@
+"""índices de paginação/busca, contador de membros, conversas e busca textual
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from app.search import search_ddl
+
+
+revision = "0002"
+down_revision = "0001"
+branch_labels = None
+depends_on = None
+
+SEARCH_TABLES = ("messages", "direct_messages")
+
+# par ordenado (menor id, maior id) de uma DM, igual a app.conversations.user_pair
+_USER_A = "CASE WHEN sender_id < receiver_id THEN sender_id ELSE receiver_id END"
+_USER_B = "CASE WHEN sender_id < receiver_id THEN receiver_id ELSE sender_id END"
+
+
+def upgrade():
+    dialect = op.get_bind().dialect.name
+
+    # MARK: - Salas
+    op.add_column("rooms", sa.Column("member_count", sa.Integer(), nullable=False, server_default="0"))
+    op.execute("UPDATE rooms SET member_count = "
+               "(SELECT COUNT(*) FROM user_rooms WHERE user_rooms.room_id = rooms.id)")
+    op.create_index("ix_rooms_name_pattern", "rooms", ["name"],
+                    postgresql_ops={"name": "text_pattern_ops"})
+    op.create_index("ix_user_rooms_room_id", "user_rooms", ["room_id"])
+
+    # MARK: - Mensagens
+    op.create_index("ix_messages_room_id_id", "messages", ["room_id", "id"])
+    op.create_index("ix_messages_room_id_timestamp", "messages", ["room_id", "timestamp"])
+
+    # MARK: - Conversas
+    op.create_table(
+        "conversations",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("user_a_id", sa.Integer(), sa.ForeignKey("users.id"), nullable=False),
+        sa.Column("user_b_id", sa.Integer(), sa.ForeignKey("users.id"), nullable=False),
+        sa.Column("last_message_id", sa.Integer()),
+        sa.Column("last_message_at", sa.DateTime()),
+        sa.UniqueConstraint("user_a_id", "user_b_id", name="uq_conversations_users"),
+    )
+    op.create_index("ix_conversations_id", "conversations", ["id"])
+    op.create_index("ix_conversations_user_a_id_last_message_id", "conversations",
+                    ["user_a_id", "last_message_id"])
+    op.create_index("ix_conversations_user_b_id_last_message_id", "conversations",
+                    ["user_b_id", "last_message_id"])
+
+    with op.batch_alter_table("direct_messages") as batch:
+        batch.add_column(sa.Column("conversation_id", sa.Integer()))
+        batch.create_foreign_key("fk_direct_messages_conversation_id", "conversations",
+                                 ["conversation_id"], ["id"])
+
+    # uma conversa por par que já trocou mensagens, com o resumo apontando para a última
+    op.execute(f"""
+        INSERT INTO conversations (user_a_id, user_b_id, last_message_id)
+        SELECT {_USER_A}, {_USER_B}, MAX(id) FROM direct_messages GROUP BY 1, 2
+    """)
+    op.execute("""
+        UPDATE conversations SET last_message_at =
+            (SELECT timestamp FROM direct_messages WHERE direct_messages.id = conversations.last_message_id)
+    """)
+    op.execute(f"""
+        UPDATE direct_messages SET conversation_id = (
+            SELECT conversations.id FROM conversations
+            WHERE conversations.user_a_id = {_USER_A} AND conversations.user_b_id = {_USER_B})
+    """)
+    op.create_index("ix_direct_messages_conversation_id_id", "direct_messages", ["conversation_id", "id"])
+    op.create_index("ix_direct_messages_receiver_id_id", "direct_messages", ["receiver_id", "id"])
+    op.create_index("ix_direct_messages_sender_id_id", "direct_messages", ["sender_id", "id"])
+
+    # MARK: - Usuários
+    # por último: o batch do SQLite reflete as tabelas e não entende índices de expressão
+    if dialect == "postgresql":
+        op.execute("CREATE INDEX ix_users_username_lower ON users (lower(username) text_pattern_ops)")
+    else:
+        op.execute("CREATE INDEX ix_users_username_lower ON users (lower(username))")
+
+    # MARK: - Busca
+    for table in SEARCH_TABLES:
+        for statement in search_ddl(table, dialect):
+            op.execute(statement)
+        if dialect == "sqlite":
+            # o FTS5 de conteúdo externo só indexa o que já existe após um rebuild
+            op.execute(f"INSERT INTO {table}_fts({table}_fts) VALUES ('rebuild')")
+
+
+def downgrade():
+    dialect = op.get_bind().dialect.name
+
+    for table in SEARCH_TABLES:
+        if dialect == "postgresql":
+            op.drop_index(f"ix_{table}_search_vector", table_name=table)
+            op.drop_column(table, "search_vector")
+        elif dialect == "sqlite":
+            for trigger in ("insert", "delete", "update"):
+                op.execute(f"DROP TRIGGER IF EXISTS {table}_fts_{trigger}")
+            op.execute(f"DROP TABLE IF EXISTS {table}_fts")
+
+    op.drop_index("ix_direct_messages_sender_id_id", table_name="direct_messages")
+    op.drop_index("ix_direct_messages_receiver_id_id", table_name="direct_messages")
+    op.drop_index("ix_direct_messages_conversation_id_id", table_name="direct_messages")
+    with op.batch_alter_table("direct_messages") as batch:
+        batch.drop_constraint("fk_direct_messages_conversation_id", type_="foreignkey")
+        batch.drop_column("conversation_id")
+    op.drop_table("conversations")
+
+    op.drop_index("ix_messages_room_id_timestamp", table_name="messages")
+    op.drop_index("ix_messages_room_id_id", table_name="messages")
+    op.drop_index("ix_users_username_lower", table_name="users")
+    op.drop_index("ix_user_rooms_room_id", table_name="user_rooms")
+    op.drop_index("ix_rooms_name_pattern", table_name="rooms")
+    with op.batch_alter_table("rooms") as batch:
+        batch.drop_column("member_count")
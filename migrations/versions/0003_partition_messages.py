@@ -0,0 +1,117 @@
+"""particiona messages e direct_messages por mês (Postgres) e indexa timestamp
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-18
+"""
+from datetime import datetime
+
+from alembic import op
+import sqlalchemy as sa
+
+from app.partitions import (
+    PARTITION_MONTHS_AHEAD, PARTITIONED_TABLES, create_partition_sql, default_partition_sql,
+    month_start, months_between, next_month,
+)
+from app.search import search_ddl
+
+
+revision = "0003"
+down_revision = "0002"
+branch_labels = None
+depends_on = None
+
+_COLUMNS = {
+    "messages": """
+        id INTEGER NOT NULL DEFAULT nextval('messages_id_seq'),
+        content TEXT NOT NULL,
+        timestamp TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+        user_id INTEGER REFERENCES users (id),
+        room_id INTEGER REFERENCES rooms (id)""",
+    "direct_messages": """
+        id INTEGER NOT NULL DEFAULT nextval('direct_messages_id_seq'),
+        conversation_id INTEGER CONSTRAINT fk_direct_messages_conversation_id REFERENCES conversations (id),
+        sender_id INTEGER REFERENCES users (id),
+        receiver_id INTEGER REFERENCES users (id),
+        content TEXT NOT NULL,
+        timestamp TIMESTAMP WITHOUT TIME ZONE NOT NULL""",
+}
+
+_COLUMN_NAMES = {
+    "messages": ("id", "content", "timestamp", "user_id", "room_id"),
+    "direct_messages": ("id", "conversation_id", "sender_id", "receiver_id", "content", "timestamp"),
+}
+
+# índices dos modelos, recriados na tabela nova (no Postgres propagam para as partições)
+_INDEXES = {
+    "messages": [
+        ("ix_messages_id", ["id"]),
+        ("ix_messages_room_id_id", ["room_id", "id"]),
+        ("ix_messages_room_id_timestamp", ["room_id", "timestamp"]),
+    ],
+    "direct_messages": [
+        ("ix_direct_messages_id", ["id"]),
+        ("ix_direct_messages_conversation_id_id", ["conversation_id", "id"]),
+        ("ix_direct_messages_receiver_id_id", ["receiver_id", "id"]),
+        ("ix_direct_messages_sender_id_id", ["sender_id", "id"]),
+    ],
+}
+
+
+def _rebuild_postgres(table: str, partitioned: bool):
+    """Recria a tabela (particionada ou não) e copia as linhas da antiga"""
+    old = f"{table}_old"
+    op.execute(f"ALTER TABLE {table} RENAME TO {old}")
+    op.execute(f"ALTER TABLE {old} RENAME CONSTRAINT {table}_pkey TO {old}_pkey")
+    for name, _ in _INDEXES[table] + [(f"ix_{table}_timestamp", None), (f"ix_{table}_search_vector", None)]:
+        op.execute(f"DROP INDEX IF EXISTS {name}")
+    # a sequência do id pertence à coluna antiga; sem isso cairia junto com ela
+    op.execute(f"ALTER SEQUENCE {table}_id_seq OWNED BY NONE")
+
+    if partitioned:
+        # a chave de partição precisa fazer parte da PK
+        op.execute(f"CREATE TABLE {table} ({_COLUMNS[table]}, PRIMARY KEY (id, timestamp)) "
+                   f"PARTITION BY RANGE (timestamp)")
+        oldest = op.get_bind().execute(sa.text(f"SELECT min(timestamp) FROM {old}")).scalar()
+        last = month_start(datetime.utcnow())
+        for _ in range(PARTITION_MONTHS_AHEAD):
+            last = next_month(last)
+        for start in months_between(oldest or datetime.utcnow(), last):
+            op.execute(create_partition_sql(table, start))
+        op.execute(default_partition_sql(table))
+    else:
+        op.execute(f"CREATE TABLE {table} ({_COLUMNS[table]}, PRIMARY KEY (id))")
+
+    for statement in search_ddl(table, "postgresql"):
+        op.execute(statement)
+    for name, columns in _INDEXES[table]:
+        op.create_index(name, table, columns)
+    op.create_index(f"ix_{table}_timestamp", table, ["timestamp"])
+
+    columns = _COLUMN_NAMES[table]
+    # linhas sem timestamp (não deveriam existir) vão para o mês mais antigo possível
+    values = ", ".join("COALESCE(timestamp, TIMESTAMP '1970-01-01')" if column == "timestamp" else column
+                       for column in columns)
+    op.execute(f"INSERT INTO {table} ({', '.join(columns)}) SELECT {values} FROM {old}")
+    op.execute(f"ALTER SEQUENCE {table}_id_seq OWNED BY {table}.id")
+    op.execute(f"DROP TABLE {old}")
+
+
+def upgrade():
+    dialect = op.get_bind().dialect.name
+    for table in PARTITIONED_TABLES:
+        if dialect == "postgresql":
+            _rebuild_postgres(table, partitioned=True)
+        else:
+            # SQLite: tabela única; o segmento mensal é a faixa neste índice
+            op.create_index(f"ix_{table}_timestamp", table, ["timestamp"])
+
+
+def downgrade():
+    dialect = op.get_bind().dialect.name
+    for table in PARTITIONED_TABLES:
+        if dialect == "postgresql":
+            _rebuild_postgres(table, partitioned=False)
+            op.drop_index(f"ix_{table}_timestamp", table_name=table)
+        else:
+            op.drop_index(f"ix_{table}_timestamp", table_name=table)
@@ -0,0 +1,26 @@
+import os
+import tempfile
+
+# banco SQLite descartável e backends em memória, antes de qualquer import de app.*
+_database = os.path.join(tempfile.mkdtemp(prefix="chat-tests-"), "chat.db")
+os.environ["DATABASE_URL"] = f"sqlite:///{_database}"
+os.environ["BROKER_BACKEND"] = "memory"
+os.environ["RATE_LIMIT_ENABLED"] = "false"
+
+import pytest
+from fastapi.testclient import TestClient
+
+
+@pytest.fixture(scope="session")
+def client():
+    from app.main import app
+
+    with TestClient(app) as test_client:
+        yield test_client
+
+
+@pytest.fixture(scope="session")
+def auth_headers(client):
+    client.post("/users/", json={"username": "tester", "password": "secret"})
+    token = client.post("/users/login", data={"username": "tester", "password": "secret"}).json()["access_token"]
+    return {"Authorization": f"Bearer {token}"}
@@ -0,0 +1,31 @@
+from app import models
+from app.conversations import user_pair
+from app.db import SessionLocal
+
+
+def _user_id(client, auth_headers, username):
+    client.post("/users/", json={"username": username, "password": "x"})
+    found = client.get("/users/search", params={"q": username}, headers=auth_headers).json()
+    return next(user["id"] for user in found if user["username"] == username)
+
+
+def test_conversation_without_messages_is_not_listed(client, auth_headers):
+    tester_id = _user_id(client, auth_headers, "tester")
+    talked_id = _user_id(client, auth_headers, "conversa_com_msg")
+    empty_id = _user_id(client, auth_headers, "conversa_vazia")
+    client.post(f"/messages/direct/{talked_id}", json={"content": "oi"}, headers=auth_headers)
+
+    async def create_empty_conversation():
+        # sobra de um envio cujo lote falhou: a conversa existe, o resumo não
+        user_a_id, user_b_id = user_pair(tester_id, empty_id)
+        async with SessionLocal() as db:
+            db.add(models.Conversation(user_a_id=user_a_id, user_b_id=user_b_id))
+            await db.commit()
+
+    client.portal.call(create_empty_conversation)
+
+    page = client.get("/messages/conversations", headers=auth_headers).json()
+
+    listed = [conversation["other_user_id"] for conversation in page["conversations"]]
+    assert talked_id in listed
+    assert empty_id not in listed
@@ -0,0 +1,17 @@
+import pytest
+
+
+@pytest.mark.parametrize("q", [" ", "   ", "\t"])
+def test_blank_query_is_rejected(client, auth_headers, q):
+    response = client.get("/search/messages", params={"q": q}, headers=auth_headers)
+    assert response.status_code == 422
+
+
+def test_query_finds_room_message(client, auth_headers):
+    room_id = client.post("/rooms/", json={"name": "busca"}, headers=auth_headers).json()["id"]
+    client.post(f"/rooms/{room_id}/messages", json={"content": "olá mundo"}, headers=auth_headers)
+
+    response = client.get("/search/messages", params={"q": " mundo "}, headers=auth_headers)
+
+    assert response.status_code == 200
+    assert [hit["content"] for hit in response.json()["hits"]] == ["olá mundo"]
@@ -0,0 +1,50 @@
+import asyncio
+
+import pytest
+
+from app.broker import broker
+from app.user_index import USER_INDEX_CHANNEL, UserDirectoryIndex
+
+
+class _PublishingSession:
+    """Sessão falsa: durante o SELECT da carga, outro worker anuncia mudanças"""
+
+    def __init__(self, rows, published):
+        self.rows = rows
+        self.published = published
+
+    async def execute(self, statement):
+        for message in self.published:
+            await broker.publish(USER_INDEX_CHANNEL, message)
+        return self.rows
+
+
+@pytest.fixture
+def index(monkeypatch):
+    # o canal tem um handler por processo: devolve o do índice global ao final
+    monkeypatch.setattr(broker, "handlers", dict(broker.handlers))
+    return UserDirectoryIndex()
+
+
+def test_changes_published_during_load_are_applied(index):
+    session = _PublishingSession(
+        rows=[(1, "Ana"), (2, "bob")],
+        published=[
+            {"op": "add", "id": 3, "username": "anabel"},
+            {"op": "remove", "id": 2, "username": "bob"},
+            # já está no snapshot: reaplicar não duplica
+            {"op": "add", "id": 1, "username": "Ana"},
+        ])
+
+    results = asyncio.run(index.search(session, "", 10))
+
+    assert results == [{"id": 1, "username": "Ana"}, {"id": 3, "username": "anabel"}]
+
+
+def test_changes_after_load_are_applied(index):
+    async def scenario():
+        await index.search(_PublishingSession(rows=[(1, "Ana")], published=[]), "a", 10)
+        await broker.publish(USER_INDEX_CHANNEL, {"op": "add", "id": 2, "username": "Anx"})
+        return await index.search(None, "an", 10)
+
+    assert asyncio.run(scenario()) == [{"id": 1, "username": "Ana"}, {"id": 2, "username": "Anx"}]
@@ -0,0 +1,29 @@
+import pytest
+
+from app.routers import users
+
+
+@pytest.fixture
+def sql_search(monkeypatch):
+    # caminho SQL do autocomplete (o índice em memória é o padrão no SQLite)
+    monkeypatch.setattr(users, "USER_INDEX_IN_MEMORY", False)
+
+
+@pytest.mark.parametrize("name", ["Ana_Maria", "ana%", "anaZ"])
+def test_sql_search_matches_prefix(client, auth_headers, sql_search, name):
+    client.post("/users/", json={"username": name, "password": "x"})
+
+    response = client.get("/users/search", params={"q": name.lower()}, headers=auth_headers)
+
+    assert response.status_code == 200
+    assert name in [user["username"] for user in response.json()]
+
+
+def test_sql_search_prefix_ending_in_last_code_point(client, auth_headers, sql_search):
+    name = "x\U0010ffff"
+    client.post("/users/", json={"username": name, "password": "x"})
+
+    response = client.get("/users/search", params={"q": name}, headers=auth_headers)
+
+    assert response.status_code == 200
+    assert [user["username"] for user in response.json()] == [name]
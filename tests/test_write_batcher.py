@@ -0,0 +1,22 @@
+import asyncio
+
+from app import models
+from app.write_batcher import WriteBatcher
+
+
+def test_bad_row_fails_alone(client):
+    # window longo: as três linhas caem no mesmo lote
+    writer = WriteBatcher(models.DirectMessage, window_ms=50, max_size=100)
+
+    async def scenario():
+        return await asyncio.gather(
+            writer.insert(dict(sender_id=1, receiver_id=1, content="antes")),
+            writer.insert(dict(sender_id=1, receiver_id=1, content=None)),  # NOT NULL
+            writer.insert(dict(sender_id=1, receiver_id=1, content="depois")),
+            return_exceptions=True)
+
+    before, bad, after = client.portal.call(scenario)
+
+    assert isinstance(bad, Exception)
+    assert (before.content, after.content) == ("antes", "depois")
+    assert before.id < after.id
@@ -3,7 +3,6 @@ set -e
 
 host="$1"
 shift
-cmd="$@"
 
 until pg_isready -h "$host" -U "$POSTGRES_USER" -d "${POSTGRES_DB:-postgres}"; do
   >&2 echo "Aguardando o banco de dados em $host..."
@@ -11,4 +10,4 @@ until pg_isready -h "$host" -U "$POSTGRES_USER" -d "${POSTGRES_DB:-postgres}"; d
 done
 
 >&2 echo "Banco de dados disponível — iniciando API!"
-exec $cmd
+exec "$@"